@@ -0,0 +1,68 @@
+"""
+Measures the per-event overhead of the checks done by FastTracer.
+
+Run from the repository root:
+
+    python misc/tracer_bench.py
+"""
+
+import os.path
+import sys
+import timeit
+
+from thonny.common import ToplevelCommand
+from thonny.plugins.cpython_backend.cp_tracers import FastTracer
+
+CALL_COUNT = 1_000_000
+REPEATS = 7
+
+
+def get_frame():
+    return sys._getframe()
+
+
+def get_library_frame():
+    namespace = {"sys": sys}
+    path = os.path.join(sys.prefix, "lib", "some_library.py")
+    exec(compile("def get_frame():\n    return sys._getframe()\n", path, "exec"), namespace)
+    return namespace["get_frame"]()
+
+
+def report(title, fun):
+    best = min(timeit.repeat(fun, number=CALL_COUNT, repeat=REPEATS))
+    print("  %s: %.1f ns" % (title, best / CALL_COUNT * 1e9))
+
+
+def bench_breakpoint_check():
+    print("Breakpoint check per traced line")
+    frame = get_frame()
+    code = frame.f_code
+    scenarios = [
+        ("no breakpoints", {}),
+        ("breakpoints in another file", {"/elsewhere/other.py": {1, 2, 3}}),
+        ("breakpoint in the same code", {code.co_filename: {code.co_firstlineno}}),
+    ]
+
+    for title, breakpoints in scenarios:
+        tracer = FastTracer(None, ToplevelCommand("FastDebug", breakpoints=breakpoints))
+        # the same check is done for every line event of the command
+        check = tracer._cmd_resume_completed
+        report(title, lambda: check(frame))
+
+
+def bench_frame_classification():
+    print("Frame classification per call event")
+    tracer = FastTracer(None, ToplevelCommand("FastDebug", breakpoints={}))
+    # pretend that this script is the program being debugged
+    tracer._main_module_path = __file__
+    for title, frame in [("library code", get_library_frame()), ("user code", get_frame())]:
+        report(title, lambda: tracer._is_interesting_frame(frame))
+
+
+def main():
+    bench_breakpoint_check()
+    bench_frame_classification()
+
+
+if __name__ == "__main__":
+    main()
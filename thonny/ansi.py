@@ -0,0 +1,106 @@
+"""
+Incremental splitting of terminal output into text runs and control sequences.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+# characters which may start a control sequence
+CONTROL_START_REGEX = re.compile(r"[\x1B\a\b\r]")
+CSI_PARAMS_REGEX = re.compile(r"[0-?]*[ -/]*")
+CSI_TERMINATOR_REGEX = re.compile(r"[@-~]")
+OSC_TERMINATOR_REGEX = re.compile(r"\a|\x1B\\")
+
+# longer incomplete sequences are given up and shown as text
+MAX_PENDING_LENGTH = 4096
+
+TEXT = "text"
+CONTROL = "control"
+
+
+class AnsiSplitter:
+    """Splits the chunks of an output stream into text runs and control sequences.
+
+    An escape sequence at the end of a chunk may be incomplete. It is kept until next chunk
+    (or flush) instead of waiting for the rest of it. Text between two control sequences is
+    returned as one run, so that it can be inserted with one style.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, data: str) -> List[Tuple[str, str]]:
+        """Returns a list of (kind, data) pairs, where kind is TEXT or CONTROL"""
+        return self._split(self._pending + data, final=False)
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """Gives up waiting for the rest of an incomplete sequence"""
+        return self._split(self._pending, final=True)
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def _split(self, data: str, final: bool) -> List[Tuple[str, str]]:
+        self._pending = ""
+
+        result = []
+        text_start = 0
+        pos = 0
+        while True:
+            match = CONTROL_START_REGEX.search(data, pos)
+            if match is None:
+                break
+
+            start = match.start()
+            end = _find_control_end(data, start)
+            if end is None and not final and len(data) - start <= MAX_PENDING_LENGTH:
+                self._pending = data[start:]
+                data = data[:start]
+                break
+            elif end is None or end == -1:
+                # not a (complete) control sequence, leave the ESC into the text
+                pos = start + 1
+            else:
+                if text_start < start:
+                    result.append((TEXT, data[text_start:start]))
+                result.append((CONTROL, data[start:end]))
+                text_start = pos = end
+
+        if text_start < len(data):
+            result.append((TEXT, data[text_start:]))
+
+        return result
+
+
+def _find_control_end(data: str, start: int) -> Optional[int]:
+    """Returns the end of the control sequence starting at start, None if the data ends before
+    the sequence is complete or -1 if it is not a known control sequence."""
+    if data[start] != "\x1b":
+        return start + 1
+
+    if start + 1 == len(data):
+        return None
+
+    introducer = data[start + 1]
+    if introducer == "[":
+        params_end = CSI_PARAMS_REGEX.match(data, start + 2).end()
+        if params_end == len(data):
+            return None
+        elif CSI_TERMINATOR_REGEX.match(data, params_end):
+            return params_end + 1
+        else:
+            return -1
+
+    elif introducer == "]":
+        # OSC needs at least one character before the terminator and can't span lines
+        match = OSC_TERMINATOR_REGEX.search(data, start + 3)
+        newline_pos = data.find("\n", start + 2)
+        if newline_pos != -1 and (match is None or newline_pos < match.start()):
+            return -1
+        elif match is None:
+            return None
+        else:
+            return match.end()
+
+    else:
+        return -1
@@ -18,6 +18,7 @@ from thonny.common import (  # TODO: try to get rid of this
     INTERNAL_ERROR_STATUS_CODE,
     IGNORED_FILES_AND_DIRS,
     PROCESS_ACK,
+    WIRE_CODEC_REPR,
     BackendEvent,
     CommandToBackend,
     EOFCommand,
@@ -52,6 +53,8 @@ class BaseBackend(ABC):
         self._interrupt_lock = threading.Lock()
         self._last_progress_reporting_time: float = 0
         self._last_sent_output = ""
+        # Frontend may ask for a faster codec, see WIRE_CODEC_FRAMED
+        self._wire_codec = WIRE_CODEC_REPR
         self._init_command_reader()
 
     def _init_command_reader(self):
@@ -193,7 +196,7 @@ class BaseBackend(ABC):
                 return InlineResponse(command_name=command.name, **args)
 
     def send_message(self, msg: MessageFromBackend) -> None:
-        sys.stdout.write(serialize_message(msg) + "\n")
+        sys.stdout.write(serialize_message(msg, codec=self._wire_codec) + "\n")
         sys.stdout.flush()
 
     def _send_output(self, data, stream_name):
@@ -256,6 +259,8 @@ class MainBackend(BaseBackend, ABC):
 
     def __init__(self):
         self._command_handlers = {}
+        # ids of the commands which should be skipped, see cancel_command
+        self._cancelled_command_ids = set()
         BaseBackend.__init__(self)
 
     def add_command(self, command_name, handler):
@@ -266,10 +271,20 @@ class MainBackend(BaseBackend, ABC):
         """
         self._command_handlers[command_name] = handler
 
+    def _cancel_command(self, cmd: ImmediateCommand) -> None:
+        """Makes the backend skip the given command, unless it has been started already"""
+        self._cancelled_command_ids.add(cmd["command_id"])
+
     def _handle_normal_command(self, cmd: CommandToBackend) -> None:
         assert isinstance(cmd, (ToplevelCommand, InlineCommand))
         logger.debug("Command: %r", cmd)
 
+        if isinstance(cmd, InlineCommand) and cmd.get("id") in self._cancelled_command_ids:
+            logger.info("Skipping cancelled command %r", cmd.name)
+            self._cancelled_command_ids.discard(cmd["id"])
+            self.send_message(self._prepare_command_response({"cancelled": True}, cmd))
+            return
+
         if cmd.name in self._command_handlers:
             handler = self._command_handlers[cmd.name]
         else:
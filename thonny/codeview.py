@@ -7,12 +7,13 @@ import sys
 import time
 import tkinter as tk
 from logging import getLogger
-from tkinter import messagebox
+from tkinter import messagebox, ttk
 from typing import Dict, Union  # @UnusedImport
 
 from thonny import get_workbench, roughparse, tktextext, ui_utils
 from thonny.common import TextRange
 from thonny.languages import tr
+from thonny.misc_utils import running_on_mac_os
 from thonny.tktextext import EnhancedText
 from thonny.ui_utils import EnhancedTextWithLogging, ask_string, compute_tab_stops
 
@@ -177,8 +178,17 @@ class CodeView(tktextext.EnhancedTextFrame):
         self._last_toggle_breakpoint_time = 0
         self._gutter.bind("<Button-1>", self._start_toggle_breakpoint, True)
         self._gutter.bind("<ButtonRelease-1>", self._consider_toggle_breakpoint, True)
+        if running_on_mac_os():
+            self._gutter.bind("<Button-2>", self._edit_breakpoint_options, True)
+        else:
+            self._gutter.bind("<Button-3>", self._edit_breakpoint_options, True)
         # self.text.tag_configure("breakpoint_line", background="pink")
         self._gutter.tag_configure("breakpoint", foreground="crimson")
+        # conditional breakpoints and logpoints
+        self._gutter.tag_configure("breakpoint_with_options", foreground="darkorange")
+        # Options follow their lines via marks. Mark name -> options.
+        self._breakpoint_options = {}
+        self._breakpoint_options_mark_counter = 0
 
         editor_font = tk.font.nametofont("EditorFont")
         spacer_font = editor_font.copy()
@@ -280,6 +290,7 @@ class CodeView(tktextext.EnhancedTextFrame):
 
         self.text.direct_delete("1.0", tk.END)
         self.text.direct_insert("1.0", content)
+        self._remove_breakpoint_options("1.0", tk.END)
 
         if not keep_undo:
             self.text.edit_reset()
@@ -302,6 +313,7 @@ class CodeView(tktextext.EnhancedTextFrame):
 
         if self.text.tag_nextrange("breakpoint_line", start_index, end_index):
             self.text.tag_remove("breakpoint_line", start_index, end_index)
+            self._remove_breakpoint_options(start_index, end_index)
         else:
             line_content = self.text.get(start_index, end_index).strip()
             if line_content and line_content[0] != "#":
@@ -310,6 +322,57 @@ class CodeView(tktextext.EnhancedTextFrame):
         self.update_gutter(clean=True)
         self._last_toggle_breakpoint_time = time.time()
 
+    def _edit_breakpoint_options(self, event):
+        index = self.text.index("@%d,%d linestart" % (event.x, event.y))
+        lineno = int(index.split(".")[0]) - self._first_line_number + 1
+        line_content = self.text.get(index, index + " lineend").strip()
+        if not line_content or line_content[0] == "#":
+            return
+
+        dlg = BreakpointOptionsDialog(
+            self.winfo_toplevel(), lineno, self.get_breakpoint_options(lineno)
+        )
+        ui_utils.show_dialog(dlg, self.winfo_toplevel())
+        if dlg.result is not None:
+            self.set_breakpoint(lineno, dlg.result)
+
+    def set_breakpoint(self, lineno, options=None):
+        """Options may contain condition, hit_count and log_message"""
+        start_index = "%d.0" % (self._first_line_number + lineno - 1)
+        end_index = start_index + " lineend"
+        self._remove_breakpoint_options(start_index, end_index)
+        self.text.tag_add("breakpoint_line", start_index, end_index)
+
+        if options:
+            self._breakpoint_options_mark_counter += 1
+            mark_name = "breakpoint_options_%d" % self._breakpoint_options_mark_counter
+            self.text.mark_set(mark_name, start_index)
+            self.text.mark_gravity(mark_name, tk.LEFT)
+            self._breakpoint_options[mark_name] = options
+
+        self.update_gutter(clean=True)
+
+    def get_breakpoint_options(self, lineno):
+        return self.get_breakpoint_options_by_line().get(lineno, {})
+
+    def get_breakpoint_options_by_line(self):
+        result = {}
+        for mark_name, options in self._breakpoint_options.items():
+            index = self.text.index(mark_name + " linestart")
+            # the line may have been deleted together with its breakpoint
+            if self.text.tag_nextrange("breakpoint_line", index, index + " lineend"):
+                result[int(index.split(".")[0]) - self._first_line_number + 1] = options
+        return result
+
+    def _remove_breakpoint_options(self, start_index, end_index):
+        start_line = int(self.text.index(start_index).split(".")[0])
+        end_line = int(self.text.index(end_index).split(".")[0])
+        for mark_name in list(self._breakpoint_options):
+            mark_line = int(self.text.index(mark_name).split(".")[0])
+            if start_line <= mark_line <= end_line:
+                self.text.mark_unset(mark_name)
+                del self._breakpoint_options[mark_name]
+
     def _clean_selection(self):
         self.text.tag_remove("sel", "1.0", "end")
         self._gutter.tag_remove("sel", "1.0", "end")
@@ -330,7 +393,13 @@ class CodeView(tktextext.EnhancedTextFrame):
             yield str(lineno), ()
 
             if self.text.tag_nextrange("breakpoint_line", linestart, linestart + " lineend"):
-                yield BREAKPOINT_SYMBOL, ("breakpoint",)
+                if self._breakpoint_options and any(
+                    self.text.compare(mark_name + " linestart", "==", linestart)
+                    for mark_name in self._breakpoint_options
+                ):
+                    yield BREAKPOINT_SYMBOL, ("breakpoint", "breakpoint_with_options")
+                else:
+                    yield BREAKPOINT_SYMBOL, ("breakpoint",)
             else:
                 yield " ", ()
 
@@ -402,6 +471,79 @@ class CodeView(tktextext.EnhancedTextFrame):
             self._gutter.tag_configure("breakpoint", _syntax_options["breakpoint"])
 
 
+class BreakpointOptionsDialog(ui_utils.CommonDialogEx):
+    def __init__(self, master, lineno, options):
+        super().__init__(master)
+        self.result = None
+
+        margin = self.get_large_padding()
+        spacing = margin // 2
+
+        self.title(tr("Breakpoint at line %d") % lineno)
+
+        self._condition_var = tk.StringVar(value=options.get("condition") or "")
+        self._hit_count_var = tk.StringVar(value=str(options.get("hit_count") or ""))
+        self._log_message_var = tk.StringVar(value=options.get("log_message") or "")
+
+        for row, (label, var, hint) in enumerate(
+            [
+                (
+                    tr("Condition"),
+                    self._condition_var,
+                    tr("Stop only when this expression is true"),
+                ),
+                (tr("Hit count"), self._hit_count_var, tr("Stop only from this hit onwards")),
+                (
+                    tr("Log message"),
+                    self._log_message_var,
+                    tr("Print this instead of stopping. Use {expression} for values"),
+                ),
+            ]
+        ):
+            ttk.Label(self.main_frame, text=label).grid(
+                row=row * 2, column=0, sticky="w", padx=(margin, spacing), pady=(margin, 0)
+            )
+            entry = ttk.Entry(self.main_frame, textvariable=var, width=40)
+            entry.grid(
+                row=row * 2, column=1, columnspan=2, sticky="we", padx=(0, margin), pady=(margin, 0)
+            )
+            entry.bind("<Return>", self._on_ok, True)
+            entry.bind("<KP_Enter>", self._on_ok, True)
+            if row == 0:
+                entry.focus_set()
+            ttk.Label(self.main_frame, text=hint).grid(
+                row=row * 2 + 1, column=1, columnspan=2, sticky="w", padx=(0, margin)
+            )
+
+        self._error_label = ttk.Label(self.main_frame, foreground="red")
+        self._error_label.grid(row=6, column=0, columnspan=3, sticky="w", padx=margin)
+
+        ok_button = ttk.Button(
+            self.main_frame, text=tr("OK"), command=self._on_ok, default="active"
+        )
+        ok_button.grid(row=7, column=1, padx=(0, spacing), pady=margin, sticky="e")
+        cancel_button = ttk.Button(self.main_frame, text=tr("Cancel"), command=self.on_close)
+        cancel_button.grid(row=7, column=2, padx=(0, margin), pady=margin, sticky="e")
+        self.main_frame.columnconfigure(1, weight=1)
+
+    def _on_ok(self, event=None):
+        hit_count = self._hit_count_var.get().strip()
+        if hit_count and (not hit_count.isdigit() or int(hit_count) < 1):
+            self._error_label.configure(text=tr("Hit count must be a positive integer"))
+            return
+
+        result = {}
+        if self._condition_var.get().strip():
+            result["condition"] = self._condition_var.get().strip()
+        if hit_count:
+            result["hit_count"] = int(hit_count)
+        if self._log_message_var.get().strip():
+            result["log_message"] = self._log_message_var.get().strip()
+
+        self.result = result
+        self.destroy()
+
+
 def set_syntax_options(syntax_options):
     global _syntax_options
     _syntax_options = syntax_options
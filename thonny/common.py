@@ -5,7 +5,9 @@ Classes used both by front-end and back-end
 """
 from __future__ import annotations
 
+import base64
 import dataclasses
+import json
 import os.path
 import site
 import sys
@@ -19,6 +21,9 @@ logger = getLogger(__name__)
 STRING_PSEUDO_FILENAME = "<string>"
 REPL_PSEUDO_FILENAME = "<stdin>"
 MESSAGE_MARKER = "\x02"
+FRAME_MARKER = "\x01"
+WIRE_CODEC_REPR = "repr"
+WIRE_CODEC_FRAMED = "framed"
 OBJECT_LINK_START = "[ide_object_link=%d]"
 OBJECT_LINK_END = "[/ide_object_link]"
 PROCESS_ACK = "OK"
@@ -248,7 +253,15 @@ class InlineResponse(MessageFromBackend):
         self.event_type = self.command_name + "_response"
 
 
-def serialize_message(msg: Record, max_line_length=65536) -> str:
+def serialize_message(msg: Record, max_line_length=65536, codec: str = WIRE_CODEC_REPR) -> str:
+    if codec == WIRE_CODEC_FRAMED:
+        try:
+            return _serialize_message_framed(msg)
+        except (TypeError, ValueError):
+            # Some value has no tagged representation (eg. a custom object put into a response
+            # by a plug-in). The reader understands both formats, so fall back for this message.
+            logger.debug("Could not frame %s, falling back to repr", type(msg).__name__)
+
     # I want to transfer only ASCII chars because encodings are not reliable
     # (eg. can't find a way to specify PYTHONIOENCODING for cx_freeze'd program)
     # The possibility for splitting message into several lines is required because of
@@ -267,6 +280,7 @@ def serialize_message(msg: Record, max_line_length=65536) -> str:
 # Include all Record subclasses that appear in serialized messages so eval can reconstruct them.
 _SAFE_EVAL_GLOBALS: Dict[str, Any] = {
     "nan": float("nan"),
+    "inf": float("inf"),
     "None": None,
     "True": True,
     "False": False,
@@ -279,6 +293,9 @@ _SAFE_EVAL_GLOBALS: Dict[str, Any] = {
     "set": set,
     "bytes": bytes,
     "Ellipsis": Ellipsis,
+    "ValueInfo": ValueInfo,
+    "FrameInfo": FrameInfo,
+    "TextRange": TextRange,
     # Command/response types serialized over the frontend-backend pipe
     "InputSubmission": InputSubmission,
     "CommandToBackend": CommandToBackend,
@@ -298,6 +315,9 @@ _SAFE_EVAL_GLOBALS: Dict[str, Any] = {
 
 def parse_message(msg_string: str) -> Record:
     """Parse a serialized message from the backend. Uses restricted eval (no __builtins__)."""
+    if msg_string[0] == FRAME_MARKER:
+        return _parse_message_framed(msg_string)
+
     assert msg_string[0] == MESSAGE_MARKER
     assert msg_string.strip().endswith(")")
     msg_start = msg_string.index(" ")
@@ -307,6 +327,113 @@ def parse_message(msg_string: str) -> Record:
     return eval(payload, _SAFE_EVAL_GLOBALS, {})  # nosec B307 - restricted globals, no __builtins__
 
 
+# Framed codec
+# ------------
+# A frame is a single line: FRAME_MARKER, payload length, space, payload.
+# The payload is ASCII-only JSON where the values JSON can't represent faithfully are
+# wrapped into objects tagged with _TAG_KEY. Decoding is done by the C-accelerated json
+# parser and never evaluates code. The length header allows the reader to detect frames
+# which were cut or interleaved with raw output of the user's subprocesses.
+_TAG_KEY = "\u0000"
+
+_FRAMED_RECORD_CLASSES: Dict[str, type] = {
+    name: value
+    for name, value in _SAFE_EVAL_GLOBALS.items()
+    if isinstance(value, type) and issubclass(value, Record)
+}
+
+_FRAMED_NAMEDTUPLES: Dict[str, Any] = {
+    "V": ValueInfo,
+    "F": FrameInfo,
+    "T": TextRange,
+}
+_FRAMED_NAMEDTUPLE_TAGS = {cls: tag for tag, cls in _FRAMED_NAMEDTUPLES.items()}
+
+
+def _encode_framed_value(value: Any) -> Any:
+    value_type = type(value)
+    if value_type is str or value_type is int or value_type is float or value_type is bool:
+        return value
+    elif value is None:
+        return None
+    elif value_type is list:
+        return [_encode_framed_value(item) for item in value]
+    elif value_type is dict:
+        if _TAG_KEY not in value and all(type(key) is str for key in value):
+            return {key: _encode_framed_value(item) for key, item in value.items()}
+        else:
+            return {
+                _TAG_KEY: "d",
+                "v": [[_encode_framed_value(k), _encode_framed_value(v)] for k, v in value.items()],
+            }
+    elif value_type is tuple:
+        return {_TAG_KEY: "t", "v": [_encode_framed_value(item) for item in value]}
+    elif value_type in _FRAMED_NAMEDTUPLE_TAGS:
+        return {
+            _TAG_KEY: _FRAMED_NAMEDTUPLE_TAGS[value_type],
+            "v": [_encode_framed_value(item) for item in value],
+        }
+    elif _FRAMED_RECORD_CLASSES.get(value_type.__name__) is value_type:
+        return {
+            _TAG_KEY: "R",
+            "c": value_type.__name__,
+            "v": {key: _encode_framed_value(item) for key, item in value.__dict__.items()},
+        }
+    elif value_type is set:
+        return {_TAG_KEY: "s", "v": [_encode_framed_value(item) for item in value]}
+    elif value_type is bytes:
+        return {_TAG_KEY: "b", "v": base64.b64encode(value).decode("ascii")}
+    elif value is Ellipsis:
+        return {_TAG_KEY: "E"}
+    else:
+        raise TypeError(f"Can't frame value of type {value_type.__name__}")
+
+
+def _decode_framed_object(obj: Dict[str, Any]) -> Any:
+    tag = obj.get(_TAG_KEY)
+    if tag is None:
+        return obj
+    elif tag == "t":
+        return tuple(obj["v"])
+    elif tag == "R":
+        record_class = _FRAMED_RECORD_CLASSES[obj["c"]]
+        # bypass __init__, the fields are restored as they were
+        record = record_class.__new__(record_class)
+        record.__dict__.update(obj["v"])
+        return record
+    elif tag in _FRAMED_NAMEDTUPLES:
+        return _FRAMED_NAMEDTUPLES[tag](*obj["v"])
+    elif tag == "d":
+        return {key: value for key, value in obj["v"]}
+    elif tag == "s":
+        return set(obj["v"])
+    elif tag == "b":
+        return base64.b64decode(obj["v"])
+    elif tag == "E":
+        return Ellipsis
+    else:
+        raise ValueError(f"Unknown frame tag {tag!r}")
+
+
+def _serialize_message_framed(msg: Record) -> str:
+    payload = json.dumps(_encode_framed_value(msg), separators=(",", ":"))
+    return FRAME_MARKER + str(len(payload)) + " " + payload
+
+
+def _parse_message_framed(msg_string: str) -> Record:
+    msg_string = msg_string.rstrip("\r\n")
+    payload_start = msg_string.index(" ") + 1
+    payload_length = int(msg_string[1 : payload_start - 1])
+    payload = msg_string[payload_start:]
+    if len(payload) != payload_length:
+        raise ValueError(f"Frame length mismatch: expected {payload_length}, got {len(payload)}")
+
+    result = json.loads(payload, object_hook=_decode_framed_object)
+    if not isinstance(result, Record):
+        raise ValueError("Frame does not contain a message")
+    return result
+
+
 def normpath_with_actual_case(name: str) -> str:
     """In Windows return the path with the case it is stored in the filesystem"""
     if not os.path.exists(name):
@@ -763,6 +890,10 @@ def read_one_incoming_message_str(line_reader):
     if msg_str == "":
         return ""
 
+    if msg_str.startswith(FRAME_MARKER):
+        # frames are always single line
+        return msg_str
+
     if not msg_str.startswith(MESSAGE_MARKER):
         return msg_str
 
@@ -1522,6 +1522,19 @@ def get_current_breakpoints():
     return result
 
 
+def get_current_breakpoint_options():
+    """Conditions, hit counts and log messages of the breakpoints which have them"""
+    result = {}
+
+    for editor in get_workbench().get_editor_notebook().get_all_editors():
+        if editor.is_local():
+            options_by_line = editor.get_code_view().get_breakpoint_options_by_line()
+            if options_by_line:
+                result[editor.get_target_path()] = options_by_line
+
+    return result
+
+
 def get_saved_current_script_path(force=True):
     editor = get_workbench().get_editor_notebook().get_current_editor()
     if not editor:
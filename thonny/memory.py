@@ -23,6 +23,10 @@ def parse_object_id(object_id_repr):
     return int(object_id_repr, base=16)
 
 
+def _variable_sort_key(name):
+    return name.startswith("_"), name
+
+
 class MemoryFrame(TreeFrame):
     def __init__(self, master, columns, show_statusbar=False, consider_heading_stripe=True):
         TreeFrame.__init__(
@@ -112,18 +116,41 @@ class VariablesFrame(MemoryFrame):
                 node_id = self.tree.insert("", "end", tags=("group_title",))
                 self.tree.set(node_id, "name", group_title)
 
-            for name in sorted(variables.keys(), key=lambda x: (x.startswith("_"), x)):
+            for name in sorted(variables.keys(), key=_variable_sort_key):
                 node_id = self.tree.insert("", "end", tags="item")
                 self.tree.set(node_id, "name", name)
-                if isinstance(variables[name], ValueInfo):
-                    description = variables[name].repr
-                    id_str = variables[name].id
-                else:
-                    description = variables[name]
-                    id_str = None
-
-                self.tree.set(node_id, "id", format_object_id(id_str))
-                self.tree.set(node_id, "value", description)
+                self._set_variable_value(node_id, variables[name])
+
+    def patch_variables(self, changed, removed):
+        """Updates the rows of an ungrouped variable list shown by update_variables"""
+        node_ids = {self.tree.set(iid, "name"): iid for iid in self.tree.get_children()}
+
+        for name in removed:
+            if name in node_ids:
+                self.tree.delete(node_ids.pop(name))
+
+        added = False
+        for name in changed:
+            if name not in node_ids:
+                node_ids[name] = self.tree.insert("", "end", tags="item")
+                self.tree.set(node_ids[name], "name", name)
+                added = True
+            self._set_variable_value(node_ids[name], changed[name])
+
+        if added:
+            for i, name in enumerate(sorted(node_ids.keys(), key=_variable_sort_key)):
+                self.tree.move(node_ids[name], "", i)
+
+    def _set_variable_value(self, node_id, value):
+        if isinstance(value, ValueInfo):
+            description = value.repr
+            id_str = value.id
+        else:
+            description = value
+            id_str = None
+
+        self.tree.set(node_id, "id", format_object_id(id_str))
+        self.tree.set(node_id, "value", description)
 
     def on_select(self, event):
         self.show_selected_object_info()
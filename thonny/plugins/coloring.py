@@ -3,7 +3,8 @@ Each text will get its on SyntaxColorer.
 
 For performance reasons, coloring is updated in 2 phases:
     1. recolor single-line tokens on the modified line(s)
-    2. recolor multi-line tokens (triple-quoted strings) in the whole text
+    2. recolor multi-line tokens (triple-quoted strings) from the first modified line
+       until the result agrees with the tags from the previous coloring
 
 First phase may insert wrong tokens inside triple-quoted strings, but the
 priorities of triple-quoted-string tags are higher and therefore user
@@ -21,10 +22,12 @@ from logging import getLogger
 from thonny import get_workbench
 from thonny.codeview import CodeViewText, SyntaxText
 from thonny.shell import ShellText
+from thonny.tktextext import index2line
 
 logger = getLogger(__name__)
 
 TODO = "COLOR_TODO"
+MULTILINE_TODO = "COLOR_MULTILINE_TODO"
 
 
 class SyntaxColorer:
@@ -138,7 +141,7 @@ class SyntaxColorer:
                 start_index = "%d.%d" % (start_row, 0)
                 end_index = "%d.%d" % (end_row + 1, 0)
                 if not event.trivial_for_coloring:
-                    self._multiline_dirty = True
+                    self._mark_multiline_dirty(start_index, end_index)
 
             elif event.sequence == "TextDelete":
                 index = self.text.index(event.index1)
@@ -146,10 +149,13 @@ class SyntaxColorer:
                 start_index = "%d.%d" % (start_row, 0)
                 end_index = "%d.%d" % (start_row + 1, 0)
                 if not event.trivial_for_coloring:
-                    self._multiline_dirty = True
+                    self._mark_multiline_dirty(start_index, end_index)
 
         self.text.tag_add(TODO, start_index, end_index)
 
+    def _mark_multiline_dirty(self, start_index, end_index):
+        self._multiline_dirty = True
+
     def schedule_update(self):
         self._highlight_tabs = get_workbench().get_option("view.highlight_tabs")
         self._use_coloring = get_workbench().get_option("view.syntax_coloring") and (
@@ -228,22 +234,9 @@ class SyntaxColorer:
                 continue
 
             match_start, match_end = match.span()
-            if (
-                token_text.startswith('"""')
-                and not token_text.endswith('"""')
-                or token_text.startswith("'''")
-                and not token_text.endswith("'''")
-                or len(token_text) == 3
-            ):
-                token_type = "open_string3"
-            elif len(token_text) >= 4 and token_text[-4] == "\\":
-                token_type = "open_string3"
-            else:
-                token_type = "string3"
-
             token_start = start + "+%dc" % match_start
             token_end = start + "+%dc" % match_end
-            self.text.tag_add(token_type, token_start, token_end)
+            self.text.tag_add(_get_string3_token_type(token_text), token_start, token_end)
 
         self._multiline_dirty = False
         self._raise_tags()
@@ -259,6 +252,9 @@ class SyntaxColorer:
 
 
 class CodeViewSyntaxColorer(SyntaxColorer):
+    def _mark_multiline_dirty(self, start_index, end_index):
+        self.text.tag_add(MULTILINE_TODO, start_index, end_index)
+
     def _update_coloring(self):
         viewport_start = self.text.index("@0,0")
         viewport_end = self.text.index(
@@ -292,9 +288,11 @@ class CodeViewSyntaxColorer(SyntaxColorer):
             else:
                 search_start = update_end
 
-        # Multiline tokens need to be searched from the whole source
         if self._multiline_dirty:
             self._update_multiline_tokens("1.0", "end")
+            self.text.tag_remove(MULTILINE_TODO, "1.0", "end")
+        elif self._use_coloring:
+            self._update_dirty_multiline_tokens()
 
         # Get rid of wrong open string tags (https://github.com/thonny/thonny/issues/943)
         search_start = viewport_start
@@ -308,6 +306,115 @@ class CodeViewSyntaxColorer(SyntaxColorer):
 
             search_start = tag_range[1]
 
+    def _update_dirty_multiline_tokens(self):
+        """Multiline tokens need to be searched from a line which doesn't start inside a
+        triple-quoted string. The search continues until a line after the modified lines,
+        where both new and old tokens agree that it doesn't start inside a string. The text
+        is read only up to the first line, where this may happen according to old tokens."""
+        first_range = self.text.tag_nextrange(MULTILINE_TODO, "1.0")
+        if not first_range:
+            return
+
+        last_range = self.text.tag_prevrange(MULTILINE_TODO, "end")
+        self.text.tag_remove(MULTILINE_TODO, "1.0", "end")
+        # text from this line on is the same as during previous coloring
+        unchanged_lineno = index2line(self.text.index(last_range[1]))
+
+        lineno = index2line(self.text.index(first_range[0]))
+        while True:
+            tag = self._get_multiline_tag_before("%d.0" % lineno)
+            if tag is None:
+                break
+            token_range = self.text.tag_prevrange(tag, "%d.0" % lineno)
+            lineno = index2line(self.text.index(token_range[0]))
+
+        last_lineno = index2line(self.text.index("end-1c"))
+        cleared_index = "%d.0" % lineno
+        scan_lineno = lineno
+        scan_col = 0
+        prev_token_end_lineno = lineno
+        while True:
+            # Old tokens tell where the coloring may converge. The text needs to be scanned
+            # only up to there, unless a new token starts before it.
+            converged_lineno = self._find_converged_lineno(
+                max(prev_token_end_lineno + 1, unchanged_lineno), last_lineno
+            )
+            if converged_lineno is None:
+                chunk_end_lineno = last_lineno + 1
+            else:
+                chunk_end_lineno = converged_lineno
+
+            while True:
+                chars, offset = self._get_multiline_chars(scan_lineno, "%d.0" % chunk_end_lineno)
+                match = self._search_string3(chars, offset + scan_col)
+                if match is None or match.end() < len(chars) or chunk_end_lineno > last_lineno:
+                    break
+                # the token may continue after the chunk
+                chunk_end_lineno += chunk_end_lineno - scan_lineno
+
+            if match is None:
+                self._remove_multiline_tags(cleared_index, "%d.0" % chunk_end_lineno)
+                break
+
+            converter = _IndexConverter(chars, offset, scan_lineno)
+            start_lineno, start_col = converter.convert(match.start())
+            end_lineno, end_col = converter.convert(match.end())
+            token_end = "%d.%d" % (end_lineno, end_col)
+            self._remove_multiline_tags(cleared_index, token_end)
+            self.text.tag_add(
+                _get_string3_token_type(match.group(1)),
+                "%d.%d" % (start_lineno, start_col),
+                token_end,
+            )
+            cleared_index = token_end
+            prev_token_end_lineno = scan_lineno = end_lineno
+            scan_col = end_col
+
+        self._raise_tags()
+
+    def _get_multiline_chars(self, lineno, end_index):
+        if lineno == 1:
+            return self.text.get("1.0", end_index), 0
+        else:
+            # with the preceding linebreak ^ in MAGIC_COMMAND matches only at the start of the
+            # text, as in the coloring of the whole text
+            return self.text.get("%d.0-1c" % lineno, end_index), 1
+
+    def _search_string3(self, chars, pos):
+        for match in self.multiline_regex.finditer(chars, pos):
+            if match.group(1) is not None:
+                return match
+
+        return None
+
+    def _find_converged_lineno(self, first_lineno, last_lineno):
+        """Returns the first of the given lines, which didn't start inside a multiline token
+        during previous coloring"""
+        lineno = first_lineno
+        while lineno <= last_lineno:
+            tag = self._get_multiline_tag_before("%d.0" % lineno)
+            if tag is None:
+                return lineno
+
+            old_token_range = self.text.tag_prevrange(tag, "%d.0" % lineno)
+            lineno = index2line(self.text.index(old_token_range[1])) + 1
+
+        return None
+
+    def _get_multiline_tag_before(self, index):
+        if index == "1.0":
+            return None
+
+        for tag in self.text.tag_names(index + "-1c"):
+            if tag in self.multiline_tags:
+                return tag
+
+        return None
+
+    def _remove_multiline_tags(self, start, end):
+        for tag in self.multiline_tags:
+            self.text.tag_remove(tag, start, end)
+
 
 class ShellSyntaxColorer(SyntaxColorer):
     def _update_coloring(self):
@@ -327,6 +434,39 @@ class ShellSyntaxColorer(SyntaxColorer):
             self._update_multiline_tokens(start_index, end_index)
 
 
+class _IndexConverter:
+    """Converts increasing offsets in a chunk of text to line numbers and columns"""
+
+    def __init__(self, chars, offset, lineno):
+        self._chars = chars
+        self._offset = offset
+        self._lineno = lineno
+        self._line_start = offset
+
+    def convert(self, offset):
+        newline_count = self._chars.count("\n", self._offset, offset)
+        if newline_count:
+            self._lineno += newline_count
+            self._line_start = self._chars.rfind("\n", self._offset, offset) + 1
+        self._offset = offset
+        return self._lineno, offset - self._line_start
+
+
+def _get_string3_token_type(token_text):
+    if (
+        token_text.startswith('"""')
+        and not token_text.endswith('"""')
+        or token_text.startswith("'''")
+        and not token_text.endswith("'''")
+        or len(token_text) == 3
+    ):
+        return "open_string3"
+    elif len(token_text) >= 4 and token_text[-4] == "\\":
+        return "open_string3"
+    else:
+        return "string3"
+
+
 def update_coloring_on_event(event):
     if hasattr(event, "text_widget"):
         text = event.text_widget
@@ -1,6 +1,7 @@
 # Frontend plugin is in cpython_frontend.py
 import ast
 import builtins
+import collections
 import functools
 import importlib.util
 import inspect
@@ -11,11 +12,13 @@ import re
 import site
 import subprocess
 import sys
+import threading
+import time
 import tokenize
 import traceback
 import types
 import warnings
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import __main__
 import thonny
@@ -26,6 +29,8 @@ from thonny.common import (
     OBJECT_LINK_START,
     REPL_PSEUDO_FILENAME,
     STRING_PSEUDO_FILENAME,
+    WIRE_CODEC_FRAMED,
+    WIRE_CODEC_REPR,
     BackendEvent,
     CommandToBackend,
     DistInfo,
@@ -59,10 +64,76 @@ _REPL_HELPER_NAME = "_thonny_repl_print"
 
 _CONFIG_FILENAME = os.path.join(thonny.get_thonny_user_dir(), "backend_configuration.ini")
 
+# Program output is collected into bigger ProgramOutput events, see OutputCoalescer
+OUTPUT_FLUSH_SIZE = 64 * 1024
+OUTPUT_FLUSH_DEADLINE = 0.02
+
+# Limits for bounded_repr
+REPR_TIME_BUDGET = 0.2
+MAX_REPR_NESTING = 50
+_BOUNDED_REPR_TYPES = {str, bytes, list, tuple, set, frozenset, dict}
+
+# Values of these types can't change without being replaced by another object
+# (subclasses are not included, as these may have mutable state)
+_IMMUTABLE_VALUE_TYPES = {
+    int,
+    float,
+    complex,
+    bool,
+    str,
+    bytes,
+    range,
+    type(None),
+    type,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.ModuleType,
+}
+
+# Values of these types get re-exported in a globals delta only when their length changes
+# (or when the frontend asks for all globals)
+_SIZED_VALUE_TYPES = {list, dict, set, bytearray, collections.deque}
+
+# After these the output of child processes may get mixed with the output of the program
+_PROCESS_HANDOVER_AUDIT_EVENTS = {
+    "subprocess.Popen",
+    "os.system",
+    "os.spawn",
+    "os.posix_spawn",
+    "os.exec",
+    "os.fork",
+    "os.forkpty",
+    "os.startfile",
+}
+
 
 _backend = None
 
 
+def _get_value_signature(value):
+    """Cheap summary of the state of a value for export_globals_delta.
+
+    None means that the value needs to be exported every time. Mutations which keep the
+    length (or shape) of a container don't change its signature, so these get noticed only
+    when the value is mentioned in a shell command or when all globals are requested."""
+    value_type = type(value)
+    if value_type in _IMMUTABLE_VALUE_TYPES:
+        return ()
+
+    try:
+        if value_type in _SIZED_VALUE_TYPES:
+            return len(value)
+
+        # numpy arrays, pandas frames and such
+        shape = getattr(value_type, "shape", None) and value.shape
+        if isinstance(shape, tuple):
+            return shape
+    except Exception:
+        pass
+
+    return None
+
+
 class MainCPythonBackend(MainBackend):
     def __init__(self, target_cwd, options):
         report_time("Before MainBackend")
@@ -74,6 +145,10 @@ class MainCPythonBackend(MainBackend):
 
         self._ini = None
         self._options = options
+        if options.get("wire_codec") == WIRE_CODEC_FRAMED:
+            self._wire_codec = WIRE_CODEC_FRAMED
+        else:
+            self._wire_codec = WIRE_CODEC_REPR
         self._object_info_tweakers = []
         self._warned_shadow_casters = set()
         self._import_handlers = {}
@@ -82,8 +157,18 @@ class MainCPythonBackend(MainBackend):
         self._ast_postprocessors = []
         self._main_dir = os.path.dirname(sys.modules["thonny"].__file__)
         self._heap = {}  # WeakValueDictionary would be better, but can't store reference to None
-        self._source_info_by_frame = {}
+        # Per module: {name: (value, ValueInfo, signature)} as last sent to the frontend,
+        # see export_globals_delta
+        self._globals_fingerprints: Dict[str, Dict[str, Tuple[object, ValueInfo, Any]]] = {}
+        # Names mentioned in the last shell command. These get exported with the next
+        # globals delta even if their signature stays the same.
+        self._names_in_last_command = set()
+        self._globals_versions: Dict[str, int] = {}
+        self._source_info_by_code = {}
         self._init_help()
+        self._output_coalescer = OutputCoalescer(self._write_message)
+        self._install_output_flushing_hooks()
+        self._incoming_line_reader = IncomingLineReader(sys.stdin.fileno())
         self._install_fake_streams()
         self._install_repl_helper()
         self._current_executor = None
@@ -149,7 +234,17 @@ class MainCPythonBackend(MainBackend):
     def _fetch_next_incoming_message(self, timeout=None) -> CommandToBackend:
         # Reading must be done synchronously
         # https://github.com/thonny/thonny/issues/1363
-        self._read_one_incoming_message()
+        while self._incoming_message_queue.empty():
+            # NB! Immediate commands don't end up in the queue
+            if not self._read_one_incoming_message():
+                break
+
+        # Take also the messages which have already arrived. This way a cancel_command
+        # gets noticed before starting the command it cancels.
+        while self._incoming_line_reader.has_line():
+            if not self._read_one_incoming_message():
+                break
+
         return self._incoming_message_queue.get()
 
     def add_object_info_tweaker(self, tweaker):
@@ -170,6 +265,25 @@ class MainCPythonBackend(MainBackend):
     def get_main_module(self):
         return __main__
 
+    def _install_output_flushing_hooks(self):
+        # Child processes inherit the real stdout and os._exit skips atexit handlers,
+        # so the coalesced output must be sent before these happen
+        def flushing_audit_hook(event, args):
+            if event in _PROCESS_HANDOVER_AUDIT_EVENTS:
+                self._output_coalescer.flush()
+
+        sys.addaudithook(flushing_audit_hook)
+
+        original_exit = os._exit
+
+        def flushing_exit(status):
+            try:
+                self._output_coalescer.flush()
+            finally:
+                original_exit(status)
+
+        os._exit = flushing_exit
+
     def import_audit_hook(self, event: str, args):
         if event == "import":
             logger.debug("detected Import event with args %r", args)
@@ -251,7 +365,7 @@ class MainCPythonBackend(MainBackend):
             sys.modules = old_modules
 
     def _read_incoming_msg_line(self) -> str:
-        return self._original_stdin.readline()
+        return self._incoming_line_reader.readline()
 
     def _handle_user_input(self, msg: InputSubmission) -> None:
         self._input_queue.put(msg)
@@ -269,7 +383,7 @@ class MainCPythonBackend(MainBackend):
         logger.debug("Handling normal command %r in cpython_backend", cmd.name)
 
         if isinstance(cmd, ToplevelCommand):
-            self._source_info_by_frame = {}
+            self._source_info_by_code = {}
             self._input_queue = queue.Queue()
 
         super()._handle_normal_command(cmd)
@@ -293,6 +407,11 @@ class MainCPythonBackend(MainBackend):
             with self._interrupt_lock:
                 interrupt_local_process()
         """
+        if cmd.name == "cancel_command":
+            # Gets read before the commands it may cancel are started,
+            # see _fetch_next_incoming_message
+            self._cancel_command(cmd)
+            return
 
         raise NotImplementedError()
 
@@ -431,6 +550,7 @@ class MainCPythonBackend(MainBackend):
             python_version=get_python_version_string(),
             cwd=os.getcwd(),
             logfile=thonny.get_backend_log_file(),
+            wire_codec=self._wire_codec,
         )
 
     def _cmd_cd(self, cmd):
@@ -459,9 +579,12 @@ class MainCPythonBackend(MainBackend):
 
     def _cmd_FastDebug(self, cmd):
         self.switch_env_to_script_mode(cmd)
-        from thonny.plugins.cpython_backend.cp_tracers import FastTracer
+        from thonny.plugins.cpython_backend.cp_tracers import FastTracer, MonitoringFastTracer
 
-        return self._execute_file(cmd, FastTracer)
+        if cmd.get("tracer_engine", "monitoring") == "monitoring" and hasattr(sys, "monitoring"):
+            return self._execute_file(cmd, MonitoringFastTracer)
+        else:
+            return self._execute_file(cmd, FastTracer)
 
     def _cmd_Debug(self, cmd):
         self.switch_env_to_script_mode(cmd)
@@ -491,6 +614,9 @@ class MainCPythonBackend(MainBackend):
             return {}
 
         assert isinstance(root, ast.Module)
+        self._names_in_last_command = {
+            node.id for node in ast.walk(root) if isinstance(node, ast.Name)
+        }
 
         if getattr(cmd, "debug_mode", False):
             from thonny.plugins.cpython_backend.cp_tracers import NiceTracer
@@ -541,10 +667,13 @@ class MainCPythonBackend(MainBackend):
         return {"gui_is_active": False}
 
     def _cmd_get_globals(self, cmd):
-        # warnings.warn("_cmd_get_globals is deprecated for CPython")
+        # Also serves as full resync for the frontends which apply globals deltas
+        self._globals_fingerprints.pop(cmd.module_name, None)
+        delta = self.export_globals_delta(cmd.module_name)
         return dict(
             module_name=cmd.module_name,
-            globals=self.export_globals(cmd.module_name),
+            globals=delta["changed"],
+            globals_version=delta["version"],
         )
 
     def _cmd_get_frame_info(self, cmd):
@@ -579,11 +708,13 @@ class MainCPythonBackend(MainBackend):
         return {"new_state": new_state, "returncode": returncode}
 
     def _cmd_get_locals(self, cmd):
-        for frame in inspect.stack():
-            if id(frame) == cmd.frame_id:
-                return InlineResponse("get_locals", locals=self.export_variables(frame.f_locals))
+        frame, _ = self._lookup_frame_by_id(cmd.frame_id)
+        if frame is None:
+            raise RuntimeError("Frame '{0}' not found".format(cmd.frame_id))
 
-        raise RuntimeError("Frame '{0}' not found".format(cmd.frame_id))
+        return InlineResponse(
+            "get_locals", frame_id=cmd.frame_id, locals=self.export_variables(frame.f_locals)
+        )
 
     def _cmd_get_heap(self, cmd):
         result = {}
@@ -875,28 +1006,39 @@ class MainCPythonBackend(MainBackend):
 
     def send_message(self, msg: MessageFromBackend) -> None:
         report_time(f"Sending message {msg.event_type}")
-        sys.stdout.flush()
 
         if isinstance(msg, ToplevelResponse):
             if "cwd" not in msg:
                 msg["cwd"] = os.getcwd()
-            if "globals" not in msg:
-                msg["globals"] = self.export_globals()
+            if "globals" not in msg and "globals_delta" not in msg:
+                msg["globals_delta"] = self.export_globals_delta()
+
+        with self._output_coalescer.lock:
+            # Input requests, responses and debugger events must come after the output
+            # produced before them
+            self._output_coalescer.flush()
+            self._write_message(msg)
 
-        self._original_stdout.write(serialize_message(msg) + "\n")
+    def _write_message(self, msg: MessageFromBackend) -> None:
+        self._original_stdout.write(serialize_message(msg, codec=self._wire_codec) + "\n")
         self._original_stdout.flush()
 
+    def _send_output(self, data, stream_name):
+        if not data:
+            return
+
+        data = self._transform_output(data, stream_name)
+        self._last_sent_output = data
+        self._output_coalescer.add(data, stream_name)
+
     def export_value(self, value, max_repr_length=5000):
         self._heap[id(value)] = value
         try:
-            rep = repr(value)
+            rep = bounded_repr(value, max_repr_length)
         except Exception:
             # See https://bitbucket.org/plas/thonny/issues/584/problem-with-thonnys-back-end-obj-no
             rep = "??? <repr error>"
 
-        if len(rep) > max_repr_length:
-            rep = rep[:max_repr_length] + "…"
-
         return ValueInfo(id(value), rep)
 
     def export_variables(self, variables, all_variables=False):
@@ -915,6 +1057,66 @@ class MainCPythonBackend(MainBackend):
         else:
             raise RuntimeError("Module '{0}' is not loaded".format(module_name))
 
+    def export_globals_delta(self, module_name="__main__"):
+        """Exports the globals which have been added, changed or removed since the last export.
+
+        Base version 0 means the delta is relative to an empty namespace."""
+        if module_name not in sys.modules:
+            raise RuntimeError("Module '{0}' is not loaded".format(module_name))
+
+        variables = sys.modules[module_name].__dict__
+        if module_name == "__main__":
+            names_to_check = self._names_in_last_command
+            self._names_in_last_command = set()
+        else:
+            names_to_check = set()
+        old_fingerprints = self._globals_fingerprints.get(module_name, {})
+        new_fingerprints = {}
+        changed = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for name in variables:
+                if name.startswith("__"):
+                    continue
+
+                value = variables[name]
+                signature = _get_value_signature(value)
+                old_fingerprint = old_fingerprints.get(name)
+                if (
+                    old_fingerprint is not None
+                    and old_fingerprint[0] is value
+                    and signature is not None
+                    and old_fingerprint[2] == signature
+                    and name not in names_to_check
+                ):
+                    # No need to compute repr.
+                    # Holding the reference guarantees that the id hasn't been reused
+                    new_fingerprints[name] = old_fingerprint
+                    continue
+
+                value_info = self.export_value(value, 100)
+                new_fingerprints[name] = (value, value_info, signature)
+                if old_fingerprint is None or old_fingerprint[1] != value_info:
+                    changed[name] = value_info
+
+        removed = [name for name in old_fingerprints if name not in new_fingerprints]
+
+        if old_fingerprints:
+            base_version = self._globals_versions.get(module_name, 0)
+        else:
+            base_version = 0
+        version = self._globals_versions.get(module_name, 0) + 1
+        self._globals_versions[module_name] = version
+        self._globals_fingerprints[module_name] = new_fingerprints
+
+        return dict(
+            module_name=module_name,
+            base_version=base_version,
+            version=version,
+            changed=changed,
+            removed=removed,
+        )
+
     def _debug(self, *args):
         logger.debug("MainCPythonBackend: " + str(args))
 
@@ -928,6 +1130,8 @@ class MainCPythonBackend(MainBackend):
         return self._io_level > 0
 
     def _export_stack(self, newest_frame, relevance_checker=None):
+        """Variables get exported only for the newest frame. For other frames both locals
+        and globals are None and the frontend needs to ask these with get_frame_info."""
         result = []
 
         system_frame = newest_frame
@@ -952,8 +1156,16 @@ class MainCPythonBackend(MainBackend):
                         filename=system_frame.f_code.co_filename,
                         module_name=module_name,
                         code_name=code_name,
-                        locals=self.export_variables(system_frame.f_locals),
-                        globals=self.export_variables(system_frame.f_globals),
+                        locals=(
+                            self.export_variables(system_frame.f_locals)
+                            if system_frame is newest_frame
+                            else None
+                        ),
+                        globals=(
+                            self.export_variables(system_frame.f_globals)
+                            if system_frame is newest_frame
+                            else None
+                        ),
                         freevars=system_frame.f_code.co_freevars,
                         source=source,
                         lineno=system_frame.f_lineno,
@@ -1007,11 +1219,13 @@ class MainCPythonBackend(MainBackend):
         return lookup_from_tb(tb), "current_exception"
 
     def _get_frame_source_info(self, frame):
-        fid = id(frame)
-        if fid not in self._source_info_by_frame:
-            self._source_info_by_frame[fid] = _fetch_frame_source_info(frame)
+        # Source info depends only on the code object. Keying by code (instead of frame id)
+        # keeps the cache small and correct also after the frame is gone and its id reused.
+        code = frame.f_code
+        if code not in self._source_info_by_code:
+            self._source_info_by_code[code] = _fetch_frame_source_info(frame)
 
-        return self._source_info_by_frame[fid]
+        return self._source_info_by_code[code]
 
     def _prepare_user_exception(self):
         e_type, e_value, e_traceback = sys.exc_info()
@@ -1070,6 +1284,133 @@ class MainCPythonBackend(MainBackend):
         return os.path.isfile(marker_path)
 
 
+class OutputCoalescer:
+    """Collects program output into few ProgramOutput events.
+
+    Pending output is sent when it grows bigger than OUTPUT_FLUSH_SIZE or
+    OUTPUT_FLUSH_DEADLINE seconds after the previous flush. A line written after a quiet
+    period is sent right away, so that slowly printing programs still get line-by-line output.
+    Consecutive writes to different streams are kept as separate events in original order.
+
+    The owner must flush (while holding the lock) before sending any other message, and
+    before the stdout gets used by someone else (a child process) or the process ends.
+    """
+
+    def __init__(self, write_message: Callable[[MessageFromBackend], None]):
+        self.lock = threading.RLock()
+        self._write_message = write_message
+        self._condition = threading.Condition(self.lock)
+        self._runs: List[Tuple[str, List[str]]] = []
+        self._size = 0
+        self._last_flush_time = 0.0
+        self._deadline: Optional[float] = None
+        threading.Thread(target=self._flush_at_deadlines, name="OutputFlusher", daemon=True).start()
+
+        import atexit
+
+        atexit.register(self.flush)
+
+    def add(self, data: str, stream_name: str) -> None:
+        with self.lock:
+            if self._runs and self._runs[-1][0] == stream_name:
+                self._runs[-1][1].append(data)
+            else:
+                self._runs.append((stream_name, [data]))
+            self._size += len(data)
+
+            now = time.monotonic()
+            if (
+                self._size >= OUTPUT_FLUSH_SIZE
+                or now - self._last_flush_time >= OUTPUT_FLUSH_DEADLINE
+                and ("\n" in data or "\r" in data)
+            ):
+                self.flush()
+            elif self._deadline is None:
+                self._deadline = now + OUTPUT_FLUSH_DEADLINE
+                self._condition.notify()
+
+    def flush(self) -> None:
+        with self.lock:
+            runs = self._runs
+            self._runs = []
+            self._size = 0
+            self._deadline = None
+            self._last_flush_time = time.monotonic()
+
+            for stream_name, chunks in runs:
+                self._write_message(
+                    BackendEvent(
+                        event_type="ProgramOutput", stream_name=stream_name, data="".join(chunks)
+                    )
+                )
+
+    def _flush_at_deadlines(self) -> None:
+        with self.lock:
+            while True:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                else:
+                    try:
+                        self.flush()
+                    except Exception:
+                        logger.exception("Could not flush program output")
+
+
+class IncomingLineReader:
+    """Reads lines sent by the frontend directly from the file descriptor.
+
+    Unlike TextIOWrapper, it can tell whether a complete line has already arrived,
+    so that the backend can look ahead without blocking.
+    """
+
+    def __init__(self, fd: int):
+        self._fd = fd
+        self._buffer = b""
+        self._eof = False
+
+    def readline(self) -> str:
+        while b"\n" not in self._buffer and not self._eof:
+            self._read_chunk()
+
+        if b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            line += b"\n"
+        else:
+            line, self._buffer = self._buffer, b""
+
+        return line.decode("utf-8").replace("\r\n", "\n")
+
+    def has_line(self) -> bool:
+        if b"\n" not in self._buffer and not self._eof and self._fd_is_readable():
+            self._read_chunk()
+
+        return b"\n" in self._buffer
+
+    def _read_chunk(self) -> None:
+        chunk = os.read(self._fd, 64 * 1024)
+        if chunk:
+            self._buffer += chunk
+        else:
+            self._eof = True
+
+    def _fd_is_readable(self) -> bool:
+        if os.name == "nt":
+            # select doesn't work with pipes on Windows
+            return False
+
+        import select
+
+        try:
+            return bool(select.select([self._fd], [], [], 0)[0])
+        except (OSError, ValueError):
+            return False
+
+
 class FakeStream:
     def __init__(self, backend: MainCPythonBackend, target_stream):
         self._backend = backend
@@ -1265,10 +1606,7 @@ class Executor:
                 statements = compile(module, filename, "exec")
             elif mode == "exec":
                 report_time("Before preparing ast in executor")
-                root = self._prepare_ast(source, filename, mode)
-                for func in ast_postprocessors:
-                    func(root)
-                statements = compile(root, filename, mode)
+                statements = self._compile_source(source, filename, ast_postprocessors)
                 report_time("After compiling ast in executor")
             else:
                 raise ValueError("Unknown mode", mode)
@@ -1289,6 +1627,12 @@ class Executor:
     def _prepare_ast(self, source, filename, mode):
         return ast.parse(source, filename, mode)
 
+    def _compile_source(self, source, filename, ast_postprocessors):
+        root = self._prepare_ast(source, filename, "exec")
+        for func in ast_postprocessors:
+            func(root)
+        return compile(root, filename, "exec")
+
     def _instrument_repl_code(self, root):
         # modify all expression statements to print and register their non-None values
         for node in ast.walk(root):
@@ -1348,6 +1692,111 @@ def _fetch_frame_source_info(frame):
             return None, None, True
 
 
+def bounded_repr(value, max_length, time_budget=REPR_TIME_BUDGET):
+    """Returns repr of the value, shortened to max_length characters (plus "…").
+
+    Unlike repr(value)[:max_length], doesn't compute the whole repr of big
+    builtin strings and containers."""
+    if type(value) not in _BOUNDED_REPR_TYPES:
+        # most common case (numbers, None, objects), doesn't need a writer
+        result = repr(value)
+        if len(result) > max_length:
+            result = result[:max_length] + "…"
+        return result
+
+    writer = _BoundedReprWriter(max_length, time.perf_counter() + time_budget)
+    writer.write_value(value, 0)
+    result = "".join(writer.parts)
+    if writer.truncated or len(result) > max_length:
+        result = result[:max_length] + "…"
+    return result
+
+
+class _BoundedReprWriter:
+    def __init__(self, max_length, deadline):
+        self.parts = []
+        self.truncated = False
+        self._length = 0
+        self._max_length = max_length
+        self._deadline = deadline
+        self._active_container_ids = set()
+
+    def _write(self, s):
+        self.parts.append(s)
+        self._length += len(s)
+
+    def _should_stop(self):
+        if self._length > self._max_length or time.perf_counter() > self._deadline:
+            self.truncated = True
+            return True
+        return False
+
+    def write_value(self, value, level):
+        value_type = type(value)
+        if value_type is str or value_type is bytes:
+            # repr of a prefix is a prefix of the repr (as long as the quotes don't change)
+            remaining = self._max_length - self._length + 1
+            if len(value) > remaining:
+                prefix = value[:remaining]
+                quote, double_quote = ("'", '"') if value_type is str else (b"'", b'"')
+                # make repr choose the same quotes as it would for the whole value
+                if quote in value and double_quote not in value:
+                    prefix += quote
+                else:
+                    prefix += double_quote
+                self._write(repr(prefix))
+                self.truncated = True
+            else:
+                self._write(repr(value))
+        elif value_type in (list, tuple, set, frozenset, dict):
+            if level < MAX_REPR_NESTING:
+                self._write_container(value, value_type, level)
+            else:
+                self._write("...")
+                self.truncated = True
+        else:
+            self._write(repr(value))
+
+    def _write_container(self, value, value_type, level):
+        if value_type is list:
+            start, end = "[", "]"
+        elif value_type is tuple:
+            start, end = "(", ",)" if len(value) == 1 else ")"
+        elif value_type is dict:
+            start, end = "{", "}"
+        elif not value:
+            self._write(value_type.__name__ + "()")
+            return
+        elif value_type is set:
+            start, end = "{", "}"
+        else:
+            start, end = "frozenset({", "})"
+
+        if id(value) in self._active_container_ids:
+            # same as built-in repr does for recursive lists and dicts
+            self._write(start[0] + "..." + end[-1])
+            return
+
+        self._active_container_ids.add(id(value))
+        try:
+            self._write(start)
+            items = value.items() if value_type is dict else value
+            for i, item in enumerate(items):
+                if i > 0:
+                    self._write(", ")
+                if self._should_stop():
+                    return
+                if value_type is dict:
+                    self.write_value(item[0], level + 1)
+                    self._write(": ")
+                    self.write_value(item[1], level + 1)
+                else:
+                    self.write_value(item, level + 1)
+            self._write(end)
+        finally:
+            self._active_container_ids.discard(id(value))
+
+
 def format_exception_with_frame_info(e_type, e_value, e_traceback, shorten_filenames=False):
     """Need to suppress thonny frames to avoid confusion"""
 
@@ -1,16 +1,29 @@
 import _ast
 import ast
 import builtins
+import copyreg
 import dis
+import hashlib
 import inspect
+import io
+import marshal
+import mmap
 import os.path
+import pickle
 import site
 import sys
-from collections import namedtuple
+import tempfile
+import threading
+import weakref
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
 from importlib.machinery import PathFinder, SourceFileLoader
+from importlib.util import decode_source
 from logging import getLogger
 from typing import Union
 
+import thonny
 from thonny import report_time
 from thonny.common import (
     DebuggerCommand,
@@ -32,6 +45,10 @@ BEFORE_EXPRESSION_MARKER = "_thonny_hidden_before_expr"
 AFTER_STATEMENT_MARKER = "_thonny_hidden_after_stmt"
 AFTER_EXPRESSION_MARKER = "_thonny_hidden_after_expr"
 
+# Increase when instrumentation changes, so that cached instrumented code gets ignored
+INSTRUMENTATION_VERSION = 1
+INSTRUMENTED_CODE_CACHE_DIR = os.path.join(thonny.get_thonny_user_dir(), "instrumented_code_cache")
+
 _CO_GENERATOR = getattr(inspect, "CO_GENERATOR", 0)
 _CO_COROUTINE = getattr(inspect, "CO_COROUTINE", 0)
 _CO_ITERABLE_COROUTINE = getattr(inspect, "CO_ITERABLE_COROUTINE", 0)
@@ -41,10 +58,20 @@ _CO_WEIRDO = _CO_GENERATOR | _CO_COROUTINE | _CO_ITERABLE_COROUTINE | _CO_ASYNC_
 
 logger = getLogger(__name__)
 
+# Recent states of NiceTracer are kept as they were saved,
+# older ones get compacted and written to disk (see StateHistory)
+DEFAULT_MAX_STATES_IN_MEMORY = 10000
+SPILL_BATCH_SIZE = 1000
+SPILLED_BATCH_CACHE_SIZE = 2
+SPILL_SEGMENT_SIZE = 64 * 1024 * 1024
+MAX_SPILL_SEGMENTS = 4
+
 TempFrameInfo = namedtuple(
     "TempFrameInfo",
     [
-        "system_frame",
+        "system_frame",  # frame object or FrameSnapshot in case of compacted states
+        "frame_id",
+        "filename",
         "locals",
         "globals",
         "event",
@@ -56,6 +83,21 @@ TempFrameInfo = namedtuple(
     ],
 )
 
+FrameSnapshot = namedtuple(
+    "FrameSnapshot",
+    [
+        "id",
+        "filename",
+        "module_name",
+        "code_name",
+        "freevars",
+        "source",
+        "lineno",
+        "firstlineno",
+        "in_library",
+    ],
+)
+
 
 class Tracer(Executor):
     def __init__(self, backend, original_cmd):
@@ -67,8 +109,17 @@ class Tracer(Executor):
         self._affected_frame_ids_per_exc_id = {}
         self._canonic_path_cache = {}
         self._file_interest_cache = {}
+        # id(code) -> interest. Entries get removed together with their code objects.
+        self._code_interest_cache = {}
+        self._code_interest_refs = {}
         self._file_breakpoints_cache = {}
+        self._allow_stepping_into_libraries = False
         self._command_completion_handler = None
+        # conditions, hit counts and log messages by canonic path and line number
+        self._breakpoint_options = {}
+        self._received_breakpoint_options = {}
+        self._breakpoint_hit_counts = {}
+        self._compiled_breakpoint_expressions = {}
 
         # first (automatic) stepping command depends on whether any breakpoints were set or not
         breakpoints = self._original_cmd.breakpoints
@@ -85,6 +136,7 @@ class Tracer(Executor):
             frame_id=None,
             exception=None,
             breakpoints=breakpoints,
+            breakpoint_options=self._original_cmd.get("breakpoint_options", {}),
         )
 
         self._initialize_new_command(None)
@@ -108,23 +160,54 @@ class Tracer(Executor):
     def _execute_prepared_user_code(self, statements, global_vars):
         old_breakpointhook = None
         try:
-            sys.settrace(self._trace)
+            self._start_tracing()
             if hasattr(sys, "breakpointhook"):
                 old_breakpointhook = sys.breakpointhook
                 sys.breakpointhook = self._breakpointhook
 
             return super()._execute_prepared_user_code(statements, global_vars)
         finally:
-            sys.settrace(None)
+            self._stop_tracing()
             if hasattr(sys, "breakpointhook"):
                 sys.breakpointhook = old_breakpointhook
 
+    def _start_tracing(self):
+        sys.settrace(self._trace)
+
+    def _stop_tracing(self):
+        sys.settrace(None)
+
     def _is_interesting_frame(self, frame):
-        code = frame.f_code
+        return self._is_interesting_code(frame.f_code)
+
+    def _is_interesting_code(self, code):
+        # called for most events, therefore the classification is memoized per code object
+        result = self._code_interest_cache.get(id(code))
+        if result is None:
+            if code is None:
+                return False
 
+            result = self._classify_code(code)
+            code_id = id(code)
+            self._code_interest_cache[code_id] = result
+            self._code_interest_refs[code_id] = weakref.ref(
+                code, lambda _, code_id=code_id: self._forget_code_interest(code_id)
+            )
+
+        return result
+
+    def _forget_code_interest(self, code_id):
+        self._code_interest_cache.pop(code_id, None)
+        self._code_interest_refs.pop(code_id, None)
+
+    def _clear_interest_caches(self):
+        self._file_interest_cache = {}
+        self._code_interest_cache = {}
+        self._code_interest_refs = {}
+
+    def _classify_code(self, code):
         return not (
-            code is None
-            or code.co_filename is None
+            code.co_filename is None
             or not self._is_interesting_module_file(code.co_filename)
             or code.co_flags & _CO_GENERATOR
             and code.co_flags & _CO_COROUTINE
@@ -153,7 +236,7 @@ class Tracer(Executor):
             and is_same_path(path, self._main_module_path)
             or extension in (".py", ".pyw", ".pyde")
             and (
-                self._current_command.get("allow_stepping_into_libraries", False)
+                self._allow_stepping_into_libraries
                 or (
                     self._main_module_path is not None
                     and path_startswith(path, os.path.dirname(self._main_module_path))
@@ -191,12 +274,115 @@ class Tracer(Executor):
             self, "_cmd_%s_completed" % self._current_command.name
         )
 
+        allow_stepping_into_libraries = self._current_command.get(
+            "allow_stepping_into_libraries", False
+        )
+        if allow_stepping_into_libraries != self._allow_stepping_into_libraries:
+            self._clear_interest_caches()
+            self._allow_stepping_into_libraries = allow_stepping_into_libraries
+
         if self._current_command.breakpoints != self._prev_breakpoints:
-            self._file_interest_cache = {}  # because there may be new breakpoints
-            self._file_breakpoints_cache = {}
-            for path, linenos in self._current_command.breakpoints.items():
-                self._file_breakpoints_cache[path] = linenos
-                self._file_breakpoints_cache[self._get_canonic_path(path)] = linenos
+            self._update_breakpoints(self._prev_breakpoints, self._current_command.breakpoints)
+
+        breakpoint_options = self._current_command.get("breakpoint_options", {})
+        if breakpoint_options != self._received_breakpoint_options:
+            self._update_breakpoint_options(breakpoint_options)
+
+    def _update_breakpoints(self, old_breakpoints, new_breakpoints):
+        """Forgets cached information only about the files where breakpoints have changed"""
+        changed_paths = {
+            self._get_canonic_path(path)
+            for path in set(old_breakpoints) | set(new_breakpoints)
+            if old_breakpoints.get(path) != new_breakpoints.get(path)
+        }
+
+        for cache in [self._file_interest_cache, self._file_breakpoints_cache]:
+            for path in list(cache):
+                if self._get_canonic_path(path) in changed_paths:
+                    del cache[path]
+
+        # files with breakpoints are always interesting
+        self._code_interest_cache = {}
+        self._code_interest_refs = {}
+
+        for path, linenos in new_breakpoints.items():
+            self._file_breakpoints_cache[path] = linenos
+            self._file_breakpoints_cache[self._get_canonic_path(path)] = linenos
+
+        self._breakpoints_changed_in(changed_paths)
+
+    def _breakpoints_changed_in(self, canonic_paths):
+        pass
+
+    def _update_breakpoint_options(self, options_by_path):
+        new_options = {
+            self._get_canonic_path(path): options_by_line
+            for path, options_by_line in options_by_path.items()
+        }
+
+        # counting starts again for the breakpoints which got new options
+        old_options = self._breakpoint_options
+        for path, lineno in list(self._breakpoint_hit_counts):
+            if old_options.get(path, {}).get(lineno) != new_options.get(path, {}).get(lineno):
+                del self._breakpoint_hit_counts[(path, lineno)]
+
+        self._breakpoint_options = new_options
+        self._received_breakpoint_options = options_by_path
+
+    def _breakpoint_allows_stopping(self, frame, lineno=None):
+        """Evaluates condition, hit count and log message of the breakpoint at current line
+        (or at given line of the frame).
+
+        Must be called only once per visit of a breakpoint line, because it counts the hits
+        and emits log messages.
+        """
+        if not self._breakpoint_options:
+            return True
+
+        path = self._get_canonic_path(frame.f_code.co_filename)
+        if lineno is None:
+            lineno = frame.f_lineno
+        options = self._breakpoint_options.get(path, {}).get(lineno)
+        if not options:
+            return True
+
+        condition = options.get("condition")
+        if condition:
+            try:
+                if not self._eval_breakpoint_expression(condition, frame):
+                    return False
+            except Exception as e:
+                # like pdb, stop so that the user notices the problem
+                self._backend._send_output(
+                    "Error in breakpoint condition %r: %s: %s\n"
+                    % (condition, type(e).__name__, e),
+                    "stderr",
+                )
+                return True
+
+        hits = self._breakpoint_hit_counts.get((path, lineno), 0) + 1
+        self._breakpoint_hit_counts[(path, lineno)] = hits
+        if hits < options.get("hit_count", 0):
+            return False
+
+        log_message = options.get("log_message")
+        if log_message:
+            try:
+                text = self._eval_breakpoint_expression("f" + repr(log_message), frame)
+            except Exception as e:
+                text = "%s (%s: %s)" % (log_message, type(e).__name__, e)
+            self._backend._send_output(text + "\n", "stdout")
+            return False
+
+        return True
+
+    def _eval_breakpoint_expression(self, source, frame):
+        code = self._compiled_breakpoint_expressions.get(source)
+        if code is None:
+            code = compile(source, "<breakpoint>", "eval")
+            self._compiled_breakpoint_expressions[source] = code
+
+        return eval(code, frame.f_globals, frame.f_locals)
 
     def _register_affected_frame(self, exception_obj, frame):
         # I used to store the frame ids in a new field inside exception object,
@@ -263,18 +449,21 @@ class Tracer(Executor):
 
 class FastTracer(Tracer):
     def __init__(self, backend, original_cmd):
+        self._code_linenos_cache = {}
+        # Breakpoint lines of a code object as bits relative to co_firstlineno
+        self._breakpoint_masks_by_code_id = {}
+        self._mask_code_ids_by_path = {}
+        self._last_mask_code = None
+        self._last_mask = 0
+
         super().__init__(backend, original_cmd)
 
         self._command_frame_returned = False
-        self._code_linenos_cache = {}
-        self._code_breakpoints_cache = {}
 
     def _initialize_new_command(self, current_frame):
         super()._initialize_new_command(current_frame)
         self._command_frame_returned = False
         if self._current_command.breakpoints != self._prev_breakpoints:
-            self._code_breakpoints_cache = {}
-
             # restore tracing for active frames which were skipped before
             # but have breakpoints now
             frame = current_frame
@@ -282,7 +471,7 @@ class FastTracer(Tracer):
                 if (
                     frame.f_trace is None
                     and frame.f_code is not None
-                    and self._get_breakpoints_in_code(frame.f_code)
+                    and self._get_breakpoint_mask(frame.f_code)
                 ):
                     frame.f_trace = self._trace
 
@@ -301,12 +490,12 @@ class FastTracer(Tracer):
             return (
                 (
                     self._current_command.name == "resume"
-                    and not self._get_breakpoints_in_code(frame.f_code)
+                    and not self._get_breakpoint_mask(frame.f_code)
                     or self._current_command.name == "step_over"
-                    and not self._get_breakpoints_in_code(frame.f_code)
+                    and not self._get_breakpoint_mask(frame.f_code)
                     and id(frame) not in self._last_reported_frame_ids
                     or self._current_command.name == "step_out"
-                    and not self._get_breakpoints_in_code(frame.f_code)
+                    and not self._get_breakpoint_mask(frame.f_code)
                 )
                 or not self._is_interesting_frame(frame)
                 or self._backend.is_doing_io()
@@ -337,6 +526,14 @@ class FastTracer(Tracer):
             self._fresh_exception = None
             if frame_id == self._current_command["frame_id"]:
                 self._command_frame_returned = True
+                if self._current_command.name in ["step_over", "step_out"]:
+                    # Next line in an interesting caller completes the command (as in
+                    # MonitoringFastTracer), but callers may have been skipped before
+                    caller = frame.f_back
+                    while caller is not None:
+                        if caller.f_trace is None and self._is_interesting_frame(caller):
+                            caller.f_trace = self._trace
+                        caller = caller.f_back
             self._check_notify_return(frame_id)
 
         elif event == "exception":
@@ -389,30 +586,61 @@ class FastTracer(Tracer):
     def _cmd_resume_completed(self, frame):
         return self._at_a_breakpoint(frame)
 
-    def _get_breakpoints_in_code(self, f_code):
-        bps_in_file = self._get_breakpoints_in_file(f_code.co_filename)
+    def _get_breakpoint_mask(self, f_code):
+        # consecutive events tend to come from the same code
+        if f_code is self._last_mask_code:
+            return self._last_mask
 
         code_id = id(f_code)
-        result = self._code_breakpoints_cache.get(code_id, None)
+        result = self._breakpoint_masks_by_code_id.get(code_id, None)
 
         if result is None:
-            if not bps_in_file:
-                result = set()
-            else:
+            result = 0
+            bps_in_file = self._get_breakpoints_in_file(f_code.co_filename)
+            if bps_in_file:
                 co_linenos = self._code_linenos_cache.get(code_id, None)
                 if co_linenos is None:
                     co_linenos = {pair[1] for pair in dis.findlinestarts(f_code)}
                     self._code_linenos_cache[code_id] = co_linenos
 
-                result = bps_in_file.intersection(co_linenos)
+                for lineno in bps_in_file.intersection(co_linenos):
+                    if lineno >= f_code.co_firstlineno:
+                        result |= 1 << (lineno - f_code.co_firstlineno)
 
-            self._code_breakpoints_cache[code_id] = result
+            self._breakpoint_masks_by_code_id[code_id] = result
+            self._mask_code_ids_by_path.setdefault(
+                self._get_canonic_path(f_code.co_filename), set()
+            ).add(code_id)
 
+        self._last_mask_code = f_code
+        self._last_mask = result
         return result
 
+    def _is_breakpoint_line(self, f_code, lineno):
+        # called for every line event, therefore the common case is inlined
+        if f_code is self._last_mask_code:
+            mask = self._last_mask
+        else:
+            mask = self._get_breakpoint_mask(f_code)
+
+        if not mask or lineno is None:
+            return False
+
+        offset = lineno - f_code.co_firstlineno
+        return offset >= 0 and mask >> offset & 1 == 1
+
+    def _breakpoints_changed_in(self, canonic_paths):
+        for path in canonic_paths:
+            for code_id in self._mask_code_ids_by_path.pop(path, ()):
+                del self._breakpoint_masks_by_code_id[code_id]
+
+        self._last_mask_code = None
+
     def _at_a_breakpoint(self, frame):
         # TODO: try re-entering same line in loop
-        return frame.f_lineno in self._get_breakpoints_in_code(frame.f_code)
+        return self._is_breakpoint_line(
+            frame.f_code, frame.f_lineno
+        ) and self._breakpoint_allows_stopping(frame)
 
     def _is_interesting_exception(self, frame, arg):
         return super()._is_interesting_exception(frame, arg) and (
@@ -425,19 +653,249 @@ class FastTracer(Tracer):
         )
 
 
+class MonitoringFastTracer(FastTracer):
+    """FastTracer built on sys.monitoring (PEP 669) instead of sys.settrace.
+
+    Events get disabled for library code on first encounter and line events are
+    requested only for the code objects which may complete current command.
+    Therefore the program runs at nearly full speed between stops.
+    """
+
+    def __init__(self, backend, original_cmd):
+        self._monitoring_active = False
+        self._in_callback = False
+        self._thread_id = threading.get_ident()
+        self._line_codes = set()
+        self._command_code = None
+        self._watched_codes = set()  # codes of reported frames
+        super().__init__(backend, original_cmd)
+
+    def _start_tracing(self):
+        mon = sys.monitoring
+        mon.use_tool_id(mon.DEBUGGER_ID, "Contour debugger")
+        events = mon.events
+        for event, callback in [
+            (events.PY_START, self._on_py_start),
+            (events.PY_RESUME, self._on_py_start),
+            (events.PY_RETURN, self._on_py_return),
+            (events.PY_YIELD, self._on_py_return),
+            (events.PY_UNWIND, self._on_py_unwind),
+            (events.LINE, self._on_line),
+            (events.RAISE, self._on_raise),
+            (events.RERAISE, self._on_raise),
+        ]:
+            mon.register_callback(mon.DEBUGGER_ID, event, callback)
+
+        self._monitoring_active = True
+        self._configure_events(None)
+
+    def _stop_tracing(self):
+        if not self._monitoring_active:
+            return
+
+        mon = sys.monitoring
+        mon.set_events(mon.DEBUGGER_ID, mon.events.NO_EVENTS)
+        for code in self._line_codes:
+            mon.set_local_events(mon.DEBUGGER_ID, code, mon.events.NO_EVENTS)
+        self._line_codes = set()
+        mon.free_tool_id(mon.DEBUGGER_ID)
+        self._monitoring_active = False
+
+    def _initialize_new_command(self, current_frame):
+        Tracer._initialize_new_command(self, current_frame)
+        self._command_frame_returned = False
+
+        self._command_code = None
+        self._watched_codes = set()
+        frame = current_frame
+        while frame is not None:
+            if id(frame) == self._current_command.frame_id:
+                self._command_code = frame.f_code
+            if id(frame) in self._last_reported_frame_ids:
+                self._watched_codes.add(frame.f_code)
+            frame = frame.f_back
+
+        if self._monitoring_active:
+            self._configure_events(current_frame)
+
+    def _configure_events(self, current_frame):
+        mon = sys.monitoring
+        events = mon.events
+        global_events = (
+            events.PY_START
+            | events.PY_RESUME
+            | events.PY_RETURN
+            | events.PY_YIELD
+            | events.PY_UNWIND
+        )
+        if self._current_command.name in ["step_into", "step_over"]:
+            # see _is_interesting_exception
+            global_events |= events.RAISE | events.RERAISE
+        mon.set_events(mon.DEBUGGER_ID, global_events)
+
+        for code in self._line_codes:
+            mon.set_local_events(mon.DEBUGGER_ID, code, events.NO_EVENTS)
+        self._line_codes = set()
+
+        # Frames already on the stack won't report PY_START anymore
+        frame = current_frame
+        while frame is not None:
+            if self._is_interesting_code(frame.f_code) and (
+                self._needs_line_events_in_new_frame(frame.f_code)
+                or frame.f_code is self._command_code
+            ):
+                self._enable_line_events(frame.f_code)
+            frame = frame.f_back
+
+        # Interest may have changed since the events were disabled
+        mon.restart_events()
+
+    def _enable_line_events(self, code):
+        if code not in self._line_codes:
+            mon = sys.monitoring
+            mon.set_local_events(mon.DEBUGGER_ID, code, mon.events.LINE)
+            self._line_codes.add(code)
+
+    def _needs_line_events_in_new_frame(self, code):
+        return self._current_command.name == "step_into" or bool(
+            self._get_breakpoint_mask(code)
+        )
+
+    def _should_ignore_event(self):
+        # sys.monitoring callbacks are invoked for all threads and also for the code
+        # run by the debugger itself (eg. repr of a user object)
+        return (
+            self._in_callback
+            or threading.get_ident() != self._thread_id
+            or self._backend.is_doing_io()
+        )
+
+    def _on_py_start(self, code, instruction_offset):
+        if self._should_ignore_event():
+            return None
+
+        if not self._is_interesting_code(code):
+            return sys.monitoring.DISABLE
+
+        self._in_callback = True
+        try:
+            self._fresh_exception = None
+            self._check_store_main_frame_id(sys._getframe(1))
+            if self._needs_line_events_in_new_frame(code):
+                self._enable_line_events(code)
+                return None
+            elif code is self._command_code or code in self._line_codes:
+                return None
+            else:
+                # until next command
+                return sys.monitoring.DISABLE
+        finally:
+            self._in_callback = False
+
+    def _on_py_return(self, code, instruction_offset, retval):
+        if self._should_ignore_event():
+            return None
+
+        if code is not self._command_code and code not in self._watched_codes:
+            return sys.monitoring.DISABLE
+
+        self._in_callback = True
+        try:
+            self._fresh_exception = None
+            self._handle_frame_exit(sys._getframe(1))
+        finally:
+            self._in_callback = False
+
+    def _on_py_unwind(self, code, instruction_offset, exception):
+        if self._should_ignore_event():
+            return
+
+        if code is not self._command_code and code not in self._watched_codes:
+            return
+
+        self._in_callback = True
+        try:
+            self._handle_frame_exit(sys._getframe(1))
+        finally:
+            self._in_callback = False
+
+    def _handle_frame_exit(self, frame):
+        frame_id = id(frame)
+        if frame_id == self._current_command.frame_id:
+            self._command_frame_returned = True
+            if self._current_command.name in ["step_over", "step_out"]:
+                # next line in an interesting caller completes the command
+                caller = frame.f_back
+                while caller is not None:
+                    if self._is_interesting_code(caller.f_code):
+                        self._enable_line_events(caller.f_code)
+                    caller = caller.f_back
+                sys.monitoring.restart_events()
+
+        self._check_notify_return(frame_id)
+
+    def _on_line(self, code, line_number):
+        if self._should_ignore_event():
+            return None
+
+        self._in_callback = True
+        try:
+            frame = sys._getframe(1)
+            self._fresh_exception = None
+            if self._command_completion_handler(frame):
+                self._report_current_state(frame)
+                self._fetch_next_debugger_command(frame)
+                return None
+
+            if (
+                self._current_command.name == "resume"
+                or self._current_command.name == "step_out"
+                and not self._command_frame_returned
+            ) and not self._is_breakpoint_line(code, line_number):
+                # this line can't complete the command (until next command)
+                return sys.monitoring.DISABLE
+
+            return None
+        finally:
+            self._in_callback = False
+
+    def _on_raise(self, code, instruction_offset, exception):
+        if self._should_ignore_event() or not self._is_interesting_code(code):
+            return
+
+        self._in_callback = True
+        try:
+            frame = sys._getframe(1)
+            arg = (type(exception), exception, exception.__traceback__)
+            if self._is_interesting_exception(frame, arg):
+                self._fresh_exception = arg
+                self._register_affected_frame(exception, frame)
+                self._report_current_state(frame)
+                self._fetch_next_debugger_command(frame)
+        finally:
+            self._in_callback = False
+
+
 class NiceTracer(Tracer):
     def __init__(self, backend, original_cmd):
         super().__init__(backend, original_cmd)
         self._instrumented_files = set()
         self._install_marker_functions()
         self._custom_stack = []
-        self._saved_states = []
+        self._saved_states = StateHistory(
+            original_cmd.get("max_states_in_memory", DEFAULT_MAX_STATES_IN_MEMORY),
+            self._describe_frame,
+        )
         self._current_state_index = 0
+        # for seeking without going through the states in between
+        self._state_indices_by_line = {}  # filename -> lineno -> state indices
 
         from collections import Counter
 
         self._fulltags = Counter()
         self._nodes = {}
+        self._node_id_prefix = None
+        self._node_ids_by_ast_node_id = {}
 
     def _breakpointhook(self, *args, **kw):
         self._report_state(len(self._saved_states) - 1)
@@ -465,6 +923,9 @@ class NiceTracer(Tracer):
 
         root = ast.parse(source, filename, mode)
 
+        self._node_id_prefix = _get_source_key(source, filename)[:12]
+        self._node_ids_by_ast_node_id = {}
+
         ast_utils.mark_text_ranges(root, source)
         self._tag_nodes(root)
         self._insert_expression_markers(root)
@@ -631,7 +1092,12 @@ class NiceTracer(Tracer):
         self._custom_stack always keeps last info,
         which gets exported as FrameInfos to _saved_states["stack"]
         """
-        focus = TextRange(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+        focus = getattr(node, "focus", None)
+        if focus is None:
+            # One object per node, so that the states refer to (and pickle) the same range
+            focus = node.focus = TextRange(
+                node.lineno, node.col_offset, node.end_lineno, node.end_col_offset
+            )
 
         custom_frame = self._custom_stack[-1]
         custom_frame.event = event
@@ -641,7 +1107,14 @@ class NiceTracer(Tracer):
 
         if self._saved_states:
             prev_state = self._saved_states[-1]
-            prev_state_frame = self._create_actual_active_frame(prev_state)
+            # Only few attributes of the previous active frame are needed here, it's cheaper
+            # to look them up than to create the frame with overrides applied
+            prev_state_frame = prev_state["stack"][-1]
+            prev_overrides = prev_state["active_frame_overrides"]
+            prev_event = prev_overrides.get("event", prev_state_frame.event)
+            prev_root_expression = prev_overrides.get(
+                "current_root_expression", prev_state_frame.current_root_expression
+            )
         else:
             prev_state = None
             prev_state_frame = None
@@ -667,10 +1140,9 @@ class NiceTracer(Tracer):
                 custom_frame.current_statement = node.parent_statement_focus
 
             # see whether current_root_expression needs to be updated
-            prev_root_expression = prev_state_frame.current_root_expression
             if event == "before_expression" and (
-                id(frame) != id(prev_state_frame.system_frame)
-                or "statement" in prev_state_frame.event
+                id(frame) != prev_state_frame.frame_id
+                or "statement" in prev_event
                 or prev_root_expression
                 and not range_contains_smaller_or_equal(prev_root_expression, focus)
             ):
@@ -685,10 +1157,11 @@ class NiceTracer(Tracer):
 
         # Save the snapshot.
         # Check if we can share something with previous state
+        exception_value = self._get_current_exception()[1]
         if (
             prev_state is not None
-            and id(prev_state_frame.system_frame) == id(frame)
-            and prev_state["exception_value"] is self._get_current_exception()[1]
+            and prev_state_frame.frame_id == id(frame)
+            and prev_state["exception_value"] is exception_value
             and prev_state["fresh_exception_id"] == id(self._fresh_exception)
             and ("before" in event or "skipexport" in node.tags)
         ):
@@ -713,18 +1186,35 @@ class NiceTracer(Tracer):
         msg = {
             "stack": stack,
             "active_frame_overrides": active_frame_overrides,
-            "in_client_log": False,
             "io_symbol_count": (
                 sys.stdin._processed_symbol_count
                 + sys.stdout._processed_symbol_count
                 + sys.stderr._processed_symbol_count
             ),
-            "exception_value": self._get_current_exception()[1],
+            "exception_value": exception_value,
             "fresh_exception_id": id(self._fresh_exception),
             "exception_info": exception_info,
         }
 
+        if "before_" in event and focus.lineno != custom_frame.breakpoint_lineno:
+            # Condition, hit count and log message need the live frame, therefore they are
+            # evaluated when the line gets entered, not when the states are examined
+            custom_frame.breakpoint_lineno = focus.lineno
+            custom_frame.breakpoint_allowed = focus.lineno not in self._get_breakpoints_in_file(
+                frame.f_code.co_filename
+            ) or self._breakpoint_allows_stopping(frame, focus.lineno)
+        if not custom_frame.breakpoint_allowed and focus.lineno == custom_frame.breakpoint_lineno:
+            msg["breakpoint_allowed"] = False
+
         self._saved_states.append(msg)
+        self._index_state(len(self._saved_states) - 1, frame, event, node)
+
+    def _index_state(self, state_index, frame, event, node):
+        if event == "before_statement" and "skip_" + event not in node.tags:
+            indices_by_lineno = self._state_indices_by_line.setdefault(frame.f_code.co_filename, {})
+            if node.lineno not in indices_by_lineno:
+                indices_by_lineno[node.lineno] = array("Q")
+            indices_by_lineno[node.lineno].append(state_index)
 
     def _respond_to_commands(self):
         """Tries to respond to client commands with states collected so far.
@@ -733,36 +1223,82 @@ class NiceTracer(Tracer):
 
         # while the state for current index is already saved:
         while self._current_state_index < len(self._saved_states):
-            state = self._saved_states[self._current_state_index]
-
-            # Get current state's most recent frame (together with overrides
-            frame = self._create_actual_active_frame(state)
-
-            # Is this state meant to be seen?
-            if "skip_" + frame.event not in frame.node_tags:
-                # if True:
-                # Has the command completed?
-                tester = getattr(self, "_cmd_" + self._current_command.name + "_completed")
-                cmd_complete = tester(frame, self._current_command)
-
-                if cmd_complete:
-                    state["in_client_log"] = True
-                    self._report_state(self._current_state_index)
-                    self._fetch_next_debugger_command(frame)
-
-            if self._current_command.name == "step_back":
-                if self._current_state_index == 0:
-                    # Already in first state. Remain in this loop
+            if self._current_command.name == "seek":
+                # jumps directly to the requested state
+                self._seek()
+            else:
+                state = self._saved_states[self._current_state_index]
+
+                # Get current state's most recent frame (together with overrides
+                frame = self._create_actual_active_frame(state)
+
+                # Is this state meant to be seen?
+                if "skip_" + frame.event not in frame.node_tags:
+                    # if True:
+                    # Has the command completed?
+                    tester = getattr(self, "_cmd_" + self._current_command.name + "_completed")
+                    cmd_complete = tester(frame, self._current_command)
+
+                    if cmd_complete:
+                        self._saved_states.set_in_client_log(self._current_state_index, True)
+                        self._report_state(self._current_state_index)
+                        self._fetch_next_debugger_command(frame)
+
+            if self._current_command.name == "seek":
+                # next seek is relative to the state reported last
+                pass
+            elif self._current_command.name == "step_back":
+                if self._current_state_index == self._saved_states.first_index:
+                    # Already in first available state. Remain in this loop
                     pass
                 else:
-                    assert self._current_state_index > 0
+                    assert self._current_state_index > self._saved_states.first_index
                     # Current event is no longer present in GUI "undo log"
-                    self._saved_states[self._current_state_index]["in_client_log"] = False
+                    self._saved_states.set_in_client_log(self._current_state_index, False)
                     self._current_state_index -= 1
             else:
                 # Other commands move the pointer forward
                 self._current_state_index += 1
 
+    def _seek(self):
+        target = self._find_seek_target(self._current_command)
+        if target is not None:
+            self._current_state_index = target
+
+        self._saved_states.set_in_client_log(self._current_state_index, True)
+        self._report_state(self._current_state_index)
+        self._fetch_next_debugger_command(None)
+
+    def _find_seek_target(self, cmd):
+        """Returns the index of the state requested by seek command or None if there is
+        no such state.
+
+        The state can be given by index or as last visit (before current state)
+        of given line"""
+        if cmd.get("state_index") is not None:
+            return max(
+                self._saved_states.first_index,
+                min(cmd["state_index"], len(self._saved_states) - 1),
+            )
+
+        if cmd.get("lineno") is not None:
+            indices = None
+            for filename in self._state_indices_by_line:
+                if is_same_path(filename, cmd["filename"]):
+                    indices = self._state_indices_by_line[filename].get(cmd["lineno"])
+                    break
+        else:
+            return None
+
+        if not indices:
+            return None
+
+        pos = bisect_left(indices, self._current_state_index)
+        if pos == 0 or indices[pos - 1] < self._saved_states.first_index:
+            return None
+        else:
+            return indices[pos - 1]
+
     def _create_actual_active_frame(self, state):
         return state["stack"][-1]._replace(**state["active_frame_overrides"])
 
@@ -783,6 +1319,10 @@ class NiceTracer(Tracer):
         state["stack"] = state["stack"].copy()
 
         state["in_present"] = in_present
+        state["in_client_log"] = self._saved_states.is_in_client_log(state_index)
+        state["state_index"] = state_index
+        state["state_count"] = len(self._saved_states)
+        state["first_state_index"] = self._saved_states.first_index
         if not in_present:
             # for past states fix the newest frame
             state["stack"][-1] = self._create_actual_active_frame(state)
@@ -794,27 +1334,21 @@ class NiceTracer(Tracer):
         new_stack = []
         self._last_reported_frame_ids = set()
         for tframe in state["stack"]:
-            system_frame = tframe.system_frame
-            module_name = system_frame.f_globals.get("__name__", None)
-            code_name = system_frame.f_code.co_name
-
-            source, firstlineno, in_library = self._backend._get_frame_source_info(system_frame)
-
-            assert firstlineno is not None, "nofir " + str(system_frame)
-            frame_id = id(system_frame)
+            snapshot = self._describe_frame(tframe.system_frame)
+            frame_id = snapshot.id
             new_stack.append(
                 FrameInfo(
                     id=frame_id,
-                    filename=system_frame.f_code.co_filename,
-                    module_name=module_name,
-                    code_name=code_name,
+                    filename=snapshot.filename,
+                    module_name=snapshot.module_name,
+                    code_name=snapshot.code_name,
                     locals=tframe.locals,
                     globals=tframe.globals,
-                    freevars=system_frame.f_code.co_freevars,
-                    source=source,
-                    lineno=system_frame.f_lineno,
-                    firstlineno=firstlineno,
-                    in_library=in_library,
+                    freevars=snapshot.freevars,
+                    source=snapshot.source,
+                    lineno=snapshot.lineno,
+                    firstlineno=snapshot.firstlineno,
+                    in_library=snapshot.in_library,
                     event=tframe.event,
                     focus=tframe.focus,
                     node_tags=tframe.node_tags,
@@ -831,6 +1365,25 @@ class NiceTracer(Tracer):
 
         self._backend.send_message(DebuggerResponse(**state))
 
+    def _describe_frame(self, system_frame):
+        if isinstance(system_frame, FrameSnapshot):
+            return system_frame
+
+        source, firstlineno, in_library = self._backend._get_frame_source_info(system_frame)
+        assert firstlineno is not None, "nofir " + str(system_frame)
+
+        return FrameSnapshot(
+            id=id(system_frame),
+            filename=system_frame.f_code.co_filename,
+            module_name=system_frame.f_globals.get("__name__", None),
+            code_name=system_frame.f_code.co_name,
+            freevars=system_frame.f_code.co_freevars,
+            source=source,
+            lineno=system_frame.f_lineno,
+            firstlineno=firstlineno,
+            in_library=in_library,
+        )
+
     def _try_interpret_as_again_event(self, frame, original_event, original_args, original_node):
         """
         Some after_* events can be interpreted also as
@@ -857,16 +1410,14 @@ class NiceTracer(Tracer):
 
                 # next step will be finalizing evaluation of parent of current expr
                 # so let's say we're before that parent expression
-                again_args = {"node_id": id(original_node.parent_node)}
                 again_event = (
                     "before_expression_again"
                     if "child_of_expression" in original_node.tags
                     else "before_statement_again"
                 )
 
-                self._handle_progress_event(
-                    frame, again_event, again_args, original_node.parent_node
-                )
+                # the parent node is given directly, the args don't need to identify it
+                self._handle_progress_event(frame, again_event, {}, original_node.parent_node)
 
     def _cmd_step_over_completed(self, frame, cmd):
         """
@@ -878,7 +1429,7 @@ class NiceTracer(Tracer):
             return True
 
         # Make sure the correct frame_id is selected
-        if id(frame.system_frame) == cmd.frame_id:
+        if frame.frame_id == cmd.frame_id:
             # We're in the same frame
             if "before_" in cmd.state:
                 if not range_contains_smaller_or_equal(cmd.focus, frame.focus):
@@ -919,12 +1470,16 @@ class NiceTracer(Tracer):
     def _cmd_step_back_completed(self, frame, cmd):
         # Check if the selected message has been previously sent to front-end
         return (
-            self._saved_states[self._current_state_index]["in_client_log"]
-            or self._current_state_index == 0
+            self._saved_states.is_in_client_log(self._current_state_index)
+            or self._current_state_index == self._saved_states.first_index
         )
 
+    def _cmd_seek_completed(self, frame, cmd):
+        # seek doesn't need to test the states (see _seek)
+        return True
+
     def _cmd_step_out_completed(self, frame, cmd):
-        if self._current_state_index == 0:
+        if self._current_state_index == self._saved_states.first_index:
             return False
 
         if frame.event == "after_statement":
@@ -940,10 +1495,10 @@ class NiceTracer(Tracer):
             not self._frame_is_alive(cmd.frame_id)
             # we're in the same frame but on higher level
             # TODO: expression inside statement expression has same range as its parent
-            or id(frame.system_frame) == cmd.frame_id
+            or frame.frame_id == cmd.frame_id
             and range_contains_smaller(frame.focus, cmd.focus)
             # or we were there in prev state
-            or id(prev_state_frame.system_frame) == cmd.frame_id
+            or prev_state_frame.frame_id == cmd.frame_id
             and range_contains_smaller(prev_state_frame.focus, cmd.focus)
         )
 
@@ -956,15 +1511,16 @@ class NiceTracer(Tracer):
 
         return (
             frame.event in ["before_statement", "before_expression"]
-            and frame.system_frame.f_code.co_filename in breakpoints
-            and frame.focus.lineno in breakpoints[frame.system_frame.f_code.co_filename]
+            and frame.filename in breakpoints
+            and frame.focus.lineno in breakpoints[frame.filename]
+            and self._saved_states[self._current_state_index].get("breakpoint_allowed", True)
             # consider only first event on a line
             # (but take into account that same line may be reentered)
             and (
                 cmd.focus is None
                 or (cmd.focus.lineno != frame.focus.lineno)
                 or (cmd.focus == frame.focus and cmd.state == frame.event)
-                or id(frame.system_frame) != cmd.frame_id
+                or frame.frame_id != cmd.frame_id
             )
         )
 
@@ -997,6 +1553,8 @@ class NiceTracer(Tracer):
                     # otherwise frame id-s would be reused and this would
                     # mess up communication with the frontend.
                     system_frame=system_frame,
+                    frame_id=id(system_frame),
+                    filename=system_frame.f_code.co_filename,
                     locals=(
                         None
                         if system_frame.f_locals is system_frame.f_globals
@@ -1411,10 +1969,115 @@ class NiceTracer(Tracer):
 
     def _export_node(self, node):
         assert isinstance(node, (ast.expr, ast.stmt))
-        node_id = id(node)
-        self._nodes[node_id] = node
+        # Node id-s end up in the code and therefore need to be stable across processes
+        # (see _compile_source)
+        node_id = self._node_ids_by_ast_node_id.get(id(node))
+        if node_id is None:
+            node_id = "%s:%d" % (self._node_id_prefix, len(self._node_ids_by_ast_node_id))
+            self._node_ids_by_ast_node_id[id(node)] = node_id
+            self._nodes[node_id] = node
         return ast.Constant(node_id)
 
+    def _compile_source(self, source, filename, ast_postprocessors):
+        if ast_postprocessors:
+            # can't know whether the result of these depends only on the source
+            return super()._compile_source(source, filename, ast_postprocessors)
+
+        source_key = _get_source_key(source, filename)
+        cache_path = _get_instrumented_code_cache_path(filename)
+        header = (
+            INSTRUMENTATION_VERSION,
+            thonny.get_version(),
+            sys.version,
+            filename,
+            source_key,
+        )
+
+        try:
+            with open(cache_path, "rb") as fp:
+                cached_header, code, node_table = marshal.load(fp)
+            if cached_header == header:
+                self._load_node_table(node_table)
+                self._instrumented_files.add(filename)
+                return code
+        except FileNotFoundError:
+            pass
+        except (OSError, EOFError, ValueError, TypeError):
+            logger.warning("Could not load instrumented code for %r", filename, exc_info=True)
+
+        code = super()._compile_source(source, filename, ast_postprocessors)
+
+        # NB! Back-end runs with -B, but this cache doesn't touch user's directories
+        try:
+            os.makedirs(INSTRUMENTED_CODE_CACHE_DIR, exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+            with open(tmp_path, "wb") as fp:
+                marshal.dump((header, code, self._create_node_table()), fp)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError):
+            logger.warning("Could not cache instrumented code for %r", filename, exc_info=True)
+
+        return code
+
+    def _create_node_table(self):
+        """Describes the nodes exported during last _prepare_ast in the form suitable for marshal.
+
+        Includes only the attributes used during tracing."""
+        nodes = []
+        indices = {}
+
+        def add_node(node):
+            if id(node) not in indices:
+                # parents come before children
+                parent = getattr(node, "parent_node", None)
+                parent_index = -1 if parent is None else add_node(parent)
+                indices[id(node)] = len(nodes)
+                nodes.append((node, parent_index))
+            return indices[id(node)]
+
+        node_ids_by_index = {}
+        for node_id in self._node_ids_by_ast_node_id.values():
+            node_ids_by_index[add_node(self._nodes[node_id])] = node_id
+
+        table = []
+        for i, (node, parent_index) in enumerate(nodes):
+            statement_focus = getattr(node, "parent_statement_focus", None)
+            table.append(
+                (
+                    node_ids_by_index.get(i),
+                    node.lineno,
+                    node.col_offset,
+                    node.end_lineno,
+                    node.end_col_offset,
+                    frozenset(getattr(node, "tags", ())),
+                    parent_index,
+                    None if statement_focus is None else tuple(statement_focus),
+                )
+            )
+
+        return tuple(table)
+
+    def _load_node_table(self, table):
+        nodes = []
+        for (
+            node_id,
+            lineno,
+            col_offset,
+            end_lineno,
+            end_col_offset,
+            tags,
+            parent_index,
+            statement_focus,
+        ) in table:
+            node = CachedNode(lineno, col_offset, end_lineno, end_col_offset, set(tags))
+            if parent_index != -1:
+                node.parent_node = nodes[parent_index]
+            if statement_focus is not None:
+                node.parent_statement_focus = TextRange(*statement_focus)
+            if node_id is not None:
+                self._nodes[node_id] = node
+            nodes.append(node)
+
     def _debug(self, *args):
         logger.debug("TRACER: " + str(args))
 
@@ -1422,6 +2085,7 @@ class NiceTracer(Tracer):
         try:
             return Tracer._execute_prepared_user_code(self, statements, global_vars)
         finally:
+            self._saved_states.close()
             """
             from thonny.misc_utils import _win_get_used_memory
             print("Memory:", _win_get_used_memory() / 1024 / 1024)
@@ -1437,16 +2101,30 @@ class FancySourceFileLoader(SourceFileLoader):
         super().__init__(fullname, path)
         self._tracer = tracer
 
-    def source_to_code(self, data, path, *, _optimize=-1):
+    def get_code(self, fullname):
+        # Instrumented code must not be read from nor written to __pycache__.
+        # NiceTracer keeps its own cache.
+        path = self.get_filename(fullname)
+        source = decode_source(self.get_data(path))
         old_tracer = sys.gettrace()
         sys.settrace(None)
         try:
-            root = self._tracer._prepare_ast(data, path, "exec")
-            return super().source_to_code(root, path)
+            return self._tracer._compile_source(source, path, [])
         finally:
             sys.settrace(old_tracer)
 
 
+class CachedNode:
+    """Stands for an AST node when instrumented code is loaded from cache"""
+
+    def __init__(self, lineno, col_offset, end_lineno, end_col_offset, tags):
+        self.lineno = lineno
+        self.col_offset = col_offset
+        self.end_lineno = end_lineno
+        self.end_col_offset = end_col_offset
+        self.tags = tags
+
+
 class CustomStackFrame:
     def __init__(self, frame, event, focus=None):
         self.system_frame = frame
@@ -1456,3 +2134,296 @@ class CustomStackFrame:
         self.current_statement = None
         self.current_root_expression = None
         self.node_tags = set()
+        # options of the breakpoint at this line were evaluated when the line was entered
+        self.breakpoint_lineno = None
+        self.breakpoint_allowed = True
+
+
+class StateHistory:
+    """Stores the states saved by NiceTracer.
+
+    Up to max_states_in_memory recent states are kept as they were saved. Older states get
+    compacted (frames replaced by FrameSnapshots, stacks and variables shared with previous
+    compacted state, values interned) and pickled into a temporary file in batches, which
+    are read back via mmap when stepping back.
+
+    The spill file is split into segments and when there are too many of them, the oldest
+    segment gets dropped together with its states (see first_index). FrameSnapshots (and
+    their sources) don't get pickled, each segment keeps a table of the snapshots its
+    batches refer to.
+    """
+
+    def __init__(
+        self,
+        max_states_in_memory,
+        describe_frame,
+        spill_batch_size=SPILL_BATCH_SIZE,
+        spill_segment_size=SPILL_SEGMENT_SIZE,
+        max_spill_segments=MAX_SPILL_SEGMENTS,
+    ):
+        self._describe_frame = describe_frame
+        self._spill_batch_size = spill_batch_size
+        self._spill_segment_size = spill_segment_size
+        self._max_spill_segments = max_spill_segments
+        self._spill_threshold = max_states_in_memory + spill_batch_size
+
+        self._in_client_log = bytearray()
+        self._live_states = deque()
+
+        self._interned = {}
+        self._last_compacted_source_stack = None
+        self._last_compacted_stack = None
+        self._compacted_frames_by_frame_id = {}  # frame_id -> (source frame, compacted frame)
+        self._variables_by_key = {}
+
+        self._spill_dispatch_table = copyreg.dispatch_table.copy()
+        self._spill_dispatch_table[FrameSnapshot] = self._reduce_snapshot
+
+        # Batch i holds the states starting from first_index + i * spill_batch_size
+        self._spill_segments = deque()
+        self._batch_locations = deque()  # (segment, offset, length) for each batch
+        self._first_index = 0
+        self._spilled_batch_cache = OrderedDict()  # index of first state -> list of states
+
+    def __len__(self):
+        return len(self._in_client_log)
+
+    @property
+    def first_index(self):
+        """Index of the oldest state which is still available"""
+        return self._first_index
+
+    def __getitem__(self, index):
+        count = len(self._in_client_log)
+        if index < 0:
+            index += count
+
+        # the tracer mostly asks for the newest states
+        live_start = count - len(self._live_states)
+        if live_start <= index < count:
+            return self._live_states[index - live_start]
+
+        if not self._first_index <= index < count:
+            raise IndexError("state index out of range")
+
+        return self._load_spilled_state(index)
+
+    def append(self, state):
+        self._live_states.append(state)
+        self._in_client_log.append(False)
+
+        if len(self._live_states) >= self._spill_threshold:
+            self._spill_batch(
+                [
+                    self._compact_state(self._live_states.popleft())
+                    for _ in range(self._spill_batch_size)
+                ]
+            )
+
+    def is_in_client_log(self, index):
+        return bool(self._in_client_log[index])
+
+    def set_in_client_log(self, index, value):
+        self._in_client_log[index] = value
+
+    def close(self):
+        for segment in self._spill_segments:
+            segment.close()
+        self._spill_segments.clear()
+        self._spilled_batch_cache.clear()
+
+    def _compact_state(self, state):
+        if state["stack"] is self._last_compacted_source_stack:
+            # the stack was shared between the states and it can stay shared
+            stack = self._last_compacted_stack
+        else:
+            compacted_frames_by_frame_id = {}
+            variables_by_key = {}
+            stack = [
+                self._compact_frame(tframe, compacted_frames_by_frame_id, variables_by_key)
+                for tframe in state["stack"]
+            ]
+            # remember only the things which may be shared with next compacted state
+            self._compacted_frames_by_frame_id = compacted_frames_by_frame_id
+            self._variables_by_key = variables_by_key
+            self._last_compacted_source_stack = state["stack"]
+            self._last_compacted_stack = stack
+
+        # The state has left the history and nobody else refers to it, so it can be
+        # compacted in place. Overrides don't need compacting, the ranges and evaluations
+        # in them are shared between the states already.
+        state["stack"] = stack
+        # exception_value is needed only for comparing with next state
+        state["exception_value"] = None
+        return state
+
+    def _compact_frame(self, tframe, compacted_frames_by_frame_id, variables_by_key):
+        prev = self._compacted_frames_by_frame_id.get(tframe.frame_id)
+        if prev is not None and prev[0] == tframe:
+            # Full exports repeat the outer frames of the stack mostly unchanged
+            compacted = prev[1]
+            compacted_frames_by_frame_id[tframe.frame_id] = (tframe, compacted)
+            if compacted.locals is not None:
+                variables_by_key[("locals", tframe.frame_id)] = compacted.locals
+            variables_by_key[("globals", compacted.system_frame.module_name)] = compacted.globals
+            return compacted
+
+        if prev is not None and prev[0].system_frame is tframe.system_frame:
+            snapshot = prev[1].system_frame
+        else:
+            snapshot = self._describe_frame(tframe.system_frame)
+
+        compacted = tframe._replace(
+            system_frame=snapshot,
+            locals=self._share_variables(
+                tframe.locals, ("locals", tframe.frame_id), variables_by_key
+            ),
+            globals=self._share_variables(
+                tframe.globals, ("globals", snapshot.module_name), variables_by_key
+            ),
+        )
+        compacted_frames_by_frame_id[tframe.frame_id] = (tframe, compacted)
+        return compacted
+
+    def _share_variables(self, variables, key, variables_by_key):
+        if variables is None:
+            return None
+
+        prev_variables = self._variables_by_key.get(key)
+        if prev_variables is None:
+            result = {self._intern(name): self._intern(value) for name, value in variables.items()}
+        elif prev_variables != variables:
+            # usually only few of the variables have changed
+            result = {}
+            for name, value in variables.items():
+                prev_value = prev_variables.get(name)
+                if prev_value is None or prev_value != value:
+                    result[self._intern(name)] = self._intern(value)
+                else:
+                    result[self._intern(name)] = prev_value
+        else:
+            result = prev_variables
+
+        variables_by_key[key] = result
+        return result
+
+    def _intern(self, obj):
+        return self._interned.setdefault(obj, obj)
+
+    def _spill_batch(self, states):
+        if not self._spill_segments or self._spill_segments[-1].size >= self._spill_segment_size:
+            if len(self._spill_segments) >= self._max_spill_segments:
+                self._drop_oldest_segment()
+            self._spill_segments.append(_SpillSegment())
+
+        segment = self._spill_segments[-1]
+        offset = segment.size
+        segment.file.seek(offset)
+        # One pickler for the whole batch, so that stacks and variables shared between
+        # the states stay shared
+        pickler = pickle.Pickler(segment.file, pickle.HIGHEST_PROTOCOL)
+        pickler.dispatch_table = self._spill_dispatch_table
+        pickler.dump(states)
+        segment.size = segment.file.tell()
+        # interning is useful only within a batch, because pickling shares objects only there
+        self._interned = {}
+        self._batch_locations.append((segment, offset, segment.size - offset))
+
+    def _reduce_snapshot(self, snapshot):
+        # _StateUnpickler resolves this function to a lookup from the snapshot table
+        return _load_snapshot, (self._spill_segments[-1].get_snapshot_index(snapshot),)
+
+    def _drop_oldest_segment(self):
+        segment = self._spill_segments.popleft()
+        while self._batch_locations and self._batch_locations[0][0] is segment:
+            self._batch_locations.popleft()
+            self._spilled_batch_cache.pop(self._first_index, None)
+            self._first_index += self._spill_batch_size
+        segment.close()
+
+    def _load_spilled_state(self, index):
+        batch_index = (index - self._first_index) // self._spill_batch_size
+        batch_start = self._first_index + batch_index * self._spill_batch_size
+
+        if batch_start in self._spilled_batch_cache:
+            self._spilled_batch_cache.move_to_end(batch_start)
+            states = self._spilled_batch_cache[batch_start]
+        else:
+            segment, offset, length = self._batch_locations[batch_index]
+            states = _StateUnpickler(
+                io.BytesIO(segment.read(offset, length)), segment.snapshots
+            ).load()
+
+            self._spilled_batch_cache[batch_start] = states
+            if len(self._spilled_batch_cache) > SPILLED_BATCH_CACHE_SIZE:
+                self._spilled_batch_cache.popitem(last=False)
+
+        return states[index - batch_start]
+
+
+class _SpillSegment:
+    """Part of the spill file of StateHistory together with the FrameSnapshots its batches
+    refer to. These get freed together when the segment is dropped."""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix="thonny_states_")
+        self.size = 0
+        self.snapshots = []
+        self._snapshot_indices = {}  # id(snapshot) -> index in snapshots
+        self._mmap = None
+
+    def get_snapshot_index(self, snapshot):
+        index = self._snapshot_indices.get(id(snapshot))
+        if index is None:
+            index = len(self.snapshots)
+            self.snapshots.append(snapshot)
+            self._snapshot_indices[id(snapshot)] = index
+        return index
+
+    def read(self, offset, length):
+        if self._mmap is None or len(self._mmap) < offset + length:
+            if self._mmap is not None:
+                self._mmap.close()
+            self.file.flush()
+            self._mmap = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+        return self._mmap[offset : offset + length]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.file.close()
+        self.snapshots = []
+        self._snapshot_indices = {}
+
+
+def _load_snapshot(index):
+    raise AssertionError("Snapshots are loaded by _StateUnpickler")
+
+
+class _StateUnpickler(pickle.Unpickler):
+    """Loads the batches of StateHistory, taking FrameSnapshots from its snapshot table"""
+
+    def __init__(self, fp, snapshot_table):
+        super().__init__(fp)
+        self._snapshot_table = snapshot_table
+
+    def find_class(self, module, name):
+        if module == __name__ and name == _load_snapshot.__name__:
+            return self._snapshot_table.__getitem__
+        return super().find_class(module, name)
+
+
+def _get_source_key(source, filename):
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    return hashlib.sha1(filename.encode("utf-8") + b"\0" + source).hexdigest()
+
+
+def _get_instrumented_code_cache_path(filename):
+    # one file per source file, like in __pycache__
+    name = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(
+        INSTRUMENTED_CODE_CACHE_DIR, "%s.%s.bin" % (name, sys.implementation.cache_tag)
+    )
@@ -15,6 +15,7 @@ from thonny.base_file_browser import (
     LocalFileDialog,
 )
 from thonny.common import (
+    WIRE_CODEC_FRAMED,
     InlineCommand,
     InlineResponse,
     ToplevelCommand,
@@ -70,11 +71,18 @@ class LocalCPythonProxy(SubprocessProxy):
                 {
                     "run.warn_module_shadowing": get_workbench().get_option(
                         "run.warn_module_shadowing"
-                    )
+                    ),
+                    "wire_codec": self.get_preferred_wire_codec(),
                 }
             ),
         ]
 
+    def get_preferred_wire_codec(self) -> str:
+        return WIRE_CODEC_FRAMED
+
+    def get_warm_backend_pool_size(self) -> int:
+        return get_workbench().get_option("run.warm_backend_pool_size")
+
     def can_be_isolated(self) -> bool:
         # Can't run in isolated mode as it would hide user site-packages
         return False
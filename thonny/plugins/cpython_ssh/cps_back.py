@@ -46,6 +46,8 @@ class SshCPythonBackend(BaseBackend, SshMixin):
         self._main_backend_is_fresh = True
 
         self._response_lock = threading.Lock()
+        # cancel_command gets forwarded from the reader thread
+        self._forward_lock = threading.Lock()
         self._start_response_forwarder()
         BaseBackend.__init__(self)
 
@@ -75,6 +77,11 @@ class SshCPythonBackend(BaseBackend, SshMixin):
             self._forward_incoming_command(cmd)
 
     def _handle_immediate_command(self, cmd: ImmediateCommand) -> None:
+        if cmd.name == "cancel_command":
+            # the command is queued in the remote process (if anywhere)
+            self._forward_incoming_command(cmd)
+            return
+
         SshMixin._handle_immediate_command(self, cmd)
         # It is possible that there is a command being executed both in the local and remote process,
         # interrupt them both
@@ -91,11 +98,12 @@ class SshCPythonBackend(BaseBackend, SshMixin):
     def _forward_incoming_command(self, msg):
         msg_str = serialize_message(msg, 1024)
 
-        for line in msg_str.splitlines(keepends=True):
-            self._proc.stdin.write(line)
-            self._proc.stdin.flush()
+        with self._forward_lock:
+            for line in msg_str.splitlines(keepends=True):
+                self._proc.stdin.write(line)
+                self._proc.stdin.flush()
 
-        self._proc.stdin.write("\n")
+            self._proc.stdin.write("\n")
 
     def _start_response_forwarder(self):
         logger.info("Starting response forwarder")
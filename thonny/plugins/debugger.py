@@ -30,7 +30,13 @@ from thonny.languages import tr
 from thonny.memory import VariablesFrame
 from thonny.misc_utils import running_on_mac_os, running_on_rpi, shorten_repr
 from thonny.tktextext import TextFrame
-from thonny.ui_utils import CommonDialog, get_hyperlink_cursor, get_tk_version_info, select_sequence
+from thonny.ui_utils import (
+    CommonDialog,
+    ems_to_pixels,
+    get_hyperlink_cursor,
+    get_tk_version_info,
+    select_sequence,
+)
 
 logger = getLogger(__name__)
 
@@ -56,6 +62,7 @@ class Debugger:
             cmd.setdefault(
                 frame_id=self._last_progress_message.stack[-1].id,
                 breakpoints=self.get_effective_breakpoints(command),
+                breakpoint_options=editors.get_current_breakpoint_options(),
                 state=self._last_progress_message.stack[-1].event,
                 focus=self._last_progress_message.stack[-1].focus,
                 allow_stepping_into_libraries=get_workbench().get_option(
@@ -65,6 +72,10 @@ class Debugger:
             if command == "run_to_cursor":
                 # cursor position was added as another breakpoint
                 cmd.name = "resume"
+            elif command == "step_back_to_cursor":
+                # ie. to the last time the line at cursor was visited
+                cmd.name = "seek"
+                cmd.filename, cmd.lineno = self.get_run_to_cursor_breakpoint()
 
             get_runner().send_command(cmd)
             if command == "resume":
@@ -93,14 +104,19 @@ class Debugger:
 
         if command == "run_to_cursor":
             return self.get_run_to_cursor_breakpoint() is not None
-        elif command == "step_back":
-            return (
-                self._last_progress_message
-                and self._last_progress_message["tracer_class"] == "NiceTracer"
-            )
+        elif command in ["step_back", "seek"]:
+            return self._can_go_back()
+        elif command == "step_back_to_cursor":
+            return self._can_go_back() and self.get_run_to_cursor_breakpoint() is not None
         else:
             return True
 
+    def _can_go_back(self):
+        return (
+            self._last_progress_message
+            and self._last_progress_message["tracer_class"] == "NiceTracer"
+        )
+
     def handle_debugger_progress(self, msg):
         self._last_brought_out_frame_id = None
 
@@ -145,6 +161,11 @@ class Debugger:
                 label=tr("Run to cursor"),
                 command=lambda: self.check_issue_command("run_to_cursor"),
             )
+            menu.add(
+                "command",
+                label=tr("Step back to cursor"),
+                command=lambda: self.check_issue_command("step_back_to_cursor"),
+            )
             menu.add("separator")
             menu.add("command", label="Copy", command=create_edit_command_handler("<<Copy>>"))
             menu.add(
@@ -219,7 +240,10 @@ class SingleWindowDebugger(Debugger):
 
         # show variables
         var_view = get_workbench().get_view("VariablesView")
-        if frame_info.code_name == "<module>":
+        if frame_info.globals is None:
+            # variables of outer frames are exported only on request
+            get_runner().send_command(InlineCommand("get_frame_info", frame_id=frame_info.id))
+        elif frame_info.code_name == "<module>":
             var_view.show_globals(frame_info.globals, frame_info.module_name)
         else:
             var_view.show_frame_variables(
@@ -329,9 +353,8 @@ class StackedWindowsDebugger(Debugger):
         self._main_frame_visualizer.bring_out_frame(frame_id)
 
         # show variables
-        var_view = get_workbench().get_view("VariablesView")
         frame_info = self.get_frame_by_id(frame_id)
-        var_view.show_globals(frame_info.globals, frame_info.module_name)
+        _show_frame_globals(frame_info)
 
     def handle_debugger_return(self, msg):
         if self._main_frame_visualizer is None:
@@ -973,8 +996,7 @@ class DialogVisualizer(CommonDialog, FrameVisualizer):
 
     def bring_out_this_frame(self):
         self.focus_set()  # no effect when clicking on stack view
-        var_view = get_workbench().get_view("VariablesView")
-        var_view.show_globals(self._frame_info.globals, self._frame_info.module_name)
+        _show_frame_globals(self._frame_info)
 
     def _on_focus(self, event):
         # TODO: bring out main frame when main window gets focus
@@ -997,6 +1019,7 @@ class DialogVisualizer(CommonDialog, FrameVisualizer):
 class FunctionCallDialog(DialogVisualizer):
     def __init__(self, master, frame_info):
         DialogVisualizer.__init__(self, master, frame_info)
+        get_workbench().bind("get_locals_response", self._handle_get_locals_response, True)
 
     def _init_layout_widgets(self, master, frame_info):
         DialogVisualizer._init_layout_widgets(self, master, frame_info)
@@ -1015,7 +1038,21 @@ class FunctionCallDialog(DialogVisualizer):
 
     def _update_this_frame(self, msg, frame_info):
         DialogVisualizer._update_this_frame(self, msg, frame_info)
-        self._locals_frame.update_variables(frame_info.locals)
+        if frame_info.globals is None:
+            # variables of outer frames are not included in progress messages
+            get_runner().send_command(InlineCommand("get_locals", frame_id=frame_info.id))
+        else:
+            self._locals_frame.update_variables(frame_info.locals)
+
+    def _handle_get_locals_response(self, msg):
+        if msg.get("frame_id") == self._frame_id and "locals" in msg:
+            self._locals_frame.update_variables(msg["locals"])
+
+    def close(self, frame_id=None):
+        if frame_id is None or frame_id == self._frame_id:
+            get_workbench().unbind("get_locals_response", self._handle_get_locals_response)
+
+        super().close(frame_id)
 
 
 class ModuleLoadDialog(DialogVisualizer):
@@ -1023,6 +1060,15 @@ class ModuleLoadDialog(DialogVisualizer):
         DialogVisualizer.__init__(self, text_frame, frame_info)
 
 
+def _show_frame_globals(frame_info):
+    if frame_info.globals is None:
+        # variables of outer frames are exported only on request
+        get_runner().send_command(InlineCommand("get_globals", module_name=frame_info.module_name))
+    else:
+        var_view = get_workbench().get_view("VariablesView")
+        var_view.show_globals(frame_info.globals, frame_info.module_name)
+
+
 class StackView(ui_utils.TreeFrame):
     def __init__(self, master):
         super().__init__(
@@ -1080,6 +1126,79 @@ class StackView(ui_utils.TreeFrame):
                 _current_debugger.bring_out_frame(frame_id)
 
 
+class HistoryView(ttk.Frame):
+    """Slider for moving between the states recorded by the nicer debugger"""
+
+    def __init__(self, master):
+        super().__init__(master)
+
+        self._updating = False
+        self._requested_state_index = None
+
+        self._scale = ttk.Scale(
+            self, from_=0, to=0, orient=tk.HORIZONTAL, command=self._on_scale_change
+        )
+        self._scale.grid(row=0, column=0, sticky="ew", padx=ems_to_pixels(0.5))
+        self._label = ttk.Label(self, text="", width=15, anchor="e")
+        self._label.grid(row=0, column=1, sticky="e", padx=ems_to_pixels(0.5))
+        self.columnconfigure(0, weight=1)
+
+        get_workbench().bind("DebuggerResponse", self._handle_debugger_response, True)
+        get_workbench().bind("ToplevelResponse", self._handle_toplevel_response, True)
+        self._clear()
+
+    def _clear(self):
+        self._requested_state_index = None
+        self._set_scale(0, 0, 0)
+        self._scale.state(["disabled"])
+        self._label.configure(text="")
+
+    def _set_scale(self, value, min_value, max_value):
+        self._updating = True
+        try:
+            self._scale.configure(from_=min_value, to=max_value)
+            self._scale.set(value)
+        finally:
+            self._updating = False
+
+    def _handle_debugger_response(self, msg):
+        if msg.get("state_index") is None:
+            # other tracers don't record the history
+            self._clear()
+            return
+
+        self._scale.state(["!disabled"])
+        # oldest states may have been dropped by the back-end
+        first_state_index = msg.get("first_state_index", 0)
+        self._set_scale(msg.state_index, first_state_index, msg.state_count - 1)
+        self._label.configure(text="%d / %d" % (msg.state_index + 1, msg.state_count))
+
+        if (
+            self._requested_state_index is not None
+            and self._requested_state_index != msg.state_index
+            and self._requested_state_index >= first_state_index
+        ):
+            # the slider was moved further while waiting for the response
+            self.after_idle(self._request_state, self._requested_state_index)
+        else:
+            self._requested_state_index = None
+
+    def _handle_toplevel_response(self, msg):
+        self._clear()
+
+    def _on_scale_change(self, value):
+        if self._updating:
+            return
+
+        self._request_state(round(float(value)))
+
+    def _request_state(self, state_index):
+        self._requested_state_index = state_index
+        debugger = get_current_debugger()
+        if debugger is not None and debugger.command_enabled("seek"):
+            debugger.check_issue_command("seek", state_index=state_index)
+
+
 class ExceptionView(TextFrame):
     def __init__(self, master):
         super().__init__(
@@ -1292,6 +1411,8 @@ def load_plugin() -> None:
         "debugger.preferred_debugger", "faster" if running_on_rpi() else "nicer"
     )
     get_workbench().set_default("debugger.allow_stepping_into_libraries", False)
+    get_workbench().set_default("debugger.fast_tracer_engine", "monitoring")
+    get_workbench().set_default("debugger.max_states_in_memory", 10000)
 
     get_workbench().add_command(
         "runresume",
@@ -1407,6 +1528,15 @@ def load_plugin() -> None:
         include_in_toolbar=False,
     )
 
+    get_workbench().add_command(
+        "step_back_to_cursor",
+        "run",
+        tr("Step back to cursor"),
+        lambda: _issue_debugger_command("step_back_to_cursor"),
+        tester=lambda: _debugger_command_enabled("step_back_to_cursor"),
+        group=30,
+    )
+
     get_workbench().add_command(
         "step_back",
         "run",
@@ -1420,6 +1550,7 @@ def load_plugin() -> None:
 
     get_workbench().add_view(StackView, tr("Stack"), "se")
     get_workbench().add_view(ExceptionView, tr("Exception"), "s")
+    get_workbench().add_view(HistoryView, tr("Debugger history"), "s")
     get_workbench().bind("DebuggerResponse", _handle_debugger_progress, True)
     get_workbench().bind("ToplevelResponse", _handle_toplevel_response, True)
     get_workbench().bind("debugger_return_response", _handle_debugger_return, True)
@@ -42,13 +42,23 @@ class HeapView(MemoryFrame):
         )
 
     def _update_data(self, data):
-        self._clear_tree()
-        for value_id in sorted(data.keys()):
-            node_id = self.tree.insert("", "end")
-            self.tree.set(node_id, "id", format_object_id(value_id))
-            self.tree.set(
-                node_id, "value", shorten_repr(data[value_id].repr, MAX_REPR_LENGTH_IN_GRID)
-            )
+        # Most of the heap stays the same between responses, so update the rows in place
+        node_ids = {
+            parse_object_id(self.tree.set(iid, "id")): iid for iid in self.tree.get_children()
+        }
+        for value_id in node_ids:
+            if value_id not in data:
+                self.tree.delete(node_ids[value_id])
+
+        for i, value_id in enumerate(sorted(data.keys())):
+            node_id = node_ids.get(value_id)
+            if node_id is None:
+                node_id = self.tree.insert("", i)
+                self.tree.set(node_id, "id", format_object_id(value_id))
+
+            description = shorten_repr(data[value_id].repr, MAX_REPR_LENGTH_IN_GRID)
+            if self.tree.set(node_id, "value") != description:
+                self.tree.set(node_id, "value", description)
 
     def before_show(self):
         self._request_heap_data(even_when_hidden=True)
@@ -166,6 +166,8 @@ class MicroPythonBackend(MainBackend, ABC):
     def _handle_immediate_command(self, cmd: ImmediateCommand) -> None:
         if cmd["name"] == "interrupt":
             self._interrupt()
+        elif cmd["name"] == "cancel_command":
+            self._cancel_command(cmd)
 
     def _interrupt(self):
         # don't interrupt while command or input is being written
@@ -28,6 +28,16 @@ class RunDebugConfigurationPage(ConfigurationPage):
             "run.warn_module_shadowing",
             tr("Warn if a user module shadows a library module"),
         )
+        add_option_combobox(
+            self,
+            "run.warm_backend_pool_size",
+            tr("Standby back-end processes"),
+            choices=[0, 1, 2],
+            width=8,
+            tooltip=tr(
+                "Keeps clean local Python processes ready, so that Stop/Restart and Run are faster."
+            ),
+        )
 
         add_vertical_separator(self)
 
@@ -63,6 +73,18 @@ class RunDebugConfigurationPage(ConfigurationPage):
             tooltip=tr("(used when clicking Debug toolbar button)"),
         )
 
+        add_option_combobox(
+            self,
+            "debugger.fast_tracer_engine",
+            tr("Tracing engine of the faster debugger"),
+            choices=["monitoring", "settrace"],
+            width=10,
+            tooltip=tr(
+                "'monitoring' (sys.monitoring) is used when the back-end supports it,\n"
+                + "'settrace' is the classic implementation."
+            ),
+        )
+
         add_option_combobox(
             self,
             "run.birdseye_port",
@@ -32,6 +32,33 @@ class ShellConfigurationPage(ConfigurationPage):
             choices=[100, 500, 1000, 5000, 10000, 50000, 100000],
         )
 
+        add_option_checkbox(
+            self,
+            "shell.virtualized_scrollback",
+            tr("Keep older lines in a separate store and bring them back when scrolling up"),
+        )
+
+        add_option_checkbox(
+            self,
+            "shell.scrollback_file_backed",
+            tr("Keep the stored lines in a temporary file instead of memory"),
+        )
+
+        add_option_checkbox(
+            self,
+            "shell.save_history",
+            tr("Remember commands between sessions (search with Ctrl+R)"),
+        )
+
+        add_option_combobox(
+            self,
+            "shell.firehose_threshold",
+            tr("Show only the tail of output arriving faster than (characters per second)")
+            + "\n"
+            + tr("0 means always show everything"),
+            choices=[0, 100000, 300000, 1000000, 3000000],
+        )
+
         add_option_combobox(
             self,
             "shell.squeeze_threshold",
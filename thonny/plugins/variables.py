@@ -33,6 +33,12 @@ class VariablesView(VariablesFrame):
         # records last info from progress messages
         self._last_active_info = None
 
+        # __main__ globals as maintained by deltas and full snapshots, with backend's version number
+        self._main_globals = {}
+        self._main_globals_version = None
+        # the dict which was last presented with show_globals (if it's still presented)
+        self._shown_globals = None
+
     def _update_back_button(self, visible):
         if visible:
             assert self._last_active_info is not None
@@ -49,8 +55,14 @@ class VariablesView(VariablesFrame):
             assert len(self._last_active_info) == 4
             self.show_frame_variables(*self._last_active_info)
 
+    def _clear_tree(self):
+        super()._clear_tree()
+        self._shown_globals = None
+
     def _handle_backend_restart(self, event):
         self._clear_tree()
+        self._main_globals = {}
+        self._main_globals_version = None
 
     def _handle_get_globals_response(self, event):
         if "error" in event:
@@ -58,6 +70,9 @@ class VariablesView(VariablesFrame):
         elif "globals" not in event:
             self._handle_error_response(str(event))
         else:
+            if event["module_name"] == "__main__" and "globals_version" in event:
+                self._main_globals = event["globals"]
+                self._main_globals_version = event["globals_version"]
             self.show_globals(event["globals"], event["module_name"])
 
     def _handle_error_response(self, error_msg):
@@ -66,16 +81,53 @@ class VariablesView(VariablesFrame):
         self.show_error("Could not query global variables: " + str(error_msg))
 
     def _handle_toplevel_response(self, event):
-        if "globals" in event:
+        if "globals_delta" in event:
+            self._apply_globals_delta(event["globals_delta"])
+        elif "globals" in event:
+            self._main_globals_version = None
             self.show_globals(event["globals"], "__main__")
         else:
             # MicroPython
             get_runner().send_command(InlineCommand("get_globals", module_name="__main__"))
 
-    def show_globals(self, globals_, module_name, is_active=True):
+    def _apply_globals_delta(self, delta):
+        if delta["base_version"] == 0:
+            base = {}
+        elif delta["base_version"] == self._main_globals_version:
+            base = self._main_globals
+        else:
+            # Missed something (eg. the view was opened later). Ask for full snapshot
+            logger.info(
+                "Globals version gap (%r vs %r), resyncing",
+                delta["base_version"],
+                self._main_globals_version,
+            )
+            get_runner().send_command(InlineCommand("get_globals", module_name="__main__"))
+            return
+
+        globals_ = dict(base)
+        globals_.update(delta["changed"])
+        for name in delta["removed"]:
+            globals_.pop(name, None)
+
+        can_patch = self._shown_globals is base and base is self._main_globals
+        self._main_globals = globals_
+        self._main_globals_version = delta["version"]
+
+        if can_patch:
+            self.show_globals(globals_, "__main__", changes=(delta["changed"], delta["removed"]))
+        else:
+            self.show_globals(globals_, "__main__")
+
+    def show_globals(self, globals_, module_name, is_active=True, changes=None):
+        """If changes (changed and removed variables) are given, then globals_ is assumed to be
+        the result of applying these to the currently presented globals"""
         self.clear_error()
-        # TODO: update only if something has changed
-        self.update_variables(globals_)
+        if changes is None:
+            self.update_variables(globals_)
+        else:
+            self.patch_variables(*changes)
+        self._shown_globals = globals_
 
         if self.containing_notebook is not None:
             if module_name == "__main__":
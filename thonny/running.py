@@ -10,7 +10,6 @@ shell becomes kind of title for the execution.
 import collections
 import os.path
 import queue
-import re
 import shlex
 import shutil
 import subprocess
@@ -41,12 +40,14 @@ from thonny import (
 from thonny.common import (
     INTERNAL_ERROR_STATUS_CODE,
     PROCESS_ACK,
+    WIRE_CODEC_REPR,
     BackendEvent,
     CommandToBackend,
     DebuggerCommand,
     DebuggerResponse,
     DistInfo,
     EOFCommand,
+    ImmediateCommand,
     InlineCommand,
     InlineResponse,
     InputSubmission,
@@ -64,6 +65,7 @@ from thonny.common import (
     update_system_path,
 )
 from thonny.editors import (
+    get_current_breakpoint_options,
     get_current_breakpoints,
     get_saved_current_script_path,
     get_target_dir_from_uri,
@@ -80,7 +82,7 @@ from thonny.misc_utils import (
     show_command_not_available_in_flatpak_message,
     uri_to_target_path,
 )
-from thonny.ui_utils import select_sequence, show_dialog
+from thonny.ui_utils import open_path_in_system_file_manager, select_sequence, show_dialog
 from thonny.workdlg import WorkDialog
 
 logger = getLogger(__name__)
@@ -94,12 +96,50 @@ EDITOR_CONTENT_TOKEN = "$EDITOR_CONTENT"
 
 INTERRUPT_SEQUENCE = "<Control-c>"
 
-CSI_TERMINATOR = re.compile("[@-~]")
-OSC_TERMINATOR = re.compile(r"\a|\x1B\\")
-
 TERMINATION_TIMEOUT = 2
 TERMINATION_POLL_INTERVAL = 0.02
 
+# How long the UI thread may spend on handling backend messages before letting Tk redraw
+MESSAGE_PROCESSING_TIME_BUDGET = 0.015
+# Used when the proxy notifies about new messages itself (just a safety net)
+IDLE_MESSAGE_POLL_INTERVAL_MS = 1000
+# Used when new messages need to be discovered by polling
+BUSY_MESSAGE_POLL_INTERVAL_MS = 20
+
+# Warm standby back-ends are started after this delay, so that they don't slow down the active one
+WARM_BACKEND_START_DELAY_MS = 1000
+MAX_WARM_BACKENDS = 2
+# How long the UI thread waits for a warm back-end to acknowledge its start before falling back
+# to starting a new process
+WARM_BACKEND_READY_TIMEOUT = 1.0
+
+# How long closing Thonny waits for the output log to get written
+OUTPUT_LOG_CLOSE_TIMEOUT = 1.0
+# Program output gets logged only for these commands (eg. not for %Reset)
+LOGGED_COMMANDS = {"Run", "Debug", "FastDebug"}
+
+# Inline commands which only query the state of the back-end. These may be sent
+# without waiting for the responses of the preceding ones
+PIPELINABLE_INLINE_COMMANDS = {
+    "get_active_distributions",
+    "get_dirs_children_info",
+    "get_frame_info",
+    "get_fs_info",
+    "get_globals",
+    "get_heap",
+    "get_locals",
+    "get_object_info",
+}
+# Newer command of the same kind makes the response of the older one useless
+SUPERSEDABLE_INLINE_COMMANDS = {
+    "get_frame_info",
+    "get_globals",
+    "get_heap",
+    "get_locals",
+    "get_object_info",
+}
+MAX_INLINE_COMMANDS_IN_FLIGHT = 4
+
 # other components may turn it on in order to avoid grouping output lines into one event
 io_animation_required = False
 
@@ -145,17 +185,35 @@ class Runner:
         get_workbench().set_default("run.allow_running_unnamed_programs", True)
         get_workbench().set_default("run.auto_cd", True)
         get_workbench().set_default("run.warn_module_shadowing", True)
+        get_workbench().set_default("run.message_queue_high_watermark", 100)
+        get_workbench().set_default("run.message_queue_low_watermark", 20)
+        get_workbench().set_default("run.coalesce_queued_output", True)
+        get_workbench().set_default("run.warm_backend_pool_size", 0)
+        get_workbench().set_default("run.log_program_output", False)
+        get_workbench().set_default(
+            "run.output_log_dir", os.path.join(get_thonny_user_dir(), "output_logs")
+        )
+        get_workbench().set_default("run.output_log_max_bytes", 10 * 1024 * 1024)
+        get_workbench().set_default("run.output_log_backup_count", 5)
 
         self._init_commands()
         self._state = "starting"
         self._proxy: Optional[BackendProxy] = None
         self._publishing_events = False
         self._polling_after_id = None
+        self._message_wakeup: Optional[MessageWakeup] = None
+        self._warm_backend_pool = WarmBackendPool()
         self._postponed_commands = []  # type: List[CommandToBackend]
         self._thread_commands = queue.Queue()
         self._thread_command_results = {}
         self._running_thread_command_ids = set()
         self._last_accepted_backend_command = None
+        self._output_log_writer: Optional[OutputLogWriter] = None
+
+        get_workbench().bind("WorkbenchClose", self._on_workbench_close, True)
+        get_workbench().bind("ProgramOutput", self._log_program_output, True)
+        get_workbench().bind("ToplevelResponse", self._close_output_log, True)
+        get_workbench().bind("BackendTerminated", self._close_output_log, True)
 
     def start(self) -> None:
         global _console_allocated
@@ -261,6 +319,27 @@ class Runner:
             group=100,
         )
 
+        def toggle_output_logging():
+            variable = get_workbench().get_variable("run.log_program_output")
+            variable.set(not variable.get())
+
+        get_workbench().add_command(
+            "log_program_output",
+            "run",
+            tr("Log program output to file"),
+            toggle_output_logging,
+            flag_name="run.log_program_output",
+            group=110,
+        )
+
+        get_workbench().add_command(
+            "show_output_logs",
+            "run",
+            tr("Show output logs"),
+            self._cmd_show_output_logs,
+            group=110,
+        )
+
     def get_state(self) -> str:
         """State is one of "running", "waiting_debugger_command", "waiting_toplevel_command" """
         return self._state
@@ -314,13 +393,22 @@ class Runner:
         # Attach extra info
         if "debug" in cmd.name.lower():
             cmd["breakpoints"] = get_current_breakpoints()
+            cmd["breakpoint_options"] = get_current_breakpoint_options()
+            if cmd.name == "FastDebug":
+                cmd["tracer_engine"] = get_workbench().get_option(
+                    "debugger.fast_tracer_engine", "monitoring"
+                )
+            else:
+                cmd["max_states_in_memory"] = get_workbench().get_option(
+                    "debugger.max_states_in_memory", 10000
+                )
 
         if "id" not in cmd:
             cmd["id"] = generate_command_id()
 
         cmd["local_cwd"] = get_workbench().get_local_cwd()
 
-        if self._proxy.running_inline_command and isinstance(cmd, InlineCommand):
+        if isinstance(cmd, InlineCommand) and not self._can_send_inline_command(cmd):
             reason = "running another inline command"
             cur_cmd_name = getattr(self._last_accepted_backend_command, "name", None)
             if cur_cmd_name:
@@ -328,6 +416,9 @@ class Runner:
             self._postpone_command(cmd, reason)
             return
 
+        if isinstance(cmd, InlineCommand):
+            self._cancel_superseded_inline_commands(cmd)
+
         # Offer the command
         logger.debug("Runner: sending command %r to proxy: %s", cmd.name, cmd)
         try:
@@ -349,15 +440,52 @@ class Runner:
             get_workbench().event_generate("CommandAccepted", command=cmd)
             self._last_accepted_backend_command = cmd
             if isinstance(cmd, InlineCommand):
-                self._proxy.running_inline_command = True
+                self._proxy.inline_commands_in_flight[cmd["id"]] = cmd
 
         if isinstance(cmd, (ToplevelCommand, DebuggerCommand)):
             self._set_state("running")
 
         if cmd.name[0].isupper():
+            if (
+                isinstance(cmd, ToplevelCommand)
+                and cmd.name in LOGGED_COMMANDS
+                and get_workbench().get_option("run.log_program_output")
+            ):
+                self._open_output_log(cmd)
+
+            # Responses to earlier inline commands may not arrive anymore
+            self._proxy.inline_commands_in_flight.clear()
             # This may be only logical restart, which does not look like restart to the runner
             get_workbench().event_generate("BackendRestart", full=False)
 
+    def _can_send_inline_command(self, cmd: InlineCommand) -> bool:
+        in_flight = self._proxy.inline_commands_in_flight.values()
+        if not in_flight:
+            return True
+
+        return (
+            cmd.name in PIPELINABLE_INLINE_COMMANDS
+            and len(in_flight) < MAX_INLINE_COMMANDS_IN_FLIGHT
+            and all(older_cmd.name in PIPELINABLE_INLINE_COMMANDS for older_cmd in in_flight)
+        )
+
+    def _cancel_superseded_inline_commands(self, cmd: InlineCommand) -> None:
+        if cmd.name not in SUPERSEDABLE_INLINE_COMMANDS:
+            return
+
+        for older_cmd in self._proxy.inline_commands_in_flight.values():
+            if (
+                older_cmd.name == cmd.name
+                and older_cmd.get("module_name") == cmd.get("module_name")
+                and older_cmd.get("frame_id") == cmd.get("frame_id")
+                and not older_cmd.get("cancelled")
+                # someone is waiting for this response
+                and older_cmd["id"] not in self._running_thread_command_ids
+            ):
+                logger.info("Cancelling superseded command %s", older_cmd["id"])
+                older_cmd["cancelled"] = True
+                self._proxy.cancel_command(older_cmd["id"])
+
     def send_command_and_wait(self, cmd: InlineCommand, dialog_title: str) -> MessageFromBackend:
         dlg = InlineCommandDialog(get_workbench(), cmd, title=dialog_title + " ...")
         show_dialog(dlg)
@@ -699,8 +827,11 @@ class Runner:
         return proxy and proxy.is_connected()
 
     def _poll_backend_messages(self) -> None:
-        """I chose polling instead of event_generate in listener thread,
-        because event_generate across threads is not reliable
+        """Processes the messages available at the moment and decides when to look again.
+
+        When the proxy can notify about new messages (via MessageWakeup), the timer set here
+        is only a safety net and next batch gets processed as soon as reader thread signals.
+        Otherwise falls back to polling, as event_generate across threads is not reliable
         http://www.thecodingforums.com/threads/more-on-tk-event_generate-and-threads.359615/
         """
         self._polling_after_id = None
@@ -710,27 +841,48 @@ class Runner:
         if self._proxy.has_next_message():
             # Some events didn't fit into this batch. Start the next batch as soon as possible
             self._polling_after_id = get_workbench().after_idle(self._poll_backend_messages)
+        elif self._message_wakeup is not None and self._proxy.notifies_about_new_messages():
+            self._polling_after_id = get_workbench().after(
+                IDLE_MESSAGE_POLL_INTERVAL_MS, self._poll_backend_messages
+            )
         else:
             # take it easy
             self._polling_after_id = get_workbench().after(
-                20, lambda: get_workbench().after_idle(self._poll_backend_messages)
+                BUSY_MESSAGE_POLL_INTERVAL_MS,
+                lambda: get_workbench().after_idle(self._poll_backend_messages),
             )
 
+    def _on_backend_messages_available(self) -> None:
+        if self._proxy is None:
+            return
+
+        if self._polling_after_id is not None:
+            get_workbench().after_cancel(self._polling_after_id)
+            self._polling_after_id = None
+
+        self._poll_backend_messages()
+
+    def _ensure_message_wakeup(self) -> None:
+        if self._message_wakeup is not None or not MessageWakeup.is_supported():
+            return
+
+        try:
+            self._message_wakeup = MessageWakeup(self._on_backend_messages_available)
+        except Exception:
+            logger.exception("Could not create message wakeup, falling back to polling")
+
     def _pull_backend_messages(self):
-        # Don't process too many messages in single batch, allow screen updates
+        # Don't spend too much time in single batch, allow screen updates
         # and user actions between batches.
         # Mostly relevant when backend prints a lot quickly.
         # TODO: Should I leave new messages (caused by processing this batch) for next batch?
-        msg_count = 0
-        max_msg_count = 10
-        while self._proxy is not None and msg_count < max_msg_count:
+        deadline = time.perf_counter() + MESSAGE_PROCESSING_TIME_BUDGET
+        while self._proxy is not None and time.perf_counter() < deadline:
             try:
                 msg = self._proxy.fetch_next_message()
                 if not msg:
                     break
                 logger.debug("RUNNER GOT: %s in state: %s", msg.event_type, self.get_state())
-
-                msg_count += 1
             except BackendTerminatedError as exc:
                 logger.info("Backend terminated with code: %r", exc.returncode)
                 self._handle_backend_termination(exc.returncode)
@@ -742,8 +894,11 @@ class Runner:
             elif isinstance(msg, DebuggerResponse):
                 self._set_state("waiting_debugger_command")
             elif isinstance(msg, InlineResponse):
-                # next inline command won't be sent before response from the last has arrived
-                self._proxy.running_inline_command = False
+                # makes room for the postponed inline commands
+                self._proxy.finish_inline_command(msg.get("command_id"))
+                if msg.get("cancelled"):
+                    logger.info("Back-end skipped cancelled command %s", msg.get("command_id"))
+                    continue
             else:
                 "other messages don't affect the state"
 
@@ -821,7 +976,10 @@ class Runner:
         self._set_state("running")
         self._proxy = None
         logger.info("Starting backend %r", backend_class)
+        self._ensure_message_wakeup()
         self._proxy = backend_class(clean)
+        if self._message_wakeup is not None:
+            self._proxy.set_message_notifier(self._message_wakeup.signal)
 
         if not first:
             get_shell().restart(automatic=automatic, was_running=was_running)
@@ -847,6 +1005,43 @@ class Runner:
     def get_backend_proxy(self) -> "BackendProxy":
         return self._proxy
 
+    def get_warm_backend_pool(self) -> "WarmBackendPool":
+        return self._warm_backend_pool
+
+    def _on_workbench_close(self, event=None) -> None:
+        self._warm_backend_pool.clear()
+        self._close_output_log(timeout=OUTPUT_LOG_CLOSE_TIMEOUT)
+
+    def _open_output_log(self, cmd: ToplevelCommand) -> None:
+        self._close_output_log()
+
+        if cmd.get("args"):
+            name = os.path.splitext(os.path.basename(cmd["args"][0]))[0]
+        else:
+            name = cmd.name.lower()
+
+        log_dir = get_workbench().get_option("run.output_log_dir")
+        path = os.path.join(log_dir, "%s_%s.log" % (name, time.strftime("%Y%m%d-%H%M%S")))
+        self._output_log_writer = OutputLogWriter(
+            path,
+            get_workbench().get_option("run.output_log_max_bytes"),
+            get_workbench().get_option("run.output_log_backup_count"),
+        )
+
+    def _log_program_output(self, msg) -> None:
+        if self._output_log_writer is not None:
+            self._output_log_writer.write(msg["data"])
+
+    def _close_output_log(self, event=None, timeout: Optional[float] = None) -> None:
+        if self._output_log_writer is not None:
+            self._output_log_writer.close(timeout)
+            self._output_log_writer = None
+
+    def _cmd_show_output_logs(self) -> None:
+        log_dir = get_workbench().get_option("run.output_log_dir")
+        os.makedirs(log_dir, exist_ok=True)
+        open_path_in_system_file_manager(log_dir)
+
     def _check_alloc_console(self) -> None:
         if sys.executable.endswith("pythonw.exe"):
             # These don't have console allocated.
@@ -950,7 +1145,41 @@ class BackendProxy(ABC):
         Backend is considered ready when the runner gets a ToplevelResponse
         with attribute "welcome_text" from fetch_next_message.
         """
-        self.running_inline_command = False
+        # Inline commands sent to the back-end, which haven't got their responses yet
+        self.inline_commands_in_flight: Dict[str, InlineCommand] = {}
+        self._message_notifier: Optional[Callable[[], None]] = None
+
+    @property
+    def running_inline_command(self) -> bool:
+        return bool(self.inline_commands_in_flight)
+
+    def finish_inline_command(self, command_id: Optional[str]) -> None:
+        if command_id is None:
+            # Can't tell which one was completed
+            self.inline_commands_in_flight.clear()
+        else:
+            self.inline_commands_in_flight.pop(command_id, None)
+
+    def cancel_command(self, command_id: str) -> None:
+        """Asks the back-end to skip the command, unless it has been started already.
+
+        Back-end responds to a skipped command with an InlineResponse having
+        attribute cancelled=True."""
+        self.send_command(ImmediateCommand("cancel_command", command_id=command_id))
+
+    def set_message_notifier(self, notifier: Callable[[], None]) -> None:
+        """Notifier is a thread-safe function, which should be called after
+        new messages become available for fetch_next_message"""
+        self._message_notifier = notifier
+
+    def notifies_about_new_messages(self) -> bool:
+        """Whether the proxy calls message notifier (instead of relying on polling)"""
+        return False
+
+    def _notify_new_messages(self) -> None:
+        notifier = self._message_notifier
+        if notifier is not None:
+            notifier()
 
     @abstractmethod
     def send_command(self, cmd: CommandToBackend) -> Optional[str]:
@@ -1195,6 +1424,8 @@ class SubprocessProxy(BackendProxy, ABC):
         self._reported_executable = None
         self._gui_update_loop_id = None
         self._in_venv = None
+        # Commands are sent with repr codec until the backend confirms the preferred one
+        self._wire_codec = WIRE_CODEC_REPR
         self._cwd = self._get_initial_cwd()  # pylint: disable=assignment-from-none
         self._start_background_process(clean=clean)
         self._have_check_remembered_current_configuration = False
@@ -1202,6 +1433,13 @@ class SubprocessProxy(BackendProxy, ABC):
     def compute_mgmt_executable(self) -> str:
         return get_front_interpreter_for_subprocess()
 
+    def get_preferred_wire_codec(self) -> str:
+        """Codec to be offered to the backend. The reader understands all codecs anyway.
+
+        Subclasses should override this only if their backend process talks to
+        the frontend directly (ie. there is no forwarding process in between)."""
+        return WIRE_CODEC_REPR
+
     def _check_remember_current_configuration(self) -> None:
         current_configuration = self.get_current_switcher_configuration()
         if not self._should_remember_configuration(current_configuration):
@@ -1276,9 +1514,12 @@ class SubprocessProxy(BackendProxy, ABC):
         ]
 
     def _start_background_process(self, clean=None, extra_args=[]):
-        # deque, because in one occasion I need to put messages back
         logger.info("Starting background process, clean: %r, extra_args: %r", clean, extra_args)
-        self._response_queue = collections.deque()
+        self._response_queue = BackendMessageQueue(
+            get_workbench().get_option("run.message_queue_high_watermark"),
+            get_workbench().get_option("run.message_queue_low_watermark"),
+            get_workbench().get_option("run.coalesce_queued_output"),
+        )
 
         exe_validation_error = self.get_mgmt_executable_validation_error()
         if exe_validation_error:
@@ -1295,28 +1536,29 @@ class SubprocessProxy(BackendProxy, ABC):
         if self.can_be_isolated():
             cmd_line.insert(1, "-s")
 
-        creationflags = 0
-        if running_on_windows():
-            creationflags = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
-
-        logger.info("Starting the backend: %s %s", cmd_line, get_workbench().get_local_cwd())
-
-        self._proc = subprocess.Popen(
-            cmd_line,
-            executable=cmd_line[0],
-            bufsize=0,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self._get_launch_cwd(),
-            env=self._get_environment(),
-            universal_newlines=True,
-            creationflags=creationflags,
-            encoding="utf-8",
-        )
+        cwd = self._get_launch_cwd()
+        env = self._get_environment()
+        pool = get_runner().get_warm_backend_pool()
+        warm_pool_size = self.get_warm_backend_pool_size()
+
+        self._proc = None
+        stdout_line = None
+        if warm_pool_size > 0:
+            self._proc = pool.take(cmd_line, cwd, env)
 
-        # read success acknowledgement
-        stdout_line = self._proc.stdout.readline().strip("\r\n")
+        if self._proc is not None:
+            logger.info("Using a warm backend process %s", self._proc.pid)
+            stdout_line = PROCESS_ACK
+        else:
+            logger.info("Starting the backend: %s %s", cmd_line, get_workbench().get_local_cwd())
+            self._proc = popen_backend_process(cmd_line, cwd, env)
+
+        # Also gets rid of the warm processes with outdated configuration
+        pool.refill(cmd_line, cwd, env, warm_pool_size)
+
+        if stdout_line is None:
+            # read success acknowledgement
+            stdout_line = self._proc.stdout.readline().strip("\r\n")
 
         # only attempt initial input if process started nicely,
         # otherwise can't read the error from stderr
@@ -1338,6 +1580,13 @@ class SubprocessProxy(BackendProxy, ABC):
                 f"Could not start back-end process, got {stdout_line!r} instead of {PROCESS_ACK!r}"
             )
 
+    def get_warm_backend_pool_size(self) -> int:
+        """How many clean back-end processes should be kept ready for restarts.
+
+        Only for proxies, whose back-end processes don't hold any exclusive resources
+        (eg. a serial connection) before getting the first command."""
+        return 0
+
     def get_mgmt_executable_validation_error(self) -> Optional[str]:
         if not os.path.isfile(self._mgmt_executable):
             return f"INTERNAL ERROR: interpreter {self._mgmt_executable!r} not found."
@@ -1377,7 +1626,7 @@ class SubprocessProxy(BackendProxy, ABC):
             return
 
         try:
-            self._proc.stdin.write(serialize_message(msg) + "\n")
+            self._proc.stdin.write(serialize_message(msg, codec=self._wire_codec) + "\n")
             self._proc.stdin.flush()
         except BrokenPipeError:
             import traceback
@@ -1411,6 +1660,10 @@ class SubprocessProxy(BackendProxy, ABC):
         self._close_backend()
 
     def _close_backend(self):
+        if self._response_queue is not None:
+            # release reader threads possibly waiting for free space
+            self._response_queue.close()
+
         if self._proc is not None and self._proc.poll() is None:
             logger.info("Trying to terminate backend process")
             self._proc.terminate()
@@ -1429,23 +1682,23 @@ class SubprocessProxy(BackendProxy, ABC):
         self._proc = None
         self._response_queue = None
 
+    def notifies_about_new_messages(self) -> bool:
+        return True
+
     def _listen_stdout(self, stdout):
         # will be called from separate thread
 
         # allow self._response_queue to be replaced while processing
         message_queue = self._response_queue
+        proc = self._proc
 
         def publish_as_msg(data):
             msg = parse_message(data)
             if "cwd" in msg:
                 self.cwd = msg["cwd"]
+            # Blocks when the UI thread is lagging behind (eg. backend runs a long print loop)
             message_queue.append(msg)
-
-            if len(message_queue) > 10:
-                # Probably backend runs an infinite/long print loop.
-                # Throttle message throughput in order to keep GUI thread responsive.
-                while len(message_queue) > 0:
-                    sleep(0.005)
+            self._notify_new_messages()
 
         while True:
             try:
@@ -1458,6 +1711,12 @@ class SubprocessProxy(BackendProxy, ABC):
             # debug("... read some stdout data", repr(data))
             if data == "":
                 logger.info("Reader got EOF")
+                # Let the runner find out about termination without waiting for the safety timer
+                try:
+                    proc.wait(TERMINATION_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    pass
+                self._notify_new_messages()
                 break
             else:
                 try:
@@ -1468,15 +1727,19 @@ class SubprocessProxy(BackendProxy, ABC):
                     # NB! If subprocess printed it without linebreak,
                     # then the suffix can be thonny message
 
-                    parts = data.rsplit(common.MESSAGE_MARKER, maxsplit=1)
+                    marker_pos = max(
+                        data.rfind(common.MESSAGE_MARKER), data.rfind(common.FRAME_MARKER)
+                    )
+                    if marker_pos <= 0:
+                        marker_pos = len(data)
 
                     # print first part as it is
                     message_queue.append(
-                        BackendEvent("ProgramOutput", data=parts[0], stream_name="stdout")
+                        BackendEvent("ProgramOutput", data=data[:marker_pos], stream_name="stdout")
                     )
 
-                    if len(parts) == 2:
-                        second_part = common.MESSAGE_MARKER + parts[1]
+                    if marker_pos < len(data):
+                        second_part = data[marker_pos:]
                         try:
                             publish_as_msg(second_part)
                         except Exception:
@@ -1486,17 +1749,20 @@ class SubprocessProxy(BackendProxy, ABC):
                                     "ProgramOutput", data=second_part, stream_name="stdout"
                                 )
                             )
+                    self._notify_new_messages()
 
     def _listen_stderr(self, stderr):
+        message_queue = self._response_queue
         while True:
             data = read_one_incoming_message_str(stderr.readline)
             if data == "":
                 logger.info("Reached end of STDERR")
                 break
             else:
-                self._response_queue.append(
+                message_queue.append(
                     BackendEvent("ProgramOutput", stream_name="stderr", data=data)
                 )
+                self._notify_new_messages()
                 logger.error("STDERR: %r", data)
 
     def _store_state_info(self, msg):
@@ -1542,6 +1808,10 @@ class SubprocessProxy(BackendProxy, ABC):
         if "logfile" in msg:
             logger.info("Back-end reported logfile: %s", msg["logfile"])
 
+        if "wire_codec" in msg and msg["wire_codec"] != self._wire_codec:
+            logger.info("Switching to %r wire codec", msg["wire_codec"])
+            self._wire_codec = msg["wire_codec"]
+
     def _check_set_board_specific_stubs(self, board_id: str) -> bool:
         user_stubs_location = self.get_user_stubs_location()
         if user_stubs_location is None:
@@ -1633,57 +1903,7 @@ class SubprocessProxy(BackendProxy, ABC):
                 self._check_remember_current_configuration()
                 self._have_check_remembered_current_configuration = True
 
-        if msg.event_type == "ProgramOutput":
-            # combine available small output messages to one single message,
-            # in order to put less pressure on UI code
-
-            wait_time = 0.01
-            total_wait_time = 0
-            while True:
-                if len(self._response_queue) == 0:
-                    if _ends_with_incomplete_ansi_code(msg["data"]) and total_wait_time < 0.1:
-                        # Allow reader to send the remaining part
-                        sleep(wait_time)
-                        total_wait_time += wait_time
-                        continue
-                    else:
-                        return msg
-                else:
-                    next_msg = self._response_queue.popleft()
-                    if (
-                        next_msg.event_type == "ProgramOutput"
-                        and next_msg["stream_name"] == msg["stream_name"]
-                        and (
-                            len(msg["data"]) + len(next_msg["data"]) <= OUTPUT_MERGE_THRESHOLD
-                            and ("\n" not in msg["data"] or not io_animation_required)
-                            or _ends_with_incomplete_ansi_code(msg["data"])
-                        )
-                    ):
-                        msg["data"] += next_msg["data"]
-                    else:
-                        # not to be sent in the same block, put it back
-                        self._response_queue.appendleft(next_msg)
-                        return msg
-
-        else:
-            return msg
-
-
-def _ends_with_incomplete_ansi_code(data):
-    pos = max(data.rfind("\033["), data.rfind("\033]"))
-
-    if pos == -1:
-        return False
-
-    if len(data) < 3:
-        return True
-
-    # note CSI_TERMINATOR also includes [
-    params_and_terminator = data[pos + 2 :]
-    if data[1] == "[":
-        return not CSI_TERMINATOR.search(params_and_terminator)
-    elif data[1] == "]":
-        return not OSC_TERMINATOR.search(params_and_terminator)
+        return msg
 
 
 def create_frontend_python_process(
@@ -1745,6 +1965,383 @@ def _create_python_process(
     return proc
 
 
+def popen_backend_process(cmd_line: List[str], cwd: str, env: Dict[str, str]) -> subprocess.Popen:
+    creationflags = 0
+    if running_on_windows():
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+
+    return subprocess.Popen(
+        cmd_line,
+        executable=cmd_line[0],
+        bufsize=0,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        universal_newlines=True,
+        creationflags=creationflags,
+        encoding="utf-8",
+    )
+
+
+class WarmBackendPool:
+    """Keeps clean back-end processes ready, so that restarting the back-end
+    doesn't need to wait for interpreter startup.
+
+    A warm process gets used only if it was started with exactly the same
+    command line, working directory and environment as the proxy is going to use
+    (these cover the interpreter, cwd and environment related options).
+    Processes with outdated configuration get terminated on next refill.
+    """
+
+    def __init__(self) -> None:
+        self._members: List[_WarmBackend] = []
+        self._refill_after_id = None
+
+    def take(self, cmd_line: List[str], cwd: str, env: Dict[str, str]) -> Optional[subprocess.Popen]:
+        """Returns a running process, which has already acknowledged successful start."""
+        key = _get_launch_key(cmd_line, cwd, env)
+        while True:
+            member = next((m for m in self._members if m.key == key), None)
+            if member is None:
+                return None
+
+            self._members.remove(member)
+            proc = member.get_ready_process()
+            if proc is not None:
+                return proc
+
+            member.discard()
+
+    def refill(self, cmd_line: List[str], cwd: str, env: Dict[str, str], size: int) -> None:
+        size = max(0, min(size, MAX_WARM_BACKENDS))
+        key = _get_launch_key(cmd_line, cwd, env)
+        for member in list(self._members):
+            if member.key != key:
+                logger.info("Discarding warm backend with outdated configuration")
+                self._members.remove(member)
+                member.discard()
+
+        if self._refill_after_id is not None:
+            get_workbench().after_cancel(self._refill_after_id)
+            self._refill_after_id = None
+
+        if len(self._members) < size:
+            self._refill_after_id = get_workbench().after(
+                WARM_BACKEND_START_DELAY_MS, lambda: self._start_members(cmd_line, cwd, env, size)
+            )
+
+    def clear(self) -> None:
+        if self._refill_after_id is not None:
+            get_workbench().after_cancel(self._refill_after_id)
+            self._refill_after_id = None
+
+        for member in self._members:
+            member.discard()
+        self._members = []
+
+    def _start_members(self, cmd_line: List[str], cwd: str, env: Dict[str, str], size: int) -> None:
+        self._refill_after_id = None
+        while len(self._members) < size:
+            logger.info("Starting a warm backend")
+            self._members.append(_WarmBackend(cmd_line, cwd, env))
+
+
+class _WarmBackend:
+    def __init__(self, cmd_line: List[str], cwd: str, env: Dict[str, str]) -> None:
+        self.key = _get_launch_key(cmd_line, cwd, env)
+        self._proc: Optional[subprocess.Popen] = None
+        self._ack_line = None
+        # Starting and waiting for the acknowledgement happens in the background
+        self._start_thread = Thread(target=self._start, args=(cmd_line, cwd, env), daemon=True)
+        self._start_thread.start()
+
+    def _start(self, cmd_line: List[str], cwd: str, env: Dict[str, str]) -> None:
+        try:
+            proc = popen_backend_process(cmd_line, cwd, env)
+            # The process may wait for a long time before getting used. Its stderr must be
+            # read meanwhile, otherwise it would block when the pipe gets full.
+            proc.stderr = _DrainedStream(proc.stderr)
+            self._proc = proc
+            self._ack_line = self._proc.stdout.readline().strip("\r\n")
+        except Exception:
+            logger.exception("Could not start warm backend")
+
+    def get_ready_process(self) -> Optional[subprocess.Popen]:
+        self._start_thread.join(WARM_BACKEND_READY_TIMEOUT)
+        if self._start_thread.is_alive():
+            logger.warning("Warm backend is not ready in time")
+            return None
+
+        if self._proc is None or self._ack_line != PROCESS_ACK or self._proc.poll() is not None:
+            logger.warning("Warm backend is not usable (ack: %r)", self._ack_line)
+            return None
+
+        return self._proc
+
+    def discard(self) -> None:
+        # don't block the UI thread
+        Thread(target=self._terminate, daemon=True).start()
+
+    def _terminate(self) -> None:
+        self._start_thread.join()
+        if self._proc is None or self._proc.poll() is not None:
+            return
+
+        self._proc.terminate()
+        try:
+            self._proc.wait(TERMINATION_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+
+
+class _DrainedStream:
+    """Reads the lines of a text stream in a background thread and hands them out via
+    the reading methods of the stream"""
+
+    def __init__(self, stream) -> None:
+        self._stream = stream
+        self._lines: "queue.Queue[str]" = queue.Queue()
+        Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self) -> None:
+        try:
+            for line in iter(self._stream.readline, ""):
+                self._lines.put(line)
+        except Exception:
+            logger.exception("Problem reading warm backend stream")
+        finally:
+            self._lines.put("")
+
+    def readline(self) -> str:
+        line = self._lines.get()
+        if line == "":
+            # keep end of stream available for subsequent reads
+            self._lines.put("")
+        return line
+
+    def read(self) -> str:
+        return "".join(iter(self.readline, ""))
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+def _get_launch_key(cmd_line: List[str], cwd: str, env: Dict[str, str]) -> Tuple:
+    return tuple(cmd_line), cwd, frozenset(env.items())
+
+
+def _can_merge_output(msg, next_msg) -> bool:
+    return (
+        msg.event_type == "ProgramOutput"
+        and next_msg.event_type == "ProgramOutput"
+        and next_msg["stream_name"] == msg["stream_name"]
+        and (
+            len(msg["data"]) + len(next_msg["data"]) <= OUTPUT_MERGE_THRESHOLD
+            and ("\n" not in msg["data"] or not io_animation_required)
+        )
+    )
+
+
+class OutputLogWriter:
+    """Writes program output to a rotating log file in a background thread.
+
+    The UI thread only puts the data to a queue. The writer thread writes everything which
+    has accumulated in the queue with a single write.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int) -> None:
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._work, name="OutputLogWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, data: str) -> None:
+        """Never blocks"""
+        self._queue.put(data)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Data written before closing still gets to the file.
+
+        If timeout is given, waits up to that many seconds for the writer thread to finish.
+        """
+        self._queue.put(None)
+        if timeout is not None:
+            self._thread.join(timeout)
+
+    def _work(self) -> None:
+        fp = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fp = self._create_file()
+            logger.info("Logging program output to %s", self.path)
+            size = 0
+            closing = False
+            while not closing:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if None in batch:
+                    closing = True
+                    batch = batch[: batch.index(None)]
+
+                # max_bytes is about the size of the file, not the number of characters
+                data = "".join(batch).encode("utf-8", errors="replace")
+                if not data:
+                    continue
+
+                if self._max_bytes and size > 0 and size + len(data) > self._max_bytes:
+                    fp.close()
+                    self._rotate()
+                    fp = open(self.path, "wb")
+                    size = 0
+
+                fp.write(data)
+                fp.flush()
+                size += len(data)
+        except Exception:
+            logger.exception("Could not write output log %s", self.path)
+        finally:
+            if fp is not None:
+                fp.close()
+
+    def _create_file(self):
+        # The path has seconds resolution, runs started within the same second need
+        # separate files
+        base, ext = os.path.splitext(self.path)
+        path = self.path
+        number = 1
+        while True:
+            try:
+                fp = open(path, "xb")
+            except FileExistsError:
+                number += 1
+                path = "%s_%d%s" % (base, number, ext)
+            else:
+                self.path = path
+                return fp
+
+    def _rotate(self) -> None:
+        if self._backup_count <= 0:
+            return
+
+        for i in range(self._backup_count - 1, 0, -1):
+            source = "%s.%d" % (self.path, i)
+            if os.path.exists(source):
+                os.replace(source, "%s.%d" % (self.path, i + 1))
+        os.replace(self.path, self.path + ".1")
+
+
+class BackendMessageQueue:
+    """Bounded queue between the reader threads of a proxy and the UI thread.
+
+    Writers block when the queue has reached the high watermark and resume when
+    the UI thread has brought it down to the low watermark. Meanwhile the reader
+    doesn't read from the backend's pipe, so a chatty program gets throttled by
+    the OS instead of flooding the UI.
+
+    If coalescing is enabled, small consecutive output events get merged while
+    they wait in the queue.
+    """
+
+    def __init__(self, high_watermark: int, low_watermark: int, coalesce_output: bool) -> None:
+        self._high_watermark = max(high_watermark, 1)
+        self._low_watermark = max(min(low_watermark, self._high_watermark - 1), 0)
+        self._coalesce_output = coalesce_output
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def append(self, msg) -> None:
+        """Called from reader threads. Blocks while the queue is full."""
+        with self._condition:
+            if len(self._items) >= self._high_watermark:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._items) <= self._low_watermark
+                )
+
+            if self._closed:
+                return
+
+            if self._coalesce_output and self._items and _can_merge_output(self._items[-1], msg):
+                self._items[-1]["data"] += msg["data"]
+            else:
+                self._items.append(msg)
+
+            self._condition.notify_all()
+
+    def popleft(self):
+        with self._condition:
+            msg = self._items.popleft()
+            if len(self._items) <= self._low_watermark:
+                self._condition.notify_all()
+            return msg
+
+    def close(self) -> None:
+        """Releases blocked writers. Later messages will be dropped."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class MessageWakeup:
+    """Wakes up Tk event loop from another thread (self-pipe trick).
+
+    Reader threads call signal() after queueing messages and the callback gets
+    executed in the UI thread. Several signals before the callback runs
+    result in a single callback.
+    """
+
+    def __init__(self, callback: Callable[[], None]) -> None:
+        self._callback = callback
+        self._signalled = False
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        get_workbench().tk.createfilehandler(self._read_fd, tk.READABLE, self._on_readable)
+
+    @staticmethod
+    def is_supported() -> bool:
+        # Tcl file handlers are not available on Windows
+        return not running_on_windows() and hasattr(get_workbench().tk, "createfilehandler")
+
+    def signal(self) -> None:
+        if self._signalled:
+            return
+
+        self._signalled = True
+        try:
+            os.write(self._write_fd, b"!")
+        except BlockingIOError:
+            # pipe is full, ie. the loop will wake up anyway
+            pass
+
+    def _on_readable(self, fd, mask) -> None:
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        # Clear the flag before processing, so that messages arriving during
+        # processing cause another wakeup
+        self._signalled = False
+        try:
+            self._callback()
+        except Exception:
+            logger.exception("Error in message wakeup callback")
+
+
 class BackendTerminatedError(Exception):
     def __init__(self, returncode=None):
         Exception.__init__(self)
@@ -0,0 +1,270 @@
+"""
+Storage for the Shell output which is not kept in the Text widget.
+
+Lines moved out of the Text widget are kept in a ScrollbackStore. A line is a list of
+segments. Each segment is a tuple (kind, content, tags), where kind is "text" for regular
+text and "squeezed" for the SpooledText of a squeeze button.
+
+Texts of squeeze buttons are kept in a TextSpool.
+"""
+
+import codecs
+import itertools
+import pickle
+import re
+import tempfile
+import weakref
+from array import array
+from collections import deque
+from logging import getLogger
+from typing import Iterator, List, Optional, TextIO, Tuple, Union
+
+logger = getLogger(__name__)
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+_spools_by_serial = weakref.WeakValueDictionary()
+_spool_serials = itertools.count()
+
+
+class TextSpool:
+    """Append-only temporary file for long texts.
+
+    The file gets closed when the spool and all its SpooledTexts are garbage collected.
+    """
+
+    def __init__(self):
+        self.serial = next(_spool_serials)
+        _spools_by_serial[self.serial] = self
+        self._file = None
+        self._size = 0
+
+    def add(self, text: str) -> "SpooledText":
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="thonny_squeezed_")
+
+        data = text.encode("utf-8", errors="surrogatepass")
+        self._file.seek(self._size)
+        self._file.write(data)
+        result = SpooledText(self, self._size, len(data), len(text))
+        self._size += len(data)
+        return result
+
+    def read_chunks(self, offset: int, byte_count: int, chunk_size: int) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="surrogatepass")
+        end = offset + byte_count
+        while offset < end:
+            self._file.seek(offset)
+            data = self._file.read(min(chunk_size, end - offset))
+            offset += len(data)
+            yield decoder.decode(data, final=offset >= end)
+
+
+class SpooledText:
+    """A text stored in a TextSpool"""
+
+    __slots__ = ("_spool", "_offset", "_byte_count", "_char_count")
+
+    def __init__(self, spool: TextSpool, offset: int, byte_count: int, char_count: int):
+        self._spool = spool
+        self._offset = offset
+        self._byte_count = byte_count
+        self._char_count = char_count
+
+    def __len__(self) -> int:
+        return self._char_count
+
+    def __reduce__(self):
+        # for file-backed ScrollbackStore
+        return (
+            _restore_spooled_text,
+            (self._spool.serial, self._offset, self._byte_count, self._char_count),
+        )
+
+    def iter_chunks(self, chunk_size: int = SPOOL_CHUNK_SIZE) -> Iterator[str]:
+        return self._spool.read_chunks(self._offset, self._byte_count, chunk_size)
+
+    def read(self) -> str:
+        return "".join(self.iter_chunks())
+
+    def get_prefix(self, char_count: int) -> str:
+        # UTF-8 takes at most 4 bytes per character
+        chunk = next(self.iter_chunks(char_count * 4), "")
+        return chunk[:char_count]
+
+    def split(self, char_count: int) -> Tuple["SpooledText", "SpooledText"]:
+        text = self.read()
+        return self._spool.add(text[:char_count]), self._spool.add(text[char_count:])
+
+
+def _restore_spooled_text(spool_serial, offset, byte_count, char_count) -> SpooledText:
+    return SpooledText(_spools_by_serial[spool_serial], offset, byte_count, char_count)
+
+
+Segment = Tuple[str, Union[str, SpooledText], Tuple[str, ...]]
+Line = List[Segment]
+
+
+def get_line_text(line: Line) -> str:
+    """Returns the text of the line without squeezed texts"""
+    return "".join(content for kind, content, _ in line if kind == "text")
+
+
+def write_line(fp: TextIO, line: Line) -> None:
+    for kind, content, _ in line:
+        if kind == "squeezed":
+            for chunk in content.iter_chunks():
+                fp.write(chunk)
+        else:
+            fp.write(content)
+
+
+class ScrollbackStore:
+    """Lines in the order of their appearance, newest last.
+
+    When the store gets more than max_lines lines, oldest lines get dropped. In file-backed
+    mode the lines are kept in a temporary file and the memory holds only their offsets.
+    """
+
+    def __init__(self, max_lines: int, file_backed: bool = False):
+        self._max_lines = max(max_lines, 0)
+        self._file_backed = file_backed
+        self._interned_tags = {}
+
+        # in-memory mode
+        self._lines = deque()
+
+        # file-backed mode
+        self._file = None
+        self._offsets = array("q")
+        self._first = 0  # index of the oldest retained line in _offsets
+        self._size = 0
+
+    def __len__(self) -> int:
+        if self._file_backed:
+            return len(self._offsets) - self._first
+        else:
+            return len(self._lines)
+
+    def push_lines(self, lines: List[Line]) -> None:
+        for line in lines:
+            line = [
+                (kind, content, self._interned_tags.setdefault(tags, tags))
+                for kind, content, tags in line
+            ]
+            if self._file_backed:
+                self._write_line(line)
+            else:
+                self._lines.append(line)
+
+        self._drop_excess_lines()
+
+    def pop_lines(self, count: int) -> List[Line]:
+        """Removes and returns (at most) count newest lines, oldest first"""
+        count = min(count, len(self))
+        if count == 0:
+            return []
+
+        if not self._file_backed:
+            result = [self._lines.pop() for _ in range(count)]
+            result.reverse()
+            return result
+
+        start = len(self._offsets) - count
+        self._file.seek(self._offsets[start])
+        data = self._file.read(self._size - self._offsets[start])
+        result = []
+        pos = 0
+        for i in range(start, len(self._offsets)):
+            if i + 1 < len(self._offsets):
+                end = self._offsets[i + 1] - self._offsets[start]
+            else:
+                end = len(data)
+            result.append(pickle.loads(data[pos:end]))
+            pos = end
+
+        self._size = self._offsets[start]
+        del self._offsets[start:]
+        return result
+
+    def iter_lines(self) -> Iterator[Line]:
+        if not self._file_backed:
+            yield from self._lines
+            return
+
+        if len(self) == 0:
+            return
+
+        self._file.seek(self._offsets[self._first])
+        for i in range(self._first, len(self._offsets)):
+            yield pickle.load(self._file)
+
+    def rfind(self, pattern: str, regexp: bool = False, nocase: bool = True) -> Optional[int]:
+        """Returns the index of the newest line containing the pattern"""
+        if not regexp:
+            pattern = re.escape(pattern)
+        regex = re.compile(pattern, re.IGNORECASE if nocase else 0)
+
+        result = None
+        for i, line in enumerate(self.iter_lines()):
+            if regex.search(get_line_text(line)):
+                result = i
+
+        return result
+
+    def write_text(self, fp: TextIO) -> None:
+        for line in self.iter_lines():
+            write_line(fp, line)
+
+    def clear(self) -> None:
+        self._lines.clear()
+        self._interned_tags.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._offsets = array("q")
+        self._first = 0
+        self._size = 0
+
+    def _write_line(self, line: Line) -> None:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="thonny_scrollback_")
+
+        data = pickle.dumps(line, pickle.HIGHEST_PROTOCOL)
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._offsets.append(self._size)
+        self._size += len(data)
+
+    def _drop_excess_lines(self) -> None:
+        excess = len(self) - self._max_lines
+        if excess <= 0:
+            return
+
+        if not self._file_backed:
+            for _ in range(excess):
+                self._lines.popleft()
+            return
+
+        self._first += excess
+        if self._first > len(self._offsets) - self._first:
+            self._compact_file()
+
+    def _compact_file(self) -> None:
+        """Copies the retained lines to a new file so that the dropped lines don't take space"""
+        logger.debug("Compacting scrollback file, dropping %d lines", self._first)
+        if len(self) == 0:
+            base = self._size
+        else:
+            base = self._offsets[self._first]
+
+        old_file = self._file
+        old_file.seek(base)
+        data = old_file.read(self._size - base)
+        self._file = tempfile.TemporaryFile(prefix="thonny_scrollback_")
+        self._file.write(data)
+        old_file.close()
+
+        self._offsets = array("q", (offset - base for offset in self._offsets[self._first :]))
+        self._first = 0
+        self._size = len(data)
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import os.path
 import pathlib
 import re
+import tempfile
+import time
 import tkinter as tk
 import traceback
 from _tkinter import TclError
@@ -10,11 +13,13 @@ from dataclasses import dataclass
 from logging import getLogger
 import sys
 from tkinter import ttk
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 
 from thonny import (
+    ansi,
     get_runner,
     get_shell,
+    get_thonny_user_dir,
     get_workbench,
     lsp_types,
     memory,
@@ -48,17 +53,22 @@ from thonny.lsp_types import (
 )
 from thonny.misc_utils import construct_cmd_line, parse_cmd_line
 from thonny.running import EDITOR_CONTENT_TOKEN
+from thonny.scrollback import Line, ScrollbackStore, SpooledText, TextSpool, write_line
+from thonny.shell_history import ShellHistory
 from thonny.tktextext import TextFrame, TweakableText, index2line
 from thonny.ui_utils import (
     CommonDialog,
     EnhancedTextWithLogging,
     TextMenu,
+    ask_string,
+    asksaveasfilename,
     compute_tab_stops,
     create_tooltip,
     ems_to_pixels,
     get_beam_cursor,
     get_hyperlink_cursor,
     lookup_style_option,
+    open_with_default_app,
     replace_unsupported_chars,
     select_sequence,
     show_dialog,
@@ -78,9 +88,8 @@ _CLEAR_SHELL_DEFAULT_SEQ = select_sequence("<Control-l>", "<Command-k>")
 
 TERMINAL_CONTROL_REGEX_STR = r"\x1B\[[0-?]*[ -/]*[@-~]|[\a\b\r]|\x1B\].+?(?:\a|\x1B\\)"
 TERMINAL_CONTROL_REGEX = re.compile(TERMINAL_CONTROL_REGEX_STR)
-OUTPUT_SPLIT_REGEX = re.compile(
-    "(%s|%s|%s)"
-    % (TERMINAL_CONTROL_REGEX_STR, OBJECT_INFO_START_REGEX_STR, OBJECT_INFO_END_REGEX_STR)
+OBJECT_LINK_SPLIT_REGEX = re.compile(
+    "(%s|%s)" % (OBJECT_INFO_START_REGEX_STR, OBJECT_INFO_END_REGEX_STR)
 )
 NUMBER_SPLIT_REGEX = re.compile(r"((?<!\w)[-+]?[0-9]*\.?[0-9]+\b)")
 SIMPLE_URL_SPLIT_REGEX = re.compile(
@@ -88,6 +97,21 @@ SIMPLE_URL_SPLIT_REGEX = re.compile(
 )
 
 INT_REGEX = re.compile(r"\d+")
+
+# how many stored lines are brought back when the user scrolls to the top
+SCROLLBACK_PAGE_LINES = 200
+
+# longer squeezed texts are shown partially in the dialog
+SQUEEZED_TEXT_VIEW_MAX_CHARS = 1000000
+
+# number of most recent lines with numbers which the plotter keeps
+PLOTTER_MIN_CAPACITY = 10000
+
+# output rate is measured over windows of this length (seconds)
+OUTPUT_RATE_WINDOW = 0.5
+FIREHOSE_FRAME_INTERVAL_MS = 100
+FIREHOSE_TAIL_LINES = 50
+FIREHOSE_TAIL_LINE_MAX_LENGTH = 1000
 ANSI_COLOR_NAMES = {
     "0": "black",
     "1": "red",
@@ -108,6 +132,116 @@ class ExecutionInfo:
     io_end_index: str
 
 
+class IoEventLog:
+    """IO events of current toplevel block in arrival order.
+
+    Events before the marker have been applied to the text, the rest are waiting.
+    Rewinding (needed when going back in time in NiceTracer) only moves the marker back.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._marker = 0
+        self.applied_char_count = 0
+
+    def has_applied(self) -> bool:
+        return self._marker > 0
+
+    def has_queued(self) -> bool:
+        return self._marker < len(self._events)
+
+    def queue(self, data: Union[str, SpooledText], stream_name: str) -> None:
+        self._events.append((data, stream_name))
+
+    def add_applied(self, data: str, stream_name: str) -> None:
+        self._events.insert(self._marker, (data, stream_name))
+        self._marker += 1
+        self.applied_char_count += len(data)
+
+    def apply_next(self, max_chars: Optional[int] = None) -> Tuple[Union[str, SpooledText], str]:
+        """Marks next queued event (or its prefix of max_chars characters) as applied"""
+        data, stream_name = self._events[self._marker]
+        if max_chars is not None and len(data) > max_chars:
+            if isinstance(data, SpooledText):
+                prefix, suffix = data.split(max_chars)
+            else:
+                prefix, suffix = data[:max_chars], data[max_chars:]
+            # the suffix remains queued
+            self._events[self._marker] = (prefix, stream_name)
+            self._events.insert(self._marker + 1, (suffix, stream_name))
+            data = prefix
+
+        self._marker += 1
+        self.applied_char_count += len(data)
+        return data, stream_name
+
+    def rewind(self) -> None:
+        self._marker = 0
+        self.applied_char_count = 0
+
+
+class OutputFirehose:
+    """Output which arrives too fast for rendering.
+
+    All of the output is written to a file, only last lines are kept for showing.
+    The file is kept for the rest of the run, so that it contains also the output
+    which gets rendered after the rate calms down (see tee).
+    """
+
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", prefix="thonny_output_", suffix=".txt", delete=False
+        )
+        self.path = self._file.name
+        self._ansi_splitters = {}
+        self._tail = collections.deque(maxlen=FIREHOSE_TAIL_LINES)
+        self._partial_line = ""
+        self.line_count = 0
+        self.char_count = 0
+
+    def write(self, data: str, stream_name: str) -> None:
+        self._file.write(data)
+        self.char_count += len(data)
+
+        if stream_name not in self._ansi_splitters:
+            self._ansi_splitters[stream_name] = ansi.AnsiSplitter()
+        text = "".join(
+            part
+            for kind, part in self._ansi_splitters[stream_name].feed(data)
+            if kind == ansi.TEXT
+        )
+        lines = (self._partial_line + OBJECT_LINK_SPLIT_REGEX.sub("", text)).split("\n")
+        self._partial_line = lines.pop()[-FIREHOSE_TAIL_LINE_MAX_LENGTH:]
+        self.line_count += len(lines)
+        for line in lines[-FIREHOSE_TAIL_LINES:]:
+            self._tail.append(line[-FIREHOSE_TAIL_LINE_MAX_LENGTH:])
+
+    def tee(self, data: str) -> None:
+        """Writes output which gets rendered normally"""
+        self._file.write(data)
+
+    def restart_tail(self) -> None:
+        """Forgets the lines which have been shown already"""
+        self._ansi_splitters = {}
+        self._tail.clear()
+        self._partial_line = ""
+        self.line_count = 0
+        self.char_count = 0
+
+    def get_tail(self) -> str:
+        return "".join(line + "\n" for line in self._tail) + self._partial_line
+
+    def get_skipped_line_count(self) -> int:
+        return max(self.line_count - len(self._tail), 0)
+
+    def flush(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
 class ShellView(tk.PanedWindow):
     def __init__(self, master):
         self._osc_title = None
@@ -135,11 +269,17 @@ class ShellView(tk.PanedWindow):
         )
 
         get_workbench().set_default("shell.max_lines", 1000)
+        get_workbench().set_default("shell.virtualized_scrollback", False)
+        get_workbench().set_default("shell.scrollback_max_lines", 100000)
+        get_workbench().set_default("shell.scrollback_file_backed", False)
+        get_workbench().set_default("shell.firehose_threshold", 300000)
         get_workbench().set_default("shell.squeeze_threshold", 1000)
         get_workbench().set_default("shell.tty_mode", True)
         get_workbench().set_default("shell.auto_inspect_values", True)
         get_workbench().set_default("shell.clear_for_new_process", True)
         get_workbench().set_default("shell.io_tab_width", 8)
+        get_workbench().set_default("shell.save_history", True)
+        get_workbench().set_default("shell.history_max_commands", 50000)
 
         self.text = ShellText(
             main_frame,
@@ -170,6 +310,8 @@ class ShellView(tk.PanedWindow):
 
         self.notice = ttk.Label(self, text="", background="#ffff99", padding=3)
 
+        self.history_search_bar = HistorySearchBar(main_frame, self.text)
+
         self.init_plotter()
         self.menu = ShellMenu(self.text, self)
 
@@ -207,6 +349,7 @@ class ShellView(tk.PanedWindow):
             group=11,
         )
 
+        get_workbench().set_default("view.plotter_num_steps", 30)
         self.update_plotter_visibility(True)
 
     def set_ignore_program_output(self, value):
@@ -229,6 +372,11 @@ class ShellView(tk.PanedWindow):
         if self.plotter is None:
             self.plotter = PlotterCanvas(self, self.text)
 
+        if self.text.plotter_data is None:
+            self.text.start_plotter_data(
+                max(PLOTTER_MIN_CAPACITY, self.plotter.get_num_steps() + 1)
+            )
+
         if not self.plotter.winfo_ismapped():
             self.add(self.plotter, minsize=100)
 
@@ -242,6 +390,7 @@ class ShellView(tk.PanedWindow):
             return
         else:
             self.remove(self.plotter)
+            self.text.stop_plotter_data()
             running.io_animation_required = False
 
     def set_notice(self, text):
@@ -305,6 +454,8 @@ class ShellView(tk.PanedWindow):
     def set_scrollbar(self, *args):
         self.vert_scrollbar.set(*args)
         self.update_plotter()
+        if float(args[0]) == 0.0:
+            self.text.request_older_scrollback()
 
     def text_deleted(self, event):
         if event.text_widget == self.text:
@@ -342,6 +493,8 @@ class ShellMenu(TextMenu):
     def add_extra_items(self):
         self.add_separator()
         self.add_command(label=tr("Clear"), command=self.text._clear_shell)
+        self.add_command(label=tr("Find in output") + "...", command=self.find_in_output)
+        self.add_command(label=tr("Save output") + "...", command=self.save_output)
 
         def toggle_from_menu():
             # I don't like that Tk menu toggles checbutton variable
@@ -362,6 +515,23 @@ class ShellMenu(TextMenu):
     def selection_is_read_only(self):
         return not self.text.selection_is_writable()
 
+    def find_in_output(self):
+        pattern = ask_string(
+            tr("Find in output"), tr("Text to search for:"), master=self.text.winfo_toplevel()
+        )
+        if pattern and not self.text.find_in_history(pattern):
+            get_workbench().bell()
+
+    def save_output(self):
+        path = asksaveasfilename(
+            filetypes=[(tr("text files"), ".txt"), (tr("all files"), ".*")],
+            defaultextension=".txt",
+            initialdir=get_workbench().get_local_cwd(),
+            parent=get_workbench(),
+        )
+        if path:
+            self.text.save_history(path)
+
 
 class BaseShellText(EnhancedTextWithLogging, SyntaxText):
     """Passive version of ShellText. Used also for preview"""
@@ -381,6 +551,8 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             []
         )  # actually not really history, because each command occurs only once
         self._command_history_current_index = None
+        # persistent history, searchable with Ctrl+R
+        self._history: Optional[ShellHistory] = None
 
         self._last_ls_cwd: str = get_workbench().get_local_cwd()
         self._last_ls_uri: Optional[lsp_types.URI] = None
@@ -390,8 +562,8 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         # logs of IO events for current toplevel block
         # (enables undoing and redoing the events)
-        self._applied_io_events = []
-        self._queued_io_events = []
+        self._io_events = IoEventLog()
+        self._ansi_splitters = {}  # by stream name
         self._images = set()
 
         self._ansi_foreground = None
@@ -404,6 +576,22 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         self._ansi_strikethrough = False
         self._io_cursor_offset = 0
         self._squeeze_buttons = set()
+        self._squeeze_spool = TextSpool()
+        self._scrollback: Optional[ScrollbackStore] = None
+        self._scrollback_load_scheduled = False
+        # number of lines removed from the top, makes line numbers stable for the plotter
+        self._discarded_line_count = 0
+        self.plotter_data: Optional[PlotterData] = None
+
+        # for detecting runaway output
+        self._output_window_start = time.monotonic()
+        self._output_window_char_count = 0
+        self._last_output_rate = 0.0
+        # one per toplevel run, created when the output becomes too fast for the first time
+        self._firehose: Optional[OutputFirehose] = None
+        self._firehose_active = False
+        self._firehose_frame_after_id = None
+        self._firehose_paths = []
 
         self.update_tty_mode()
 
@@ -491,10 +679,13 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         self._try_submit_input()
 
     def _handle_input_request(self, msg):
+        self._stop_firehose()
         self._ensure_visible()
         self.focus_set()
         self.mark_set("insert", "end")
         self.tag_remove("sel", "1.0", tk.END)
+        self._flush_io_queue()
+        self._update_visible_io(None)
         self._try_submit_input()  # try to use leftovers from previous request
         self.see("end")
 
@@ -502,6 +693,18 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         if self._ignore_program_output:
             # This output will be handled elsewhere
             return
+        if not self._firehose_active and self._measure_output_rate(len(msg.data)):
+            self._start_firehose()
+
+        if self._firehose_active:
+            # rendered later, a frame at a time
+            self._firehose.write(msg.data, msg.stream_name)
+            return
+
+        if self._firehose is not None:
+            # keep the file complete for the rest of the run
+            self._firehose.tee(msg.data)
+
         # Discard but not too often, as toplevel response will discard anyway
         if int(float(self.index("end"))) > get_workbench().get_option("shell.max_lines") + 100:
             self._discard_old_content()
@@ -509,13 +712,99 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         self._ensure_visible()
         self._append_to_io_queue(msg.data, msg.stream_name)
 
-        if not self._applied_io_events:
+        if not self._io_events.has_applied():
             # this is first line of io, add padding below command line
             self.tag_add("before_io", "output_insert -1 line linestart")
 
         self._update_visible_io(None)
 
+    def _measure_output_rate(self, char_count) -> bool:
+        """Returns True if the output arrives faster than the Shell should render it"""
+        now = time.monotonic()
+        elapsed = now - self._output_window_start
+        if elapsed >= OUTPUT_RATE_WINDOW:
+            self._last_output_rate = self._output_window_char_count / elapsed
+            self._output_window_start = now
+            self._output_window_char_count = 0
+
+        self._output_window_char_count += char_count
+        threshold = get_workbench().get_option("shell.firehose_threshold")
+        return bool(threshold) and self._last_output_rate > threshold
+
+    def _start_firehose(self):
+        logger.info("Output rate %d chars/s, showing only the tail", self._last_output_rate)
+        if self._firehose is None:
+            self._firehose = OutputFirehose()
+            self._firehose_paths.append(self._firehose.path)
+        else:
+            self._firehose.restart_tail()
+        self._firehose_active = True
+
+        self._insert_command_link(
+            tr("Open full output"),
+            lambda event, firehose=self._firehose: self._open_firehose_output(firehose),
+            ("io",),
+        )
+        self.mark_set("firehose_summary_start", "output_insert")
+        self.mark_gravity("firehose_summary_start", tk.LEFT)
+        self._firehose_frame_after_id = self.after(
+            FIREHOSE_FRAME_INTERVAL_MS, self._render_firehose_frame
+        )
+
+    def _render_firehose_frame(self):
+        self._firehose_frame_after_id = None
+        if not self._measure_output_rate(0):
+            self._stop_firehose()
+            return
+
+        self._render_firehose()
+        # so that the file can be looked at while the program is running
+        self._firehose.flush()
+        self._firehose_frame_after_id = self.after(
+            FIREHOSE_FRAME_INTERVAL_MS, self._render_firehose_frame
+        )
+
+    def _render_firehose(self):
+        firehose = self._firehose
+        self.direct_delete("firehose_summary_start", "output_insert")
+        self._insert_text_directly(
+            " "
+            + tr("[%d lines skipped, %.1f MB]")
+            % (firehose.get_skipped_line_count(), firehose.char_count / 1024 / 1024)
+            + "\n",
+            ("io",),
+        )
+        self._insert_text_directly(firehose.get_tail(), ("io", "stdout"))
+        self.mark_set("output_end", self.index("end-1c"))
+        self.see("end")
+
+    def _open_firehose_output(self, firehose):
+        firehose.flush()
+        open_with_default_app(firehose.path)
+
+    def _stop_firehose(self):
+        if not self._firehose_active:
+            return
+
+        if self._firehose_frame_after_id is not None:
+            self.after_cancel(self._firehose_frame_after_id)
+            self._firehose_frame_after_id = None
+        self._render_firehose()
+        self._firehose_active = False
+        self.mark_unset("firehose_summary_start")
+        # the tail was shown without its formatting
+        self._reset_ansi_attributes()
+        self._io_cursor_offset = 0
+
+    def _close_firehose(self):
+        """Called at the end of the run"""
+        self._stop_firehose()
+        if self._firehose is not None:
+            self._firehose.close()
+            self._firehose = None
+
     def _handle_toplevel_response(self, msg: ToplevelResponse) -> None:
+        self._close_firehose()
         was_scrolled_to_end = self.is_scrolled_to_end()
         if "source_for_language_server" in msg:
             self._context_lines_for_language_server += msg["source_for_language_server"].splitlines(
@@ -542,6 +831,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         self.mark_set("output_end", self.index("end-1c"))
         self._discard_old_content()
+        self._flush_io_queue()
         self._update_visible_io(None)
         self._reset_ansi_attributes()
         self._io_cursor_offset = 0
@@ -565,45 +855,73 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         return get_workbench().get_option("shell.squeeze_threshold")
 
     def _append_to_io_queue(self, data, stream_name):
-        # Make sure ANSI CSI codes and object links are stored as separate events
-        # TODO: try to complete previously submitted incomplete code
-        parts = re.split(OUTPUT_SPLIT_REGEX, data)
-        for part in parts:
-            if part:  # split may produce empty string in the beginning or start
-                # split the data so that very long lines separated
-                for block in re.split("(.{%d,})" % (self._get_squeeze_threshold() + 1), part):
-                    if block:
-                        self._queued_io_events.append((block, stream_name))
+        # Make sure ANSI CSI codes and object links are stored as separate events.
+        # An incomplete escape sequence at the end gets completed by next output of the stream.
+        if stream_name not in self._ansi_splitters:
+            self._ansi_splitters[stream_name] = ansi.AnsiSplitter()
+        self._queue_io_parts(self._ansi_splitters[stream_name].feed(data), stream_name)
+
+    def _flush_io_queue(self):
+        """Gives up waiting for the rest of incomplete escape sequences"""
+        for stream_name, splitter in self._ansi_splitters.items():
+            self._queue_io_parts(splitter.flush(), stream_name)
+
+    def _queue_io_parts(self, parts, stream_name):
+        squeeze_split_regex = "(.{%d,})" % (self._get_squeeze_threshold() + 1)
+        for kind, part in parts:
+            if kind == ansi.CONTROL:
+                self._io_events.queue(part, stream_name)
+                continue
+
+            for link_part in OBJECT_LINK_SPLIT_REGEX.split(part):
+                if link_part:  # split may produce empty string in the beginning or start
+                    # split the data so that very long lines separated
+                    for block in re.split(squeeze_split_regex, link_part):
+                        if self._should_squeeze(block):
+                            # keep only the reference in memory
+                            self._io_events.queue(self._squeeze_spool.add(block), stream_name)
+                        elif block:
+                            self._io_events.queue(block, stream_name)
+
+    def _should_squeeze(self, data):
+        if len(data) <= self._get_squeeze_threshold():
+            return False
+
+        non_url_length = len(data)
+        for url_match in SIMPLE_URL_SPLIT_REGEX.finditer(data):
+            non_url_length -= url_match.end() - url_match.start()
+
+        return (
+            non_url_length > self._get_squeeze_threshold()
+            and "\n" not in data
+            and not (data.startswith(OBJECT_LINK_START))
+        )
 
     def _update_visible_io(self, target_num_visible_chars):
         was_scrolled_to_end = self.is_scrolled_to_end()
-        current_num_visible_chars = sum(map(lambda x: len(x[0]), self._applied_io_events))
+        io_events = self._io_events
 
         if (
             target_num_visible_chars is not None
-            and target_num_visible_chars < current_num_visible_chars
+            and target_num_visible_chars < io_events.applied_char_count
         ):
             # hard to undo complex renderings (squeezed texts and ANSI codes)
             # easier to clean everything and start again
-            self._queued_io_events = self._applied_io_events + self._queued_io_events
-            self._applied_io_events = []
+            io_events.rewind()
+            if self.plotter_data is not None:
+                self.plotter_data.drop_from(self._get_absolute_lineno("command_io_start"))
             self.direct_delete("command_io_start", "output_end")
-            current_num_visible_chars = 0
             self._reset_ansi_attributes()
 
-        while self._queued_io_events and current_num_visible_chars != target_num_visible_chars:
-            data, stream_name = self._queued_io_events.pop(0)
-
-            if target_num_visible_chars is not None:
-                leftover_count = current_num_visible_chars + len(data) - target_num_visible_chars
-
-                if leftover_count > 0:
-                    # add suffix to the queue
-                    self._queued_io_events.insert(0, (data[-leftover_count:], stream_name))
-                    data = data[:-leftover_count]
+        while io_events.has_queued() and io_events.applied_char_count != target_num_visible_chars:
+            if target_num_visible_chars is None:
+                data, stream_name = io_events.apply_next()
+            else:
+                data, stream_name = io_events.apply_next(
+                    target_num_visible_chars - io_events.applied_char_count
+                )
 
             self._apply_io_event(data, stream_name)
-            current_num_visible_chars += len(data)
 
         self.mark_set("output_end", self.index("end-1c"))
         if was_scrolled_to_end:
@@ -613,9 +931,10 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         if not data:
             return
 
-        original_data = data
+        if isinstance(data, SpooledText):
+            self._apply_squeezed_io_event(data, stream_name)
 
-        if self.tty_mode and re.match(TERMINAL_CONTROL_REGEX, data):
+        elif self.tty_mode and re.match(TERMINAL_CONTROL_REGEX, data):
             if data == "\a":
                 get_workbench().bell()
             elif data == "\b":
@@ -660,52 +979,9 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             # id was already printed and value should be suppressed
             pass
         else:
-            if "value" in self.active_extra_tags:
-                tags = set(self.active_extra_tags)
-            else:
-                tags = set(self.active_extra_tags) | {"io", stream_name}
-
-            if stream_name == "stdout" and self.tty_mode:
-                tags |= self._get_ansi_tags()
-
-            non_url_length = len(data)
-            for url_match in SIMPLE_URL_SPLIT_REGEX.finditer(data):
-                non_url_length -= url_match.end() - url_match.start()
+            tags = self._get_io_tags(stream_name)
 
-            if (
-                non_url_length > self._get_squeeze_threshold()
-                and "\n" not in data
-                and not (data.startswith(OBJECT_LINK_START))
-            ):
-                self._io_cursor_offset = 0  # ignore the effect of preceding \r and \b
-                actual_text = data
-                button_text = actual_text[:70] + " …"
-                btn = tk.Label(
-                    self,
-                    text=button_text,
-                    # width=len(button_text),
-                    cursor="arrow",
-                    borderwidth=2,
-                    relief="raised",
-                    font="IOFont",
-                )
-                btn.bind("<1>", lambda e: self._show_squeezed_text(btn), True)
-                btn.contained_text = actual_text
-                btn.tags = tags
-                self._squeeze_buttons.add(btn)
-                create_tooltip(btn, "%d characters squeezed. " % len(data) + "Click for details.")
-
-                # TODO: refactor
-                # (currently copied from insert_text_directly)
-                self.mark_gravity("input_start", tk.RIGHT)
-                self.mark_gravity("output_insert", tk.RIGHT)
-
-                self.window_create("output_insert", window=btn)
-                for tag_name in tags:
-                    self.tag_add(tag_name, "output_insert -1 chars")
-                data = ""
-
-            elif self._io_cursor_offset < 0:
+            if self._io_cursor_offset < 0:
                 overwrite_len = min(len(data), -self._io_cursor_offset)
 
                 if 0 <= data.find("\n") < overwrite_len:
@@ -740,8 +1016,53 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             if data:
                 # if any data is still left, then this should be output normally
                 self._insert_text_directly(data, tuple(tags))
+                if self.plotter_data is not None and stream_name == "stdout" and "\n" in data:
+                    self._add_plotter_lines(data.count("\n"))
+
+    def _get_io_tags(self, stream_name):
+        if "value" in self.active_extra_tags:
+            tags = set(self.active_extra_tags)
+        else:
+            tags = set(self.active_extra_tags) | {"io", stream_name}
 
-        self._applied_io_events.append((original_data, stream_name))
+        if stream_name == "stdout" and self.tty_mode:
+            tags |= self._get_ansi_tags()
+
+        return tags
+
+    def _apply_squeezed_io_event(self, spooled_text, stream_name):
+        if "value" in self.active_extra_tags and get_workbench().in_heap_mode():
+            # id was already printed and value should be suppressed
+            return
+
+        tags = self._get_io_tags(stream_name)
+        self._io_cursor_offset = 0  # ignore the effect of preceding \r and \b
+        btn = self._create_squeeze_button(spooled_text, tags)
+
+        # TODO: refactor
+        # (currently copied from insert_text_directly)
+        self.mark_gravity("input_start", tk.RIGHT)
+        self.mark_gravity("output_insert", tk.RIGHT)
+
+        self.window_create("output_insert", window=btn)
+        for tag_name in tags:
+            self.tag_add(tag_name, "output_insert -1 chars")
+
+    def _create_squeeze_button(self, spooled_text, tags):
+        btn = tk.Label(
+            self,
+            text=spooled_text.get_prefix(70) + " …",
+            cursor="arrow",
+            borderwidth=2,
+            relief="raised",
+            font="IOFont",
+        )
+        btn.bind("<1>", lambda e: self._show_squeezed_text(btn), True)
+        btn.spooled_text = spooled_text
+        btn.tags = tags
+        self._squeeze_buttons.add(btn)
+        create_tooltip(btn, "%d characters squeezed. " % len(spooled_text) + "Click for details.")
+        return btn
 
     def _show_squeezed_text(self, button):
         dlg = SqueezedTextDialog(self, button)
@@ -990,12 +1311,16 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
     def restart(self, automatic: bool = False, was_running: bool = False):
         logger.info("BaseShellText.restart(%r)", automatic)
         self.set_read_only(False)
+        # incomplete escape sequences of the previous process can't be completed anymore
+        self._ansi_splitters = {}
         if (
             get_workbench().get_option("shell.clear_for_new_process")
             and not automatic
             and not was_running
         ):
             self._clear_content("end")
+            self._clear_scrollback()
+            self._squeeze_spool = TextSpool()
         else:
             if (
                 "restart_line" in self.tag_names("output_insert -2 chars")
@@ -1037,7 +1362,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             EnhancedTextWithLogging.intercept_insert(self, index, chars, tags)
 
             if not get_runner().is_waiting_toplevel_command():
-                if not self._applied_io_events:
+                if not self._io_events.has_applied():
                     # tag preceding command line differently
                     self.tag_add("before_io", "input_start -1 lines linestart")
 
@@ -1117,11 +1442,11 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         except Exception:
             return False
 
-    def _insert_command_link(self, txt, handler):
+    def _insert_command_link(self, txt, handler, tags=()):
         self._link_handler_count += 1
         command_tag = "link_handler_%s" % self._link_handler_count
 
-        self.direct_insert("output_insert", txt, ("io_hyperlink", command_tag))
+        self.direct_insert("output_insert", txt, tags + ("io_hyperlink", command_tag))
         self.tag_bind(command_tag, "<1>", handler)
 
     def _insert_text_directly(self, txt, tags=()):
@@ -1303,6 +1628,8 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             if text_to_be_submitted in self._command_history:
                 self._command_history.remove(text_to_be_submitted)
             self._command_history.append(text_to_be_submitted)
+            if self._history is not None:
+                self._history.add(text_to_be_submitted)
 
             # meaning command selection is not in process
             self._command_history_current_index = None
@@ -1379,8 +1706,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
                 self.mark_set("command_io_start", "output_insert")
                 self.mark_gravity("command_io_start", "left")
                 # discard old io events
-                self._applied_io_events = []
-                self._queued_io_events = []
+                self._io_events = IoEventLog()
             except Exception:
                 get_workbench().report_exception()
                 self._insert_prompt()
@@ -1391,7 +1717,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
             assert get_runner().is_running()
             get_runner().send_program_input(text_to_be_submitted)
             get_workbench().event_generate("ShellInput", input_text=text_to_be_submitted)
-            self._applied_io_events.append((text_to_be_submitted, "stdin"))
+            self._io_events.add_applied(text_to_be_submitted, "stdin")
 
     def _arrow_up(self, event):
         if not get_runner().is_waiting_toplevel_command():
@@ -1454,6 +1780,13 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         )
         return "break"
 
+    def _search_history(self, event):
+        if self._history is None or not get_runner().is_waiting_toplevel_command():
+            return None
+
+        self.view.history_search_bar.start(self._history)
+        return "break"
+
     def _propose_command(self, cmd_line):
         self.delete("input_start", "end")
         self.intercept_insert("input_start", cmd_line)
@@ -1481,9 +1814,13 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
     def _clear_shell(self):
         end_index = self.index("output_end")
         self._clear_content(end_index)
+        self._clear_scrollback()
+        # texts still referred to keep the old spool alive
+        self._squeeze_spool = TextSpool()
 
     def _on_backend_terminated(self, event=None):
         logger.info("BaseShellText._on_backend_terminated")
+        self._close_firehose()
         # make sure dead values are not clickable anymore
         self._invalidate_current_data()
         self.set_read_only(True)
@@ -1580,6 +1917,17 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
         if proposed_cut == "1.0":
             return
 
+        if get_workbench().get_option("shell.virtualized_scrollback"):
+            if not self.is_scrolled_to_end():
+                # keep the lines which the user is looking at
+                view_cut = self.index("@0,0 -%d lines linestart" % SCROLLBACK_PAGE_LINES)
+                if self.compare(view_cut, "<", proposed_cut):
+                    proposed_cut = view_cut
+                if proposed_cut == "1.0":
+                    return
+
+            self._move_to_scrollback(proposed_cut)
+
         # would this keep current block intact?
         next_prompt = self.tag_nextrange("prompt", proposed_cut, "end")
         if not next_prompt:
@@ -1589,6 +1937,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
     def _clear_content(self, cut_idx):
         proposed_cut_float = float(self.index(cut_idx))
+        self._discarded_line_count += int(proposed_cut_float) - 1
         for btn in list(self._squeeze_buttons):
             try:
                 idx = self.index(btn)
@@ -1596,7 +1945,7 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
                     self._squeeze_buttons.remove(btn)
                     # looks like the widgets are not fully GC-d.
                     # At least avoid leaking big chunks of texts
-                    btn.contained_text = None
+                    btn.spooled_text = None
                     btn.destroy()
             except Exception as e:
                 logger.warning("Problem with a squeeze button, removing it", exc_info=e)
@@ -1605,6 +1954,141 @@ class BaseShellText(EnhancedTextWithLogging, SyntaxText):
 
         self.direct_delete("0.1", cut_idx)
 
+    def _move_to_scrollback(self, cut_idx):
+        if self._scrollback is None:
+            self._scrollback = ScrollbackStore(
+                get_workbench().get_option("shell.scrollback_max_lines"),
+                get_workbench().get_option("shell.scrollback_file_backed"),
+            )
+
+        self._scrollback.push_lines(self._dump_lines("1.0", cut_idx))
+
+    def _dump_lines(self, start, end) -> List[Line]:
+        """Returns the content of the range together with the tags"""
+        buttons_by_name = {str(btn): btn for btn in self._squeeze_buttons}
+        lines = []
+        segments = []
+        active_tags = []
+        for key, value, _ in self.dump(start, end, text=True, tag=True, window=True):
+            if key == "tagon":
+                if value != "sel":
+                    active_tags.append(value)
+            elif key == "tagoff":
+                if value in active_tags:
+                    active_tags.remove(value)
+            elif key == "window":
+                btn = buttons_by_name.get(value)
+                if btn is not None:
+                    segments.append(("squeezed", btn.spooled_text, tuple(btn.tags)))
+            elif key == "text":
+                for part in value.splitlines(keepends=True):
+                    segments.append(("text", part, tuple(active_tags)))
+                    if part.endswith("\n"):
+                        lines.append(segments)
+                        segments = []
+
+        if segments:
+            lines.append(segments)
+
+        return lines
+
+    def has_scrollback(self) -> bool:
+        return bool(self._scrollback)
+
+    def request_older_scrollback(self) -> None:
+        if self.has_scrollback() and not self._scrollback_load_scheduled:
+            self._scrollback_load_scheduled = True
+            self.after_idle(self._load_older_scrollback)
+
+    def _load_older_scrollback(self) -> None:
+        self._scrollback_load_scheduled = False
+        view_top = self.index("@0,0")
+        count = self._load_scrollback_lines(SCROLLBACK_PAGE_LINES)
+        if count:
+            # keep the viewport where it was
+            self.yview("%s +%d lines" % (view_top, count))
+
+    def _load_scrollback_lines(self, count) -> int:
+        """Moves newest stored lines back to the beginning of the text"""
+        if not self.has_scrollback():
+            return 0
+
+        lines = self._scrollback.pop_lines(count)
+        io_started_at_top = self.compare("command_io_start", "==", "1.0")
+        self.mark_set("scrollback_insert", "1.0")
+        self.mark_gravity("scrollback_insert", tk.RIGHT)
+        for line in lines:
+            for kind, content, tags in line:
+                if kind == "squeezed":
+                    btn = self._create_squeeze_button(content, set(tags))
+                    self.window_create("scrollback_insert", window=btn)
+                    for tag_name in tags:
+                        self.tag_add(tag_name, "scrollback_insert -1 chars")
+                else:
+                    self.direct_insert("scrollback_insert", content, tags)
+
+        if io_started_at_top:
+            self.mark_set("command_io_start", "scrollback_insert")
+        self.mark_unset("scrollback_insert")
+        self._discarded_line_count -= len(lines)
+        return len(lines)
+
+    def _get_absolute_lineno(self, index) -> int:
+        return int(float(self.index(index))) + self._discarded_line_count
+
+    def start_plotter_data(self, capacity: int) -> None:
+        """Collects the numbers of present and future stdout lines"""
+        self.plotter_data = PlotterData(capacity)
+        end_lineno = int(float(self.index("output_insert")))
+        self._add_plotter_lines(end_lineno - 1)
+
+    def stop_plotter_data(self) -> None:
+        self.plotter_data = None
+
+    def _add_plotter_lines(self, count):
+        """Adds count completed lines before output_insert"""
+        end_lineno = int(float(self.index("output_insert")))
+        start_lineno = max(end_lineno - count, 1)
+        content = self.get("%d.0" % start_lineno, "%d.0" % end_lineno)
+        for lineno, line in enumerate(content.splitlines(), start_lineno):
+            if "stdout" in self.tag_names("%d.0" % lineno):
+                self.plotter_data.add_line(lineno + self._discarded_line_count, line)
+
+    def _clear_scrollback(self) -> None:
+        if self._scrollback is not None:
+            self._scrollback.clear()
+            self._scrollback = None
+
+    def find_in_history(self, pattern: str) -> bool:
+        """Selects the previous occurrence of the pattern, loading stored lines when needed"""
+        if self.tag_ranges("sel"):
+            search_start = self.index("sel.first")
+        else:
+            search_start = self.index("@0,0")
+
+        pos = self.search(pattern, search_start, stopindex="1.0", backwards=True, nocase=True)
+        if not pos and self.has_scrollback():
+            line_index = self._scrollback.rfind(pattern)
+            if line_index is not None:
+                self._load_scrollback_lines(len(self._scrollback) - line_index)
+                pos = self.search(pattern, "2.0", stopindex="1.0", backwards=True, nocase=True)
+
+        if not pos:
+            return False
+
+        self.tag_remove("sel", "1.0", "end")
+        self.tag_add("sel", pos, "%s +%d chars" % (pos, len(pattern)))
+        self.see(pos)
+        return True
+
+    def save_history(self, path: str) -> None:
+        """Saves stored and visible output as plain text"""
+        with open(path, "w", encoding="utf-8") as fp:
+            if self._scrollback is not None:
+                self._scrollback.write_text(fp)
+            for line in self._dump_lines("1.0", "end-1c"):
+                write_line(fp, line)
+
     def _on_mouse_move(self, event=None):
         tags = self.tag_names("@%d,%d" % (event.x, event.y))
         if "value" in tags or "io_hyperlink" in tags or "stacktrace_hyperlink" in tags:
@@ -1840,6 +2324,14 @@ class ShellText(BaseShellText):
         self.tag_bind("stacktrace_hyperlink", "<ButtonRelease-1>", self._handle_hyperlink)
 
         self.bind("<Motion>", self._on_mouse_move, True)
+        # takes precedence over the global Run shortcut
+        self.bind("<Control-r>", self._search_history, True)
+
+        if get_workbench().get_option("shell.save_history"):
+            self._history = ShellHistory(
+                os.path.join(get_thonny_user_dir(), "shell_history.txt"),
+                get_workbench().get_option("shell.history_max_commands"),
+            )
 
         get_workbench().bind("InputRequest", self._handle_input_request, True)
         get_workbench().bind("ProgramOutput", self._handle_program_output, True)
@@ -1849,6 +2341,108 @@ class ShellText(BaseShellText):
         get_workbench().bind(
             "HideTrailingOutput", lambda msg: self._hide_trailing_output(msg.text), True
         )
+        get_workbench().bind("WorkbenchClose", self._on_workbench_close, True)
+
+    def _on_workbench_close(self, event=None):
+        self._close_firehose()
+        for path in self._firehose_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                logger.warning("Could not remove %s", path)
+
+
+class HistorySearchBar(ttk.Frame):
+    """Incremental reverse search in the shell history (like Ctrl+R in bash).
+
+    The matching command is proposed in the shell input while typing. Ctrl+R goes to older
+    matches, Enter keeps the proposed command and Escape restores the original input.
+    """
+
+    def __init__(self, master, shell_text: "ShellText"):
+        super().__init__(master)
+        self._shell_text = shell_text
+        self._history: Optional[ShellHistory] = None
+        self._match_id: Optional[int] = None
+        self._original_input = ""
+        self._active = False
+
+        self._label = ttk.Label(self, text=tr("Search history") + ":")
+        self._label.grid(row=0, column=0, padx=(ems_to_pixels(0.5), 0))
+        self._pattern_var = tk.StringVar(value="")
+        self._entry = ttk.Entry(self, textvariable=self._pattern_var)
+        self._entry.grid(row=0, column=1, sticky="ew", padx=ems_to_pixels(0.5))
+        self.columnconfigure(1, weight=1)
+
+        self._pattern_var.trace_add("write", self._on_pattern_change)
+        self._entry.bind("<Control-r>", self._search_older, True)
+        self._entry.bind("<Return>", self._accept, True)
+        self._entry.bind("<KP_Enter>", self._accept, True)
+        self._entry.bind("<Escape>", self._cancel, True)
+        self._entry.bind("<FocusOut>", self._accept, True)
+
+    def start(self, history: ShellHistory) -> None:
+        if self._active:
+            self._entry.focus_set()
+            return
+
+        self._history = history
+        self._match_id = None
+        self._original_input = self._shell_text.get("input_start", "end-1c")
+        self._pattern_var.set("")
+        self._active = True
+        self.grid(row=2, column=1, columnspan=2, sticky="ew")
+        self._entry.focus_set()
+
+    def _on_pattern_change(self, *args) -> None:
+        if not self._active:
+            return
+
+        pattern = self._pattern_var.get()
+        if pattern:
+            self._show_match(self._history.search(pattern))
+        else:
+            self._match_id = None
+            self._propose(self._original_input)
+
+    def _search_older(self, event=None):
+        if self._match_id is not None:
+            self._show_match(self._history.search(self._pattern_var.get(), self._match_id))
+        return "break"
+
+    def _show_match(self, match_id: Optional[int]) -> None:
+        if match_id is None:
+            self._label.configure(text=tr("No match") + ":")
+            get_workbench().bell()
+            return
+
+        self._label.configure(text=tr("Search history") + ":")
+        self._match_id = match_id
+        self._propose(self._history.get_command(match_id))
+
+    def _propose(self, cmd_line: str) -> None:
+        if get_runner().is_waiting_toplevel_command():
+            self._shell_text._propose_command(cmd_line)
+
+    def _accept(self, event=None):
+        self._close()
+        return "break"
+
+    def _cancel(self, event=None):
+        if self._active:
+            self._propose(self._original_input)
+        self._close()
+        return "break"
+
+    def _close(self) -> None:
+        if not self._active:
+            return
+
+        self._active = False
+        self.grid_remove()
+        self._label.configure(text=tr("Search history") + ":")
+        self._shell_text.focus_set()
+        self._shell_text.mark_set("insert", "end-1c")
 
 
 class SqueezedTextDialog(CommonDialog):
@@ -1857,7 +2451,7 @@ class SqueezedTextDialog(CommonDialog):
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
         self.button = button
-        self.content = button.contained_text
+        self.spooled_text = button.spooled_text
         self.shell_text = master
 
         padding = 20
@@ -1898,9 +2492,23 @@ class SqueezedTextDialog(CommonDialog):
             wrap="none",
         )
         self.text_frame.grid(row=2, column=0, padx=padding, sticky="nsew")
-        self.text_frame.text.insert("1.0", button.contained_text)
+        shown_char_count = 0
+        for chunk in self.spooled_text.iter_chunks():
+            chunk = chunk[: SQUEEZED_TEXT_VIEW_MAX_CHARS - shown_char_count]
+            self.text_frame.text.insert("end", chunk)
+            shown_char_count += len(chunk)
+            if shown_char_count >= SQUEEZED_TEXT_VIEW_MAX_CHARS:
+                break
         self.text_frame.text.set_read_only(True)
 
+        if shown_char_count < len(self.spooled_text):
+            truncation_label = ttk.Label(
+                mainframe,
+                text=tr("Showing first %d characters. Copy or expand to get the whole text.")
+                % shown_char_count,
+            )
+            truncation_label.grid(row=4, column=0, padx=padding, pady=(0, padding), sticky="w")
+
         button_frame = ttk.Frame(mainframe)
         button_frame.grid(row=3, column=0, padx=padding, pady=padding, sticky="nswe")
         button_frame.columnconfigure(2, weight=1)
@@ -1922,7 +2530,7 @@ class SqueezedTextDialog(CommonDialog):
 
         self.bind("<Escape>", self._on_close, True)
         self.protocol("WM_DELETE_WINDOW", self._on_close)
-        self.title(tr("Squeezed text (%d characters)") % len(self.content))
+        self.title(tr("Squeezed text (%d characters)") % len(self.spooled_text))
 
     def _on_wrap_changed(self):
         if self._wrap_var.get():
@@ -1933,22 +2541,67 @@ class SqueezedTextDialog(CommonDialog):
     def _on_expand(self):
         index = self.shell_text.index(self.button)
         self.shell_text.direct_delete(index, index + " +1 chars")
-        self.shell_text.direct_insert(index, self.content, tuple(self.button.tags))
+        self.shell_text.mark_set("squeezed_insert", index)
+        self.shell_text.mark_gravity("squeezed_insert", tk.RIGHT)
+        for chunk in self.spooled_text.iter_chunks():
+            self.shell_text.direct_insert("squeezed_insert", chunk, tuple(self.button.tags))
+        self.shell_text.mark_unset("squeezed_insert")
         self.destroy()
 
         # looks like the widgets are not fully GC-d.
-        # At least avoid leaking big chunks of texts
-        self.button.contained_text = None
+        # At least avoid keeping references to the spool
+        self.button.spooled_text = None
         self.button.destroy()
 
     def _on_copy(self):
         self.clipboard_clear()
-        self.clipboard_append(self.content)
+        for chunk in self.spooled_text.iter_chunks():
+            self.clipboard_append(chunk)
 
     def _on_close(self, event=None):
         self.destroy()
 
 
+class PlotterData:
+    """Numbers of most recent stdout lines, by absolute line number"""
+
+    def __init__(self, capacity):
+        # (line number, pattern, numbers) for lines containing numbers
+        self._lines = collections.deque(maxlen=capacity)
+        self.version = 0
+
+    def add_line(self, lineno, text):
+        pattern, numbers = extract_pattern_and_numbers(text)
+        if numbers:
+            self._lines.append((lineno, pattern, numbers))
+            self.version += 1
+
+    def drop_from(self, lineno):
+        while self._lines and self._lines[-1][0] >= lineno:
+            self._lines.pop()
+            self.version += 1
+
+    def get_lines(self, first_lineno, last_lineno):
+        result = []
+        for line in reversed(self._lines):
+            if line[0] < first_lineno:
+                break
+            elif line[0] <= last_lineno:
+                result.append(line)
+
+        result.reverse()
+        return result
+
+
+def extract_pattern_and_numbers(line):
+    parts = NUMBER_SPLIT_REGEX.split(line)
+    if len(parts) < 2:
+        return ((), [])
+
+    assert len(parts) % 2 == 1
+    return tuple(parts[0::2]), [float(part) for part in parts[1::2]]
+
+
 class PlotterCanvas(tk.Canvas):
     def __init__(self, master, text):
         self.master = master
@@ -1977,6 +2630,10 @@ class PlotterCanvas(tk.Canvas):
         self.x_padding_left = -1  # makes sharper cut for partly hidden line
         self.x_padding_right = self.linespace
         self.fresh_range = True
+        # line items are reused between updates
+        self._segment_item_ids = []
+        self._segment_item_colors = []
+        self._last_update_key = None
 
         self.colors = [
             "#1f77b4",
@@ -2057,22 +2714,33 @@ class PlotterCanvas(tk.Canvas):
         self.fresh_range = True
 
     def get_num_steps(self):
-        return 30
+        return get_workbench().get_option("view.plotter_num_steps")
 
     def update_plot(self, force_clean=False):
-        data_lines = []
-        bottom_index = self.text.index(
+        plotter_data = self.text.plotter_data
+        if plotter_data is None:
+            return
+
+        bottom_lineno = self.text._get_absolute_lineno(
             "@%d,%d" % (self.text.winfo_width(), self.text.winfo_height())
         )
-        bottom_lineno = int(float(bottom_index))
+        update_key = (
+            plotter_data.version,
+            bottom_lineno,
+            self.winfo_width(),
+            self.winfo_height(),
+        )
+        if update_key == self._last_update_key and not force_clean and not self.fresh_range:
+            # nothing to redraw
+            return
+        self._last_update_key = update_key
 
-        for i in range(bottom_lineno - self.get_num_steps(), bottom_lineno + 1):
-            line_start_index = "%d.0" % i
-            if i < 1 or "stdout" not in self.text.tag_names(line_start_index):
-                data_lines.append(([], []))
-            else:
-                content = self.text.get(line_start_index, line_start_index + " lineend")
-                data_lines.append(self.extract_pattern_and_numbers(content))
+        # (position, pattern, numbers) for the lines with numbers
+        first_lineno = bottom_lineno - self.get_num_steps()
+        data_lines = [
+            (lineno - first_lineno, pattern, nums)
+            for lineno, pattern, nums in plotter_data.get_lines(first_lineno, bottom_lineno)
+        ]
 
         # data_lines need to be transposed
         segments_by_color = []
@@ -2083,8 +2751,6 @@ class PlotterCanvas(tk.Canvas):
             else:
                 break
 
-        self.delete("segment")
-
         self.update_range(segments_by_color, force_clean)
         segment_count = self.draw_segments(segments_by_color)
         self.update_legend(data_lines, force_clean)
@@ -2116,9 +2782,11 @@ class PlotterCanvas(tk.Canvas):
         legend = None
         i = len(data_lines) - 2  # one before last
         while i >= 0:
-            legend = data_lines[i][0]
-            if legend and legend == data_lines[i + 1][0]:
+            pos, pattern, _ = data_lines[i]
+            next_pos, next_pattern, _ = data_lines[i + 1]
+            if next_pos == pos + 1 and pattern == next_pattern:
                 # found last legend, which covers at least 2 consecutive points
+                legend = pattern
                 break
             i -= 1
 
@@ -2174,27 +2842,36 @@ class PlotterCanvas(tk.Canvas):
         count = 0
         for color, segments in enumerate(segments_by_color):
             for pos, nums in segments:
-                self.draw_segment(color, pos, nums)
+                self.draw_segment(count, color, pos, nums)
                 count += 1
 
+        # remove the items not needed anymore
+        for item_id in self._segment_item_ids[count:]:
+            self.delete(item_id)
+        del self._segment_item_ids[count:]
+        del self._segment_item_colors[count:]
+
         # raise certain elements above segments
         self.tag_raise("tick")
         self.tag_raise("close")
         return count
 
-    def draw_segment(self, color, pos, nums):
-        x = self.x_padding_left + pos * self.x_scale
+    def draw_segment(self, item_nr, color, pos, nums):
+        fill = self.colors[color % len(self.colors)]
+        coords = self.compute_segment_coords(pos, nums)
 
-        args = []
-        for num in nums:
-            y = self.y_padding + (self.range_end - num) * self.y_scale
-            args.extend([x, y])
-            x += self.x_scale
+        if item_nr < len(self._segment_item_ids):
+            item_id = self._segment_item_ids[item_nr]
+            self.coords(item_id, *coords)
+            if self._segment_item_colors[item_nr] != fill:
+                self.itemconfigure(item_id, fill=fill)
+                self._segment_item_colors[item_nr] = fill
+            return
 
-        self.create_line(
-            *args,
+        item_id = self.create_line(
+            *coords,
             width=2,
-            fill=self.colors[color % len(self.colors)],
+            fill=fill,
             tags=("segment",),
             # arrow may be confusing
             # and doesn't play nice with distinguishing between
@@ -2202,7 +2879,45 @@ class PlotterCanvas(tk.Canvas):
             # arrow="last",
             # arrowshape=(3,5,3)
         )
-        # self.current_segment_ids.append(line_id)
+        self._segment_item_ids.append(item_id)
+        self._segment_item_colors.append(fill)
+
+    def compute_segment_coords(self, pos, nums):
+        x = self.x_padding_left + pos * self.x_scale
+
+        def get_y(num):
+            return self.y_padding + (self.range_end - num) * self.y_scale
+
+        coords = []
+        if self.x_scale >= 1:
+            for num in nums:
+                coords.extend([x, get_y(num)])
+                x += self.x_scale
+            return coords
+
+        # Several values per pixel column. Keep only the smallest and the largest
+        # of each column (in their original order), so that the peaks remain visible.
+        column = None
+        column_nums = []
+        for num in nums + [None]:
+            if num is None or int(x) != column:
+                if column_nums:
+                    low = min(column_nums)
+                    high = max(column_nums)
+                    if column_nums.index(low) > column_nums.index(high):
+                        low, high = high, low
+                    coords.extend([column, get_y(low)])
+                    if high != low:
+                        coords.extend([column, get_y(high)])
+                column = int(x)
+                column_nums = []
+            column_nums.append(num)
+            x += self.x_scale
+
+        if len(coords) < 4:
+            # a line needs at least 2 points
+            coords.extend(coords)
+        return coords
 
     def update_range(self, segments_by_color, clean):
         if not segments_by_color:
@@ -2299,39 +3014,29 @@ class PlotterCanvas(tk.Canvas):
             )
             value += self.range_block_size
 
-    def extract_pattern_and_numbers(self, line):
-        parts = NUMBER_SPLIT_REGEX.split(line)
-        if len(parts) < 2:
-            return ([], [])
-
-        assert len(parts) % 2 == 1
-
-        pattern = []
-        numbers = []
-        for i in range(0, len(parts), 2):
-            pattern.append(parts[i])
-
-        for i in range(1, len(parts), 2):
-            numbers.append(float(parts[i]))
-
-        return (pattern, numbers)
-
     def extract_series_segments(self, data_lines, series_nr):
         """Yields numbers which form connected multilines on graph
         Each segment is pair of starting position and numbers"""
         segment = (0, [])
         prev_pattern = None
-        for i, (pattern, nums) in enumerate(data_lines):
-            if len(nums) <= series_nr or pattern != prev_pattern:
+        prev_pos = None
+        for pos, pattern, nums in data_lines:
+            if (
+                len(nums) <= series_nr
+                or pattern != prev_pattern
+                or prev_pos is None
+                or pos != prev_pos + 1
+            ):
                 # break the segment
                 if len(segment[1]) > 1:
                     yield segment
-                segment = (i, [])
+                segment = (pos, [])
 
             if len(nums) > series_nr:
                 segment[1].append(nums[series_nr])
 
             prev_pattern = pattern
+            prev_pos = pos
 
         if len(segment[1]) > 1:
             yield segment
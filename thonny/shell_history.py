@@ -0,0 +1,150 @@
+"""
+Shell commands remembered across sessions.
+
+The commands are appended to a file, one JSON string per line. The file is read only when
+the history is searched first time, so that keeping a long history doesn't slow down the
+start-up.
+"""
+
+import json
+import os.path
+from logging import getLogger
+from typing import Dict, List, Optional, Set
+
+logger = getLogger(__name__)
+
+# substrings of this length are indexed
+GRAM_LENGTH = 3
+
+
+class ShellHistory:
+    """Commands in the order of their submission, each command occurring once.
+
+    Substring search uses an index from trigrams of the lowercased commands to the ids
+    (positions) of the commands containing them. The index gives the candidates, which
+    are then checked with a plain substring test.
+    """
+
+    def __init__(self, path: str, max_commands: int):
+        self.path = path
+        self._max_commands = max(max_commands, 1)
+        self._loaded = False
+
+        # removed (repeated) commands leave None to keep the ids stable
+        self._commands: List[Optional[str]] = []
+        self._ids_by_command: Dict[str, int] = {}
+        self._ids_by_gram: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._ids_by_command)
+
+    def add(self, command: str) -> None:
+        command = command.rstrip("\n")
+        if not command.strip():
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(command) + "\n")
+        except OSError:
+            logger.exception("Could not save shell history to %s", self.path)
+
+        if self._loaded:
+            self._add_to_index(command)
+            if len(self._commands) > 2 * self._max_commands:
+                self._rebuild()
+
+    def search(self, pattern: str, before_id: Optional[int] = None) -> Optional[int]:
+        """Returns the id of the newest command (older than before_id) containing the pattern.
+        The search ignores case."""
+        self._ensure_loaded()
+        if before_id is None:
+            before_id = len(self._commands)
+
+        pattern = pattern.lower()
+        if len(pattern) < GRAM_LENGTH:
+            # short patterns match too much for the index to help
+            candidates = range(before_id - 1, -1, -1)
+        else:
+            posting_sets = sorted(
+                (self._ids_by_gram.get(gram, set()) for gram in _get_grams(pattern)), key=len
+            )
+            candidates = sorted(
+                (id for id in posting_sets[0] if id < before_id and _all_contain(posting_sets, id)),
+                reverse=True,
+            )
+
+        for id in candidates:
+            command = self._commands[id]
+            if command is not None and pattern in command.lower():
+                return id
+
+        return None
+
+    def get_command(self, id: int) -> str:
+        return self._commands[id]
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+
+        self._loaded = True
+        line_count = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as fp:
+                    for line in fp:
+                        line_count += 1
+                        try:
+                            command = json.loads(line)
+                        except ValueError:
+                            logger.warning("Skipping corrupt shell history line %r", line)
+                            continue
+                        self._add_to_index(command)
+            except OSError:
+                logger.exception("Could not load shell history from %s", self.path)
+
+        if line_count > 2 * self._max_commands or len(self._ids_by_command) < line_count / 2:
+            self._rebuild()
+            self._save()
+
+    def _add_to_index(self, command: str) -> None:
+        old_id = self._ids_by_command.get(command)
+        if old_id is not None:
+            self._commands[old_id] = None
+            for gram in _get_grams(command.lower()):
+                self._ids_by_gram[gram].discard(old_id)
+
+        id = len(self._commands)
+        self._commands.append(command)
+        self._ids_by_command[command] = id
+        for gram in _get_grams(command.lower()):
+            self._ids_by_gram.setdefault(gram, set()).add(id)
+
+    def _rebuild(self) -> None:
+        """Drops the oldest commands and the gaps left by repeated commands"""
+        commands = [command for command in self._commands if command is not None]
+        self._commands = []
+        self._ids_by_command = {}
+        self._ids_by_gram = {}
+        for command in commands[-self._max_commands :]:
+            self._add_to_index(command)
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as fp:
+                for command in self._commands:
+                    fp.write(json.dumps(command) + "\n")
+        except OSError:
+            logger.exception("Could not save shell history to %s", self.path)
+
+
+def _get_grams(text: str) -> Set[str]:
+    return {text[i : i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+
+
+def _all_contain(sets: List[Set[int]], item: int) -> bool:
+    return all(item in s for s in sets)
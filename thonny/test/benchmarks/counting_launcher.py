@@ -0,0 +1,86 @@
+"""
+Starts the back-end like cp_launcher.py does, but counts the events handled by the tracers.
+
+The count gets written to the file given in THONNY_BENCHMARK_EVENT_COUNT_FILE after each
+executed program. Counting slows the tracers down a bit, so run_benchmarks.py measures
+the times in separate runs.
+"""
+
+import os.path
+import runpy
+import sys
+
+TRACER_ENTRY_POINTS = {
+    "FastTracer": ["_trace"],
+    "MonitoringFastTracer": [
+        "_on_py_start",
+        "_on_py_return",
+        "_on_py_unwind",
+        "_on_line",
+        "_on_raise",
+    ],
+    "NiceTracer": [
+        "_trace",
+        "_thonny_hidden_before_stmt",
+        "_thonny_hidden_after_stmt",
+        "_thonny_hidden_before_expr",
+        "_thonny_hidden_after_expr",
+    ],
+}
+
+
+def install_counters(count_file):
+    from thonny.plugins.cpython_backend import cp_back, cp_tracers
+
+    counter = [0]
+
+    def wrap_entry_point(method):
+        def counting_method(self, *args):
+            counter[0] += 1
+            return method(self, *args)
+
+        return counting_method
+
+    for class_name, method_names in TRACER_ENTRY_POINTS.items():
+        cls = getattr(cp_tracers, class_name)
+        for name in method_names:
+            # wrap only the methods defined in this class, inherited ones are wrapped already
+            if name in cls.__dict__:
+                setattr(cls, name, wrap_entry_point(cls.__dict__[name]))
+
+    original_execute_file = cp_back.MainCPythonBackend._execute_file
+
+    def execute_file(self, cmd, executor_class):
+        counter[0] = 0
+        try:
+            return original_execute_file(self, cmd, executor_class)
+        finally:
+            with open(count_file, "w", encoding="utf-8") as fp:
+                fp.write(str(counter[0]))
+
+    cp_back.MainCPythonBackend._execute_file = execute_file
+
+
+def main():
+    launcher_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        "plugins",
+        "cpython_backend",
+        "cp_launcher.py",
+    )
+
+    thonny_container = os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.dirname(launcher_path)))
+    )
+    sys.path.insert(0, thonny_container)
+    install_counters(os.environ["THONNY_BENCHMARK_EVENT_COUNT_FILE"])
+    # the launcher adds it again when needed
+    sys.path.remove(thonny_container)
+
+    # launcher expects its arguments at the same positions
+    sys.argv = [launcher_path] + sys.argv[1:]
+    runpy.run_path(launcher_path, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Measures how much the executors of the CPython back-end slow down standard workloads.
+
+The back-end is driven directly over its stdin/stdout protocol, without the GUI. Each
+workload is run in a fresh back-end process under each executor. The results (wall time,
+events handled by the tracer, messages received from the back-end and peak RSS of the
+back-end process) are written as JSON.
+
+    python -m thonny.test.benchmarks.run_benchmarks --output results.json
+    python -m thonny.test.benchmarks.run_benchmarks --compare old_results.json
+
+The back-end must be run with a supported interpreter, see --python.
+"""
+
+import argparse
+import datetime
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import thonny
+from thonny.common import (
+    PROCESS_ACK,
+    DebuggerCommand,
+    DebuggerResponse,
+    InlineResponse,
+    ToplevelCommand,
+    ToplevelResponse,
+    parse_message,
+    read_one_incoming_message_str,
+    serialize_message,
+)
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKLOADS_DIR = os.path.join(BENCHMARKS_DIR, "workloads")
+LAUNCHER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(BENCHMARKS_DIR)), "plugins", "cpython_backend", "cp_launcher.py"
+)
+COUNTING_LAUNCHER_PATH = os.path.join(BENCHMARKS_DIR, "counting_launcher.py")
+
+WORKLOADS = ["recursion", "tight_loop", "heavy_imports", "big_data"]
+
+# name -> (command name, extra command attributes)
+EXECUTORS = {
+    "run": ("Run", {}),
+    "fast_debug_monitoring": ("FastDebug", {"tracer_engine": "monitoring"}),
+    "fast_debug_settrace": ("FastDebug", {"tracer_engine": "settrace"}),
+    "nice_debug": ("Debug", {}),
+}
+
+DEFAULT_TIMEOUT = 600
+DEFAULT_REPEATS = 3
+
+
+class BackendSession:
+    """A back-end process which runs one program"""
+
+    def __init__(self, python: str, launcher: str, env: Dict[str, str]):
+        self._proc = subprocess.Popen(
+            [python, "-u", "-B", launcher, WORKLOADS_DIR, repr({})],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            encoding="utf-8",
+            env=env,
+        )
+        self.message_count = 0
+
+        ack = self._proc.stdout.readline().strip()
+        if ack != PROCESS_ACK:
+            raise RuntimeError(
+                "Back-end did not start: %s%s" % (ack, self._proc.stderr.read().strip())
+            )
+
+    def send(self, msg) -> None:
+        self._proc.stdin.write(serialize_message(msg) + "\n")
+        self._proc.stdin.flush()
+
+    def receive(self):
+        msg_str = read_one_incoming_message_str(self._proc.stdout.readline)
+        if msg_str == "":
+            raise RuntimeError("Back-end exited: " + self._proc.stderr.read().strip())
+
+        self.message_count += 1
+        return parse_message(msg_str)
+
+    def receive_toplevel_response(self) -> ToplevelResponse:
+        while True:
+            msg = self.receive()
+            if isinstance(msg, ToplevelResponse):
+                return msg
+            elif isinstance(msg, DebuggerResponse):
+                # Same information which the front-end would send. Without breakpoints
+                # the debuggers stop at the first line, resume runs to the end.
+                frame = msg.stack[-1]
+                self.send(
+                    DebuggerCommand(
+                        "resume",
+                        frame_id=frame.id,
+                        breakpoints={},
+                        breakpoint_options={},
+                        state=frame.event,
+                        focus=frame.focus,
+                        allow_stepping_into_libraries=False,
+                    )
+                )
+            elif isinstance(msg, InlineResponse) and msg.get("error"):
+                raise RuntimeError(msg["error"])
+
+    def get_peak_rss(self) -> Optional[int]:
+        """Peak resident set size in bytes (available only on Linux)"""
+        try:
+            with open("/proc/%d/status" % self._proc.pid, encoding="ascii") as fp:
+                for line in fp:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+
+        return None
+
+    def kill(self) -> None:
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        for stream in [self._proc.stdin, self._proc.stdout, self._proc.stderr]:
+            stream.close()
+
+
+def run_workload(
+    python: str, workload: str, executor: str, scale: int, count_events: bool, timeout: float
+) -> Dict[str, Any]:
+    command_name, extra_attributes = EXECUTORS[executor]
+    env = os.environ.copy()
+    env["THONNY_FRONTEND_SYS_PATH"] = repr(sys.path)
+    event_count_file = None
+    if count_events:
+        fd, event_count_file = tempfile.mkstemp(suffix=".txt", prefix="thonny_events_")
+        os.close(fd)
+        env["THONNY_BENCHMARK_EVENT_COUNT_FILE"] = event_count_file
+        launcher = COUNTING_LAUNCHER_PATH
+    else:
+        launcher = LAUNCHER_PATH
+
+    session = BackendSession(python, launcher, env)
+    timer = threading.Timer(timeout, session.kill)
+    timer.start()
+    try:
+        session.send(ToplevelCommand("get_environment_info"))
+        session.receive_toplevel_response()
+        session.message_count = 0
+
+        cmd = ToplevelCommand(
+            command_name,
+            args=[os.path.join(WORKLOADS_DIR, workload + ".py"), str(scale)],
+            **extra_attributes,
+        )
+        if command_name != "Run":
+            cmd["breakpoints"] = {}
+            cmd["breakpoint_options"] = {}
+
+        start_time = time.perf_counter()
+        session.send(cmd)
+        response = session.receive_toplevel_response()
+        wall_time = time.perf_counter() - start_time
+
+        result = {
+            "wall_time": wall_time,
+            "messages_received": session.message_count,
+            "peak_rss": session.get_peak_rss(),
+        }
+        if response.get("user_exception"):
+            result["error"] = "%(type_name)s: %(message)s" % response["user_exception"]
+        if event_count_file is not None:
+            with open(event_count_file, encoding="utf-8") as fp:
+                content = fp.read()
+            result["events_traced"] = int(content) if content else None
+
+        return result
+    finally:
+        timer.cancel()
+        session.kill()
+        if event_count_file is not None:
+            os.remove(event_count_file)
+
+
+def run_benchmarks(
+    python: str,
+    workloads: List[str],
+    executors: List[str],
+    scale: int,
+    repeats: int,
+    count_events: bool,
+    timeout: float,
+) -> Dict[str, Any]:
+    results = []
+    for workload in workloads:
+        for executor in executors:
+            print("Running %s under %s" % (workload, executor), file=sys.stderr)
+            result = {"workload": workload, "executor": executor}
+            try:
+                # the best time is the least disturbed by the rest of the system
+                result.update(
+                    min(
+                        (
+                            run_workload(python, workload, executor, scale, False, timeout)
+                            for _ in range(repeats)
+                        ),
+                        key=lambda r: r["wall_time"],
+                    )
+                )
+                if count_events and EXECUTORS[executor][0] != "Run":
+                    # separate run, because counting would distort the times
+                    counting_result = run_workload(python, workload, executor, scale, True, timeout)
+                    result["events_traced"] = counting_result["events_traced"]
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+
+    return {
+        "thonny_version": thonny.get_version(),
+        "python": python,
+        "python_version": subprocess.check_output(
+            [python, "-c", "import sys; print(sys.version.split()[0])"], universal_newlines=True
+        ).strip(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "scale": scale,
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def print_comparison(old_report: Dict[str, Any], new_report: Dict[str, Any]) -> None:
+    old_results = {(r["workload"], r["executor"]): r for r in old_report["results"]}
+    print(
+        "%-15s %-22s %10s %10s %8s" % ("workload", "executor", "old time", "new time", "change"),
+        file=sys.stderr,
+    )
+    for result in new_report["results"]:
+        old_result = old_results.get((result["workload"], result["executor"]))
+        if old_result is None or not old_result.get("wall_time") or not result.get("wall_time"):
+            continue
+
+        print(
+            "%-15s %-22s %10.3f %10.3f %+7.1f%%"
+            % (
+                result["workload"],
+                result["executor"],
+                old_result["wall_time"],
+                result["wall_time"],
+                (result["wall_time"] / old_result["wall_time"] - 1) * 100,
+            ),
+            file=sys.stderr,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--python", default=sys.executable, help="interpreter for the back-end (default: current)"
+    )
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--executors", nargs="+", choices=list(EXECUTORS), default=list(EXECUTORS))
+    parser.add_argument("--scale", type=int, default=1, help="size multiplier for the workloads")
+    parser.add_argument(
+        "--repeats", type=int, default=DEFAULT_REPEATS, help="timed runs per workload and executor"
+    )
+    parser.add_argument(
+        "--no-event-counts",
+        action="store_true",
+        help="skip the extra runs which count the events handled by the tracers",
+    )
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per run")
+    parser.add_argument("--output", help="file for the JSON report (default: stdout)")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.python,
+        args.workloads,
+        args.executors,
+        args.scale,
+        args.repeats,
+        not args.no_event_counts,
+        args.timeout,
+    )
+
+    report_str = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            fp.write(report_str + "\n")
+    else:
+        print(report_str)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp:
+            print_comparison(json.load(fp), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+# Big values in the namespace: stresses exporting of variables
+import sys
+
+scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+numbers = list(range(200_000 * scale))
+words = {"word%d" % i: i for i in range(50_000 * scale)}
+nested = [[i, str(i), (i, i)] for i in range(10_000 * scale)]
+text = "lorem ipsum " * (100_000 * scale)
+numbers.sort(reverse=True)
+total = sum(words.values())
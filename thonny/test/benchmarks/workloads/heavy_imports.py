@@ -0,0 +1,24 @@
+# Lots of library code: stresses skipping of uninteresting frames.
+# The imports are done once, scale only repeats the work done with the modules.
+import sys
+
+import argparse
+import asyncio
+import csv
+import dataclasses
+import decimal
+import email.message
+import http.client
+import json
+import logging
+import unittest
+import urllib.parse
+import xml.dom.minidom
+
+scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+for i in range(10 * scale):
+    data = json.loads(json.dumps({"numbers": list(range(50)), "text": "x" * i}))
+    urllib.parse.urlencode({"a": i, "b": data["text"]})
+    decimal.Decimal(i) / decimal.Decimal(7)
+    xml.dom.minidom.parseString("<root><child>%d</child></root>" % i).toxml()
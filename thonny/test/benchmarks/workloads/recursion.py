@@ -0,0 +1,14 @@
+# Many short calls: stresses call/return events and stack exports
+import sys
+
+scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+
+for _ in range(scale):
+    fib(16)
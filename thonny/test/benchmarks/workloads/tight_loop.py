@@ -0,0 +1,11 @@
+# Few frames, many lines: stresses line events
+import sys
+
+scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+total = 0
+for i in range(20_000 * scale):
+    if i % 3:
+        total += i
+    else:
+        total -= 1
@@ -0,0 +1,274 @@
+import os.path
+import sys
+
+import pytest
+
+from thonny.common import DebuggerCommand, DebuggerResponse, TextRange, ToplevelCommand
+from thonny.plugins.cpython_backend import cp_tracers
+from thonny.plugins.cpython_backend.cp_tracers import (
+    CachedNode,
+    FastTracer,
+    FrameSnapshot,
+    MonitoringFastTracer,
+    NiceTracer,
+    StateHistory,
+    TempFrameInfo,
+)
+
+
+class FakeFrame:
+    pass
+
+
+def describe_frame(system_frame):
+    return FrameSnapshot(
+        id=id(system_frame),
+        filename="prog.py",
+        module_name="__main__",
+        code_name="<module>",
+        freevars=(),
+        source="x = 0\n" * 1000,
+        lineno=1,
+        firstlineno=1,
+        in_library=False,
+    )
+
+
+def create_state(system_frame, i):
+    tframe = TempFrameInfo(
+        system_frame=system_frame,
+        frame_id=id(system_frame),
+        filename="prog.py",
+        locals=None,
+        globals={"x": repr(i // 3), "y": "'constant'"},
+        event="before_statement",
+        focus=TextRange(1, 0, 1, 5),
+        node_tags=set(),
+        current_statement=TextRange(1, 0, 1, 5),
+        current_root_expression=None,
+        current_evaluations=[],
+    )
+    return {
+        "stack": [tframe],
+        "active_frame_overrides": {},
+        "io_symbol_count": i,
+        "exception_value": None,
+        "fresh_exception_id": None,
+        "exception_info": None,
+    }
+
+
+def test_spilled_states_are_restored_and_share_snapshots():
+    frame = FakeFrame()
+    history = StateHistory(10, describe_frame, spill_batch_size=5)
+    for i in range(100):
+        history.append(create_state(frame, i))
+
+    assert len(history) == 100
+    assert history.first_index == 0
+    assert len(history._live_states) < 20
+
+    for i in [0, 4, 5, 42, 99, 3]:
+        state = history[i]
+        assert state["io_symbol_count"] == i
+        assert state["stack"][0].globals == {"x": repr(i // 3), "y": "'constant'"}
+
+    # the snapshot (and the source in it) is neither pickled nor repeated
+    assert len(history._spill_segments) == 1
+    snapshots = history._spill_segments[0].snapshots
+    assert len(snapshots) == 1
+    assert history[0]["stack"][0].system_frame is snapshots[0]
+    assert history[42]["stack"][0].system_frame is snapshots[0]
+    history.close()
+
+
+def test_oldest_states_are_dropped_with_oldest_segment():
+    frame = FakeFrame()
+    history = StateHistory(
+        10, describe_frame, spill_batch_size=5, spill_segment_size=1, max_spill_segments=3
+    )
+    for i in range(100):
+        history.append(create_state(frame, i))
+
+    assert len(history) == 100
+    assert len(history._spill_segments) == 3
+    assert history.first_index > 0
+    assert history[history.first_index]["io_symbol_count"] == history.first_index
+    assert history[99]["io_symbol_count"] == 99
+    try:
+        history[history.first_index - 1]
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("Dropped state should not be available")
+    history.close()
+
+
+def test_snapshots_are_dropped_with_oldest_segment():
+    history = StateHistory(
+        10, describe_frame, spill_batch_size=5, spill_segment_size=1, max_spill_segments=3
+    )
+
+    def count_snapshots():
+        return sum(len(segment.snapshots) for segment in history._spill_segments)
+
+    # each state comes from a different frame, so each spilled batch adds new snapshots
+    for i in range(50):
+        history.append(create_state(FakeFrame(), i))
+    count_after_50 = count_snapshots()
+
+    for i in range(50, 500):
+        history.append(create_state(FakeFrame(), i))
+
+    assert len(history._spill_segments) == 3
+    assert count_snapshots() <= count_after_50
+    assert count_snapshots() <= 3 * 5
+    state = history[history.first_index]
+    assert state["stack"][0].system_frame in history._spill_segments[0].snapshots
+    history.close()
+
+
+STEP_OVER_PROGRAM = """def f():
+    a = 1
+    return a
+
+def g():
+    f()
+    f()
+
+g()
+"""
+
+
+class FakeFrameInfo:
+    def __init__(self, frame):
+        self.id = id(frame)
+        self.code_name = frame.f_code.co_name
+        self.lineno = frame.f_lineno
+
+
+class FakeBackend:
+    """Records where the tracer stops and answers with scripted commands"""
+
+    def __init__(self, command_names, breakpoints):
+        self.command_names = list(command_names)
+        self.breakpoints = breakpoints
+        self.stops = []
+        self.last_stack = None
+
+    def is_doing_io(self):
+        return False
+
+    def _export_stack(self, frame, is_interesting_frame):
+        stack = []
+        while frame is not None:
+            if is_interesting_frame(frame):
+                stack.insert(0, FakeFrameInfo(frame))
+            frame = frame.f_back
+        return stack
+
+    def send_message(self, msg):
+        if isinstance(msg, DebuggerResponse):
+            self.last_stack = msg.stack
+            self.stops.append((msg.stack[-1].code_name, msg.stack[-1].lineno))
+
+    def _fetch_next_incoming_message(self):
+        return DebuggerCommand(
+            self.command_names.pop(0) if self.command_names else "resume",
+            state=None,
+            focus=None,
+            frame_id=self.last_stack[-1].id,
+            exception=None,
+            breakpoints=self.breakpoints,
+            breakpoint_options={},
+        )
+
+
+def run_fast_tracer(tracer_class, tmp_path, source, breakpoints, command_names):
+    path = os.path.join(str(tmp_path), "prog.py")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(source)
+
+    breakpoints = {path: breakpoints}
+    backend = FakeBackend(command_names, breakpoints)
+    tracer = tracer_class(backend, ToplevelCommand("FastDebug", breakpoints=breakpoints))
+    tracer._main_module_path = path
+    code = compile(source, path, "exec")
+    tracer._start_tracing()
+    try:
+        exec(code, {"__name__": "__main__"})
+    finally:
+        tracer._stop_tracing()
+
+    return backend.stops
+
+
+FAST_TRACER_CLASSES = [FastTracer]
+if hasattr(sys, "monitoring"):
+    FAST_TRACER_CLASSES.append(MonitoringFastTracer)
+
+
+@pytest.mark.parametrize("tracer_class", FAST_TRACER_CLASSES)
+def test_step_over_from_last_line_of_callee_stops_in_caller(tracer_class, tmp_path):
+    stops = run_fast_tracer(tracer_class, tmp_path, STEP_OVER_PROGRAM, {3}, ["step_over"])
+    assert stops == [("f", 3), ("g", 7), ("f", 3)]
+
+
+@pytest.mark.parametrize("tracer_class", FAST_TRACER_CLASSES)
+def test_step_out_stops_in_caller(tracer_class, tmp_path):
+    stops = run_fast_tracer(tracer_class, tmp_path, STEP_OVER_PROGRAM, {2}, ["step_out"])
+    assert stops == [("f", 2), ("g", 7), ("f", 2)]
+
+
+CACHED_PROGRAM = """def f(x):
+    return x * 2
+
+print(f(21))
+"""
+
+
+def compile_with_nice_tracer(source, filename):
+    tracer = NiceTracer(FakeBackend([], {}), ToplevelCommand("Debug", breakpoints={}))
+    try:
+        code = tracer._compile_source(source, filename, [])
+    finally:
+        tracer._saved_states.close()
+
+    # nodes come from the cache only when the source didn't get instrumented
+    from_cache = all(isinstance(node, CachedNode) for node in tracer._nodes.values())
+    nodes = {
+        node_id: (node.lineno, node.col_offset, node.end_lineno, node.end_col_offset, node.tags)
+        for node_id, node in tracer._nodes.items()
+    }
+    return code, nodes, from_cache
+
+
+def test_instrumented_code_gets_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(cp_tracers, "INSTRUMENTED_CODE_CACHE_DIR", str(tmp_path / "cache"))
+    filename = str(tmp_path / "prog.py")
+
+    code, nodes, from_cache = compile_with_nice_tracer(CACHED_PROGRAM, filename)
+    assert not from_cache
+    assert nodes
+
+    cached_code, cached_nodes, from_cache = compile_with_nice_tracer(CACHED_PROGRAM, filename)
+    assert from_cache
+    assert cached_code == code
+    assert cached_nodes == nodes
+
+
+def test_instrumented_code_cache_is_invalidated(tmp_path, monkeypatch):
+    monkeypatch.setattr(cp_tracers, "INSTRUMENTED_CODE_CACHE_DIR", str(tmp_path / "cache"))
+    filename = str(tmp_path / "prog.py")
+    compile_with_nice_tracer(CACHED_PROGRAM, filename)
+
+    changed_source = CACHED_PROGRAM.replace("21", "22")
+    assert not compile_with_nice_tracer(changed_source, filename)[2]
+    assert compile_with_nice_tracer(changed_source, filename)[2]
+
+    assert not compile_with_nice_tracer(CACHED_PROGRAM, str(tmp_path / "other.py"))[2]
+
+    monkeypatch.setattr(
+        cp_tracers, "INSTRUMENTATION_VERSION", cp_tracers.INSTRUMENTATION_VERSION + 1
+    )
+    assert not compile_with_nice_tracer(changed_source, filename)[2]
@@ -0,0 +1,36 @@
+from thonny.ansi import CONTROL, TEXT, AnsiSplitter
+
+
+def test_splits_text_and_control_sequences():
+    splitter = AnsiSplitter()
+    assert splitter.feed("a\x1b[31mred\x1b[0m\rb\x1b]0;title\a") == [
+        (TEXT, "a"),
+        (CONTROL, "\x1b[31m"),
+        (TEXT, "red"),
+        (CONTROL, "\x1b[0m"),
+        (CONTROL, "\r"),
+        (TEXT, "b"),
+        (CONTROL, "\x1b]0;title\a"),
+    ]
+    assert not splitter.has_pending()
+
+
+def test_completes_sequence_from_next_chunk():
+    splitter = AnsiSplitter()
+    assert splitter.feed("red\x1b[3") == [(TEXT, "red")]
+    assert splitter.has_pending()
+    assert splitter.feed("1mtext") == [(CONTROL, "\x1b[31m"), (TEXT, "text")]
+
+    assert splitter.feed("\x1b") == []
+    assert splitter.feed("]2;title\x1b") == []
+    assert splitter.feed("\\") == [(CONTROL, "\x1b]2;title\x1b\\")]
+
+
+def test_flush_gives_up_incomplete_sequence():
+    splitter = AnsiSplitter()
+    assert splitter.feed("a\x1b]title") == [(TEXT, "a")]
+    assert splitter.flush() == [(TEXT, "\x1b]title")]
+    assert not splitter.has_pending()
+
+    # unknown escapes and broken sequences stay in the text
+    assert splitter.feed("\x1b(B\x1b]x\ny") == [(TEXT, "\x1b(B\x1b]x\ny")]
@@ -31,3 +31,86 @@ def test_path_startswith():
         assert path_startswith("c:\\foo\\bar.txt/kala\\pala", "C:\\")
 
         assert not path_startswith("C:\\kalapala\\pala", "C:\\kala")
+
+
+def test_framed_message_roundtrip():
+    from thonny.common import (
+        WIRE_CODEC_FRAMED,
+        FrameInfo,
+        InlineResponse,
+        TextRange,
+        ToplevelResponse,
+        ValueInfo,
+        parse_message,
+        read_one_incoming_message_str,
+        serialize_message,
+    )
+
+    frame = FrameInfo(
+        id=1,
+        filename="/tmp/a.py",
+        module_name="__main__",
+        code_name="<module>",
+        source="x = 1\n",
+        lineno=1,
+        firstlineno=1,
+        in_library=False,
+        locals=None,
+        globals={"x": ValueInfo(2, "1")},
+        freevars=(),
+        event="line",
+        focus=TextRange(1, 0, 2, 0),
+        node_tags=None,
+        current_statement=None,
+        current_root_expression=None,
+        current_evaluations=[(TextRange(1, 4, 1, 5), "1")],
+    )
+    msg = ToplevelResponse(
+        command_name="Run",
+        stack=[frame],
+        heap={12: ValueInfo(12, "[1, 2]")},
+        data=b"\x00\xff",
+        names={"a", "b"},
+        text="Tere\nõ\x02\x01",
+        ratio=float("inf"),
+        nested=InlineResponse("get_heap", heap={}),
+    )
+
+    line = serialize_message(msg, codec=WIRE_CODEC_FRAMED)
+    assert line.startswith("\x01")
+    assert "\n" not in line
+    assert line.isascii()
+
+    lines = iter([line + "\n"])
+    parsed = parse_message(read_one_incoming_message_str(lambda: next(lines)))
+    assert type(parsed) is ToplevelResponse
+    assert repr(parsed) == repr(msg)
+    assert type(parsed.stack[0]) is FrameInfo
+    assert type(parsed.stack[0].focus) is TextRange
+    assert type(parsed.nested) is InlineResponse
+
+    # legacy codec must understand the same values
+    assert repr(parse_message(serialize_message(msg))) == repr(msg)
+
+
+def test_framed_message_falls_back_to_repr():
+    from thonny.common import (
+        MESSAGE_MARKER,
+        WIRE_CODEC_FRAMED,
+        BackendEvent,
+        parse_message,
+        serialize_message,
+    )
+
+    msg = BackendEvent("ProgramOutput", data=complex(1, 2))
+    line = serialize_message(msg, codec=WIRE_CODEC_FRAMED)
+    assert line.startswith(MESSAGE_MARKER)
+
+    msg = BackendEvent("ProgramOutput", data="abc")
+    line = serialize_message(msg, codec=WIRE_CODEC_FRAMED)
+    try:
+        parse_message(line[:-1])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Truncated frame should be rejected")
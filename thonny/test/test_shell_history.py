@@ -0,0 +1,35 @@
+import os.path
+
+from thonny.shell_history import ShellHistory
+
+
+def test_search_finds_newest_matches_first(tmp_path):
+    path = os.path.join(str(tmp_path), "history.txt")
+    history = ShellHistory(path, 100)
+    for command in ["print('Hello')", "x = 1", "for i in range(3):\n    print(i)\n", "X = 2"]:
+        history.add(command)
+    history.add("print('Hello')")
+
+    id = history.search("PRINT")
+    assert history.get_command(id) == "print('Hello')"
+    id = history.search("print", id)
+    assert history.get_command(id) == "for i in range(3):\n    print(i)"
+    assert history.search("print", id) is None
+
+    assert history.get_command(history.search("x")) == "X = 2"
+    assert history.search("while") is None
+
+
+def test_history_is_loaded_lazily_and_limited(tmp_path):
+    path = os.path.join(str(tmp_path), "history.txt")
+    history = ShellHistory(path, 3)
+    for i in range(10):
+        history.add("command %d" % i)
+    history.add("command 1")
+
+    history = ShellHistory(path, 3)
+    assert not history._loaded
+    assert len(history) == 3
+    assert history.get_command(history.search("command")) == "command 1"
+    with open(path, encoding="utf-8") as fp:
+        assert len(fp.readlines()) == 3